@@ -0,0 +1,65 @@
+from osl_package import parse, resolve, fold, e, count_nodes
+import contextlib
+import os
+import time
+import sys
+import tracemalloc
+from colorama import Fore, Style
+
+# Memory per AST node and the time of every stage of the pipeline (parse,
+# resolve, fold, e) on a generated program of a few megabytes.
+# python3 bench_ast.py [megabytes]
+
+CHUNK = """
+fn F{k}(x, s) {{
+    if (x = 10) return s;
+    if (x % 3 = 0 || x % 5 = 0)
+        return F{k}(x + 1, s + x);
+    return F{k}(x + 1, s);
+}}
+var y{k} := F{k}(0, {k});
+print(y{k} * 2 - ({k} + 1) * 3);
+"""
+
+def source(megabytes):
+    chunks, size, k = [], 0, 0
+    while size < megabytes * 1e6:
+        chunks.append(CHUNK.format(k=k))
+        size += len(chunks[-1])
+        k += 1
+    return "".join(chunks)
+
+def bytes_per_node(f, *args):
+    tracemalloc.start()
+    tree = f(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / count_nodes(tree)
+
+def timed(f, *args):
+    start_time = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start_time
+
+if __name__ == "__main__":
+    sys.setrecursionlimit(100000)
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    src = source(megabytes)
+    tree = parse(src)
+    print(f"{len(src) / 1e6:.1f} MB, {count_nodes(tree)} nodes, "
+          f"{Fore.CYAN}{bytes_per_node(parse, src):.0f} bytes/node{Style.RESET_ALL} parsed, "
+          f"{Fore.CYAN}{bytes_per_node(resolve, tree):.0f} bytes/node{Style.RESET_ALL} resolved")
+
+    total = 0
+    tree, t = timed(parse, src)
+    print(f"{'parse':>8}: {t:.3f} s")
+    total += t
+    for stage in (resolve, fold):
+        tree, t = timed(stage, tree)
+        print(f"{stage.__name__:>8}: {t:.3f} s")
+        total += t
+    with open(os.devnull, "w") as out, contextlib.redirect_stdout(out):
+        _, t = timed(e, tree)
+    print(f"{'e':>8}: {t:.3f} s")
+    total += t
+    print(f"{'total':>8}: {Fore.CYAN}{total:.3f} s{Style.RESET_ALL}")
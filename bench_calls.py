@@ -0,0 +1,33 @@
+from osl_package import e, resolve, parse
+import time
+import sys
+from colorama import Fore, Style
+
+sys.setrecursionlimit(100000000)
+
+# Cost of a call as the number of live global bindings grows: a closure only
+# copies the variables it uses, so the time per call should stay flat.
+
+CALLS = 2000
+
+def program(n_globals, calls):
+    decls = "".join(f"var g{k} := {k};\n" for k in range(n_globals))
+    return decls + f"""
+fn F(n) {{
+    if (n = 0) return 0;
+    return F(n - 1);
+}}
+F({calls});
+"""
+
+def run(n_globals, calls):
+    ast = resolve(parse(program(n_globals, calls)))
+    start_time = time.time()
+    result = e(ast)
+    assert result == 0
+    return time.time() - start_time
+
+for n_globals in [0, 10, 100, 1000, 10000]:
+    # the declarations themselves are timed by the zero-call run and subtracted
+    t1 = run(n_globals, CALLS) - run(n_globals, 0)
+    print(f"{n_globals:>6} globals: {Fore.CYAN}{t1 / CALLS * 1e6:10.2f} us/call{Style.RESET_ALL}")
@@ -0,0 +1,41 @@
+from osl_package import e, resolve, parse
+import time
+import sys
+from colorama import Fore, Style
+
+# resolve() and e() on generated programs far deeper than the Python stack.
+# The parser still recurses on nesting, so parsing gets a raised limit and the
+# passes run under the default one.
+# python3 bench_deep.py [size]
+
+def programs(n):
+    yield "expression", " + ".join(["1"] * n) + ";", n
+    yield "right-nested ^", " ^ ".join(["1"] * n) + ";", 1
+    yield "nested negation", "- " * (n - n % 2) + "1;", 1
+    yield "nested blocks", "{ " * (n // 10) + "var x := 1; x;" + " }" * (n // 10), 1
+    yield "nested ifs", "if (1) " * (n // 10) + "2;", 2
+    yield "non-tail recursion", f"""
+fn depth(n) {{
+    if (n = 0) return 0;
+    return 1 + depth(n - 1);
+}}
+depth({n // 10});
+""", n // 10
+
+def timed(f, *args):
+    start_time = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start_time
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    limit = sys.getrecursionlimit()
+    for label, src, expected in programs(n):
+        sys.setrecursionlimit(10 * n)
+        tree = parse(src)
+        sys.setrecursionlimit(limit)
+        resolved, t_resolve = timed(resolve, tree)
+        result, t_eval = timed(e, resolved)
+        assert result == expected, (label, result)
+        print(f"{label:>20}: resolve {Fore.CYAN}{t_resolve:.3f} s{Style.RESET_ALL}, "
+              f"e {Fore.CYAN}{t_eval:.3f} s{Style.RESET_ALL}")
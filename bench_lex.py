@@ -0,0 +1,43 @@
+from osl_package import lex
+from collections import deque
+import time
+import sys
+from colorama import Fore, Style
+
+# Lexer throughput on generated sources of a few megabytes.
+# python3 bench_lex.py [megabytes]
+
+CHUNK = """
+// Euler problem {k}
+fn F{k}(x, s) {{
+    if (x = 1000) return s;
+    if (x % 3 = 0 || x % 5 = 0)
+        return F{k}(x + 1, s + x);
+    return F{k}(x + 1.5, s);
+}}
+var msg{k} := "{text}";
+print(F{k}(0, 0) <= √(16) && msg{k} != 0);
+"""
+
+def source(megabytes, string_length=0):
+    text = "ab\\n" * (string_length // 4)
+    chunks, size, k = [], 0, 0
+    while size < megabytes * 1e6:
+        chunks.append(CHUNK.format(k=k, text=text))
+        size += len(chunks[-1])
+        k += 1
+    return "".join(chunks)
+
+def throughput(src, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        deque(lex(src), maxlen=0)
+        best = min(best, time.perf_counter() - start_time)
+    return len(src.encode()) / best / 1e6
+
+if __name__ == "__main__":
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    for label, string_length in [("code", 0), ("code + 1 KB strings", 1000), ("code + 100 KB strings", 100_000)]:
+        src = source(megabytes, string_length)
+        print(f"{label:>22}: {len(src) / 1e6:.1f} MB, {Fore.CYAN}{throughput(src):.2f} MB/s{Style.RESET_ALL}")
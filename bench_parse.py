@@ -0,0 +1,46 @@
+from osl_package import lex, parse
+from bench_lex import source
+import time
+import sys
+import tracemalloc
+from colorama import Fore, Style
+
+sys.setrecursionlimit(100000000)
+
+# Parser throughput and the memory the token stream takes when it is kept
+# around, on the generated sources of bench_lex.py and on a source that is
+# nothing but long expressions.
+# python3 bench_parse.py [megabytes]
+
+EXPRESSION = "x{k} := (a + {k} * b - c / 2) ^ 2 ^ n % 7 <= -y + √(z) * {k} || f(a, b * c) != 0 && q;\n"
+
+def expressions(megabytes):
+    lines, size, k = [], 0, 0
+    while size < megabytes * 1e6:
+        lines.append(EXPRESSION.format(k=k))
+        size += len(lines[-1])
+        k += 1
+    return "".join(lines)
+
+def throughput(src, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        parse(src)
+        best = min(best, time.perf_counter() - start_time)
+    return len(src.encode()) / best / 1e6
+
+def bytes_per_token(src):
+    tracemalloc.start()
+    tokens = list(lex(src))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(tokens), size / len(tokens)
+
+if __name__ == "__main__":
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    src = source(megabytes)
+    n, per_token = bytes_per_token(src)
+    print(f"{len(src) / 1e6:.1f} MB, {n} tokens, {Fore.CYAN}{per_token:.0f} bytes/token{Style.RESET_ALL}")
+    print(f"parse: {Fore.CYAN}{throughput(src):.2f} MB/s{Style.RESET_ALL}")
+    print(f"parse, expressions only: {Fore.CYAN}{throughput(expressions(megabytes)):.2f} MB/s{Style.RESET_ALL}")
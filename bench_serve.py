@@ -0,0 +1,57 @@
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from colorama import Fore, Style
+
+# Latency of running a one-line snippet in a fresh python3 process against a
+# round trip to a warm osl_serve.py over localhost TCP, and the compile and
+# execute times the server reports for it.
+# python3 bench_serve.py [runs]
+
+SNIPPET = "var x := 6; print(x * 7);"
+
+def fresh_process():
+    subprocess.run([sys.executable, "-c",
+                    f"from osl_package import parse, resolve, e; e(resolve(parse({SNIPPET!r})))"],
+                   check=True, capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+def timed(f, runs):
+    times = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start_time)
+    return statistics.median(times) * 1e3, max(times) * 1e3
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server = subprocess.Popen([sys.executable, "osl_serve.py", "0"], stderr=subprocess.PIPE, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        host, port = server.stderr.readline().split()[-1].split(":")
+        with socket.create_connection((host, int(port))) as sock, sock.makefile("rwb") as stream:
+            def round_trip(**request):
+                stream.write(json.dumps(request).encode() + b"\n")
+                stream.flush()
+                return json.loads(stream.readline())
+
+            def run_snippet():
+                # a session per snippet, as every fresh process starts empty
+                assert round_trip(code=SNIPPET, session="bench")["output"] == "42\n"
+                round_trip(op="reset", session="bench")
+
+            median, worst = timed(fresh_process, max(runs // 20, 5))
+            print(f"{'fresh process':>14}: median {Fore.CYAN}{median:8.3f} ms{Style.RESET_ALL}, max {worst:8.3f} ms")
+            median, worst = timed(run_snippet, runs)
+            print(f"{'warm server':>14}: median {Fore.CYAN}{median:8.3f} ms{Style.RESET_ALL}, max {worst:8.3f} ms "
+                  f"(run and reset, two round trips)")
+            stats = round_trip(op="stats")
+            for stage in ("compile", "execute"):
+                print(f"{stage:>14}: p50 {stats[stage]['p50']:.3f} ms, p99 {stats[stage]['p99']:.3f} ms")
+    finally:
+        server.terminate()
+        server.wait()
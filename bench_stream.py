@@ -0,0 +1,82 @@
+from osl_package import parse, resolve, e, run_stream
+import contextlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from colorama import Fore, Style
+
+# Time to first output and peak memory of running a generated script whole
+# (parse, resolve, e) and streamed from its file (run_stream), for growing
+# sizes of script. Streamed, both should stay flat.
+# python3 bench_stream.py [megabytes...]
+
+HEADER = """
+var x := 1;
+fn step(a, k) {
+    return (a * 31 + k) % 1000003;
+}
+print(x);
+"""
+
+CHUNK = """x := step(x, {k});
+if (x % 97 = 0) print(x);
+"""
+
+def source(megabytes):
+    chunks, size, k = [HEADER], len(HEADER), 0
+    while size < megabytes * 1e6:
+        chunks.append(CHUNK.format(k=k))
+        size += len(chunks[-1])
+        k += 1
+    return "".join(chunks)
+
+class FirstWrite:
+    # a sink for stdout remembering when it was first written to
+    def __init__(self):
+        self.at = None
+
+    def write(self, text):
+        if self.at is None:
+            self.at = time.perf_counter()
+
+    def flush(self):
+        pass
+
+def whole(path):
+    with open(path) as f:
+        e(resolve(parse(f.read())))
+
+def streamed(path):
+    with open(path, "rb") as f:
+        run_stream(f)
+
+def measure(run, path):
+    # (time to first output, total time, peak traced memory); tracing slows
+    # the run down, so memory comes from a second one
+    out = FirstWrite()
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        run(path)
+    total = time.perf_counter() - start_time
+    tracemalloc.start()
+    with contextlib.redirect_stdout(FirstWrite()):
+        run(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out.at - start_time, total, peak
+
+if __name__ == "__main__":
+    sys.setrecursionlimit(100000)
+    sizes = [float(arg) for arg in sys.argv[1:]] or [0.25, 1, 4]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "script.osl")
+        for megabytes in sizes:
+            with open(path, "w") as f:
+                f.write(source(megabytes))
+            print(f"{os.path.getsize(path) / 1e6:.2f} MB")
+            for run in (whole, streamed):
+                first, total, peak = measure(run, path)
+                print(f"{run.__name__:>10}: first output {Fore.CYAN}{first * 1e3:8.1f} ms{Style.RESET_ALL}, "
+                      f"total {total:6.2f} s, peak {Fore.CYAN}{peak / 1e6:7.1f} MB{Style.RESET_ALL}")
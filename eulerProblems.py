@@ -1,15 +1,19 @@
-from osl_package import e, resolve, parse
+from osl_package import resolve, parse, fold, ENGINES
 import time
 import sys
 from colorama import Fore, Style
 
 sys.setrecursionlimit(100000000)
 
+# python3 eulerProblems.py [tree|closure]
+engine = sys.argv[1] if len(sys.argv) > 1 else "tree"
+evaluate = ENGINES[engine]
+
 def run_test(exp, expected, label):
-    print(f"\n{label} osl Code:")
+    print(f"\n{label} osl Code ({engine} engine):")
     print(exp)
     start_time = time.time()
-    result = e(resolve(parse(exp)))
+    result = evaluate(fold(resolve(parse(exp))))
     t1 = time.time() - start_time
     print(f"Result: {result}")
     print(f"osl Time: {Fore.CYAN}{t1:.6f} seconds{Style.RESET_ALL}")
@@ -0,0 +1,56 @@
+import time
+import sys
+import os
+import tempfile
+from colorama import Fore, Style
+from cache import CompileCache
+from euler import EULER
+
+sys.setrecursionlimit(100000000)
+
+# Compiling through the on-disk cache: the first compile of a source misses
+# (compiles and stores), every later one loads the stored tree and bytecode.
+# Also fills a small cache to show the size limit evicting.
+# python3 bench_cache.py [megabytes]
+
+CHUNK = """
+fn F{k}(x, s) {{
+    if (x = 10) return s;
+    if (x % 3 = 0 || x % 5 = 0)
+        return F{k}(x + 1, s + x);
+    return F{k}(x + 1, s);
+}}
+var y{k} := F{k}(0, {k});
+log y{k} * 2 - ({k} + 1) * 3;
+"""
+
+def generated(megabytes):
+    chunks, size, k = [], 0, 0
+    while size < megabytes * 1e6:
+        chunks.append(CHUNK.format(k=k))
+        size += len(chunks[-1])
+        k += 1
+    return "".join(chunks)
+
+def timed(f, *args):
+    start_time = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start_time
+
+if __name__ == "__main__":
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    programs = [(label, src) for label, (src, _) in EULER.items()]
+    programs.append((f"{megabytes:g} MB generated", generated(megabytes)))
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CompileCache(os.path.join(tmp, "__oslcache__"))
+        for label, src in programs:
+            (tree, _, code), miss = timed(cache.compile, src)
+            (hit_tree, _, hit_code), hit = min((timed(cache.compile, src) for _ in range(3)), key=lambda r: r[1])
+            assert hit_code.to_bytes() == code.to_bytes() and repr(hit_tree) == repr(tree)
+            print(f"{label:>20}: miss {miss * 1e3:9.1f} ms, hit {Fore.CYAN}{hit * 1e3:8.1f} ms{Style.RESET_ALL} "
+                  f"({hit / miss:.0%} of the miss)")
+
+        small = CompileCache(os.path.join(tmp, "small"), max_bytes=4 * os.path.getsize(cache.path(programs[0][1])))
+        for label, src in programs[:-1]:
+            small.compile(src)
+        print(f"limited to 4 entries' worth: {len(os.listdir(small.directory))} of {len(programs) - 1} kept")
@@ -0,0 +1,39 @@
+import time
+import sys
+from colorama import Fore, Style
+from codegen import do_codegen, resolve, parse, count_nodes, CompilationUnit
+
+sys.setrecursionlimit(100000000)
+
+# do_codegen() time per AST node on generated programs of 1k to 1M nodes; with
+# a single output buffer it should stay flat as the programs grow.
+# python3 bench_codegen.py [largest size]
+
+def deep_sum(terms):
+    # one expression, as deep as it is long
+    return "var x := 1;\nlog " + " + ".join(["x"] * terms) + ";\n"
+
+def statements(count):
+    return "var x := 1;\n" + "if (x < 5) x := x + 1; else x := x - 1;\n" * count
+
+SHAPES = [
+    ("deep expression", deep_sum, 2),          # ~2 nodes per term
+    ("flat statements", statements, 12),       # ~12 nodes per statement
+]
+
+def run(tree):
+    start_time = time.perf_counter()
+    do_codegen(tree, CompilationUnit())
+    return time.perf_counter() - start_time
+
+if __name__ == "__main__":
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    for label, shape, per_unit in SHAPES:
+        size = 1000
+        while size <= largest:
+            tree = resolve(parse(shape(size // per_unit)))
+            nodes = count_nodes(tree)
+            elapsed = min(run(tree) for _ in range(3 if nodes < 100_000 else 1))
+            print(f"{label:>16} {nodes:>8} nodes: {elapsed:.4f} s, "
+                  f"{Fore.CYAN}{elapsed / nodes * 1e9:.0f} ns/node{Style.RESET_ALL}")
+            size *= 10
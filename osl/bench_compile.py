@@ -0,0 +1,48 @@
+import time
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from colorama import Fore, Style
+from codegen import CompilationUnit
+from euler import EULER
+
+# Compiling many small programs in one long-lived process: every program gets
+# its own CompilationUnit, so the 10000th compile costs what the first did and
+# produces the same bytecode. Also compiles the same batch on threads and on
+# processes and checks the results match.
+# python3 bench_compile.py [programs]
+
+def compile_source(src):
+    return CompilationUnit().compile(src).to_bytes()
+
+def sequential(sources):
+    times = []
+    results = []
+    for src in sources:
+        start_time = time.perf_counter()
+        results.append(compile_source(src))
+        times.append(time.perf_counter() - start_time)
+    return results, times
+
+def timed_map(executor, sources):
+    start_time = time.perf_counter()
+    with executor:
+        results = list(executor.map(compile_source, sources, chunksize=64))
+    return results, time.perf_counter() - start_time
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    programs = [src for src, _ in EULER.values()]
+    sources = [programs[k % len(programs)] for k in range(n)]
+    expected = [compile_source(src) for src in programs]
+
+    results, times = sequential(sources)
+    assert all(code == expected[k % len(programs)] for k, code in enumerate(results))
+    tenth = n // 10
+    print(f"{n} compiles: {Fore.CYAN}{sum(times):.3f} s{Style.RESET_ALL}, "
+          f"first {tenth} {sum(times[:tenth]) / tenth * 1e6:.0f} us/program, "
+          f"last {tenth} {sum(times[-tenth:]) / tenth * 1e6:.0f} us/program")
+
+    for label, executor in [("4 threads", ThreadPoolExecutor(4)), ("4 processes", ProcessPoolExecutor(4))]:
+        parallel, elapsed = timed_map(executor, sources)
+        assert parallel == results
+        print(f"{label:>12}: {Fore.CYAN}{elapsed:.3f} s{Style.RESET_ALL}, same bytecode")
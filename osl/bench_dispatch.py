@@ -0,0 +1,63 @@
+import time
+import sys
+import struct
+from colorama import Fore, Style
+import vm
+from vm import StackVM, Code, Opcode, OPERANDS
+
+# Per-opcode dispatch cost of the StackVM: fetch, dispatch and execute of one
+# instruction, in ns.
+# python3 bench_dispatch.py [repeat] [--specialised]
+#
+# Each opcode runs UNITS times in a row on a stack prefilled with the values it
+# consumes. Binary operators need a fresh right operand each time, so they are
+# timed as PUSH_INT 1; OP and the PUSH_INT cost is subtracted.
+
+UNITS = 50000
+
+def ins(op, operand=None):
+    size, fmt = OPERANDS.get(op, (0, None))
+    return bytes([op]) + (struct.pack(fmt, operand) if size else b"")
+
+PUSH = ins(Opcode.PUSH_INT, 1)
+BINARY = ["ADD", "SUB", "MUL", "DIV", "MOD", "EQ", "NEQ", "LT", "GT", "LE", "GE", "BITWISE_AND", "BITWISE_OR"]
+
+# label -> (unit, prefilled stack)
+CASES = {
+    "PUSH_INT":        (PUSH, []),
+    "PUSH_NONE":       (ins(Opcode.PUSH_NONE), []),
+    "POP":             (ins(Opcode.POP), [7] * UNITS),
+    "DUP":             (ins(Opcode.DUP), [7]),
+    "NEG":             (ins(Opcode.NEG), [7]),
+    **{name: (PUSH + ins(getattr(Opcode, name)), [7]) for name in BINARY},
+    "JUMP":            (ins(Opcode.JUMP, 0), []),
+    "JUMP_IF_ZERO":    (ins(Opcode.JUMP_IF_ZERO, 0), [0] * UNITS),
+    "JUMP_IF_NONZERO": (ins(Opcode.JUMP_IF_NONZERO, 0), [1] * UNITS),
+    "LOAD":            (ins(Opcode.LOAD, 1), []),
+    "STORE":           (ins(Opcode.STORE, 1), [7] * UNITS),
+}
+
+# binds variable 1 for LOAD
+PRELUDE = PUSH + ins(Opcode.STORE, 1)
+
+def time_unit(machine, unit, prefill, repeat):
+    bytecode = bytearray(PRELUDE + unit * UNITS + ins(Opcode.HALT))
+    best = float("inf")
+    for _ in range(repeat):
+        m = machine(Code(bytecode=bytecode))
+        m.stack = list(prefill) + [7]
+        start_time = time.perf_counter()
+        m.execute()
+        best = min(best, time.perf_counter() - start_time)
+    return best / UNITS * 1e9
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 5
+    machine = vm.specialised_vm() if "--specialised" in sys.argv else StackVM
+    costs = {}
+    for label, (unit, prefill) in CASES.items():
+        costs[label] = time_unit(machine, unit, prefill, repeat)
+        if label in BINARY:
+            costs[label] -= costs["PUSH_INT"]
+        print(f"{label:>16}: {Fore.CYAN}{costs[label]:8.1f} ns{Style.RESET_ALL}")
+    print(f"{'mean':>16}: {Fore.CYAN}{sum(costs.values()) / len(costs):8.1f} ns{Style.RESET_ALL}")
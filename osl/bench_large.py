@@ -0,0 +1,66 @@
+import time
+import sys
+import io
+import contextlib
+from colorama import Fore, Style
+from codegen import CompilationUnit
+from container import Code
+from vm import StackVM
+
+sys.setrecursionlimit(100000000)
+
+# Generated programs whose branches and function bodies are far longer than a
+# 16-bit jump reaches, and with thousands of functions in the function table.
+# Each is compiled, written out as a container and read back, then run.
+# python3 bench_large.py [statements]
+
+def long_branch(n):
+    # the then-branch alone is ~16 bytes per statement
+    body = "a := a + 1;\n" * n
+    return f"""
+fn big(x) {{
+    if (x > 0) {{
+        var a := x;
+        {body}
+        return a;
+    }}
+    return 0;
+}}
+log big(1);
+log big(0);
+""", [n + 1, 0]
+
+def many_functions(n):
+    # f0 .. f{n-1}, each calling the one before it
+    fns = ["fn f0(x) { return x; }"]
+    fns += [f"fn f{k}(x) {{ return f{k - 1}(x + 1); }}" for k in range(1, n)]
+    return "\n".join(fns) + f"\nlog f{n - 1}(0);\n", [n - 1]
+
+def constants(n):
+    # values that need the constant pool: wide ints, floats and strings
+    lines = [f"log {2**40 + k};" for k in range(n)]
+    return "\n".join(lines) + '\nlog 2.5;\nlog "done";\n', [2**40 + k for k in range(n)] + [2.5, "done"]
+
+SHAPES = [("long branch", long_branch), ("many functions", many_functions), ("constant pool", constants)]
+
+def run(code):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        StackVM(code).execute()
+    return out.getvalue().split()
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for label, shape in SHAPES:
+        src, expected = shape(n)
+        start_time = time.perf_counter()
+        blob = CompilationUnit().compile(src).to_bytes()
+        compiled = time.perf_counter() - start_time
+        code = Code.from_bytes(blob)
+        start_time = time.perf_counter()
+        result = run(code)
+        elapsed = time.perf_counter() - start_time
+        assert result == [str(v) for v in expected], (label, result[:5])
+        print(f"{label:>16}: {len(blob)} bytes, {len(code.functions)} functions, "
+              f"{len(code.constants)} constants, compile {Fore.CYAN}{compiled:.3f} s{Style.RESET_ALL}, "
+              f"run {Fore.CYAN}{elapsed:.3f} s{Style.RESET_ALL}")
@@ -0,0 +1,65 @@
+import time
+import sys
+import os
+import json
+import struct
+import subprocess
+import tempfile
+from colorama import Fore, Style
+from container import Code, load
+from vm import StackVM, Opcode
+
+# Startup time and peak RSS of the StackVM on a large bytecode file, read into
+# memory, mapped with load(), or handed over as an in-memory Code. Each way
+# runs in a fresh process; startup is loading plus StackVM's one-off decode.
+# python3 bench_load.py [megabytes]
+
+def block(k):
+    # x := x + k * 3 % 7
+    return struct.pack("<BiBiBiBBiBBBi", Opcode.LOAD, 1, Opcode.PUSH_INT, k % 1000, Opcode.PUSH_INT, 3,
+                       Opcode.MUL, Opcode.PUSH_INT, 7, Opcode.MOD, Opcode.ADD, Opcode.STORE, 1)
+
+def generate(megabytes):
+    n = int(megabytes * 1e6) // len(block(0))
+    x = struct.pack("<BiBi", Opcode.PUSH_INT, 0, Opcode.STORE, 1)
+    return Code(bytearray(x + b"".join(map(block, range(n))) + bytes([Opcode.HALT])))
+
+def rss(field="VmRSS"):
+    # MB, from /proc: ru_maxrss would carry over the parent's peak
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field + ":")) / 1024
+
+def child(how, arg):
+    if how == "in memory":
+        code = generate(float(arg))
+    base = rss()
+    start_time = time.perf_counter()
+    if how == "read":
+        with open(arg, "rb") as f:
+            code = Code.from_bytes(f.read())
+    elif how == "mmap":
+        code = load(arg)
+    loaded = time.perf_counter() - start_time
+    rss_loaded = rss()
+    vm = StackVM(code)
+    started = time.perf_counter() - start_time
+    print(json.dumps({"load": loaded, "startup": started, "base": base,
+                      "loaded": rss_loaded, "rss": rss("VmHWM"), "instrs": len(vm.instrs)}))
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2], sys.argv[3])
+        sys.exit()
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "large.bin")
+        with open(path, "wb") as f:
+            f.write(generate(megabytes).to_bytes())
+        print(f"{os.path.getsize(path) / 1e6:.0f} MB of bytecode")
+        for how, arg in [("read", path), ("mmap", path), ("in memory", str(megabytes))]:
+            out = subprocess.run([sys.executable, __file__, "--child", how, arg],
+                                 capture_output=True, text=True, check=True).stdout
+            r = json.loads(out)
+            print(f"{how:>10}: load {r['load'] * 1e3:8.1f} ms, RSS +{r['loaded'] - r['base']:6.0f} MB; "
+                  f"startup {Fore.CYAN}{r['startup']:.2f} s{Style.RESET_ALL}, "
+                  f"peak RSS {Fore.CYAN}{r['rss']:.0f} MB{Style.RESET_ALL} ({r['instrs']} instructions)")
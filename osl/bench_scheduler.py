@@ -0,0 +1,96 @@
+import time
+import sys
+import statistics
+import contextlib
+import io
+from colorama import Fore, Style
+from vm import StackVM
+from scheduler import Scheduler, READY, DONE
+from bench_vm import compile_program
+from euler import EULER
+
+sys.setrecursionlimit(100000000)
+
+# A mixed workload of thousands of programs: many short ones, some long ones,
+# a runaway loop and a runaway recursion. Run to completion one after another
+# (without the runaway ones, which would never end), the short programs wait
+# for every long one queued before them; the round-robin Scheduler finishes
+# them within its first turns and stops the runaway ones at their limits.
+# python3 bench_scheduler.py [short programs] [long programs]
+
+LONG = """
+fn count(n, s) {
+    if (n = 0) return s;
+    return count(n - 1, s + n);
+}
+log count(100000, 0);
+"""
+
+RUNAWAY_LOOP = """
+fn loop(n) {
+    return loop(n + 1);
+}
+log loop(0);
+"""
+
+RUNAWAY_RECURSION = """
+fn deep(n) {
+    return 1 + deep(n + 1);
+}
+log deep(0);
+"""
+
+MAX_STEPS = 2000000
+
+def one_after_another(workload):
+    # finish time of every program, running each to completion in turn
+    finished = {}
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, code in workload:
+            StackVM(code).execute()
+            finished[name] = time.perf_counter() - start_time
+    return finished
+
+def scheduled(workload, quantum):
+    # Scheduler.run(), noting when each task finishes; spawning (and so each
+    # VM's decode) counts, as it does above
+    finished = {}
+    start_time = time.perf_counter()
+    scheduler = Scheduler(quantum)
+    for name, code in workload:
+        scheduler.spawn(code, name, max_steps=MAX_STEPS)
+    ready = scheduler.ready
+    while ready:
+        task = ready.popleft()
+        scheduler.step(task)
+        if task.state == READY:
+            ready.append(task)
+        else:
+            finished[task.name] = time.perf_counter() - start_time
+    return finished, scheduler.tasks
+
+def report(label, finished, steps):
+    short = [t for name, t in finished.items() if name.startswith("short")]
+    total = max(finished.values())
+    print(f"{label:>18}: short programs done at median {Fore.CYAN}{statistics.median(short) * 1e3:8.1f} ms{Style.RESET_ALL}, "
+          f"last {max(short) * 1e3:8.1f} ms; all done {total:6.2f} s, {steps / total / 1e6:5.2f} M instructions/s")
+
+if __name__ == "__main__":
+    shorts = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    longs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    short, long = compile_program(EULER["Problem 2"][0]), compile_program(LONG)
+    workload = [(f"long {k}", long) for k in range(longs)] + [(f"short {k}", short) for k in range(shorts)]
+    runaway = [("loop", compile_program(RUNAWAY_LOOP)), ("recursion", compile_program(RUNAWAY_RECURSION))]
+
+    _, tasks = scheduled(workload, 1000)
+    steps = sum(task.vm.steps for task in tasks)
+    print(f"{shorts} short programs ({tasks[-1].vm.steps} instructions each), "
+          f"{longs} long ones ({tasks[0].vm.steps} each), queued long ones first")
+    report("one after another", one_after_another(workload), steps)
+    for quantum in (100, 1000, 10000):
+        finished, tasks = scheduled(runaway + workload, quantum)
+        assert all(task.state == DONE for task in tasks[len(runaway):])
+        report(f"quantum {quantum}", finished, sum(task.vm.steps for task in tasks))
+    for task in tasks[:len(runaway)]:
+        print(f"{task.name:>18}: {task.error} after {task.vm.steps} instructions")
@@ -0,0 +1,44 @@
+import time
+import sys
+from colorama import Fore, Style
+import codegen as cg
+from codegen import resolve, parse, fold, CompilationUnit
+from vm import StackVM
+from regcodegen import reg_codegen, RegCode
+from regvm import RegisterVM
+from euler import EULER
+
+sys.setrecursionlimit(100000000)
+
+# VM execution time on every program of eulerProblems.py
+# python3 bench_vm.py [repeat] [--no-fuse] [--mode stack|register]
+# In stack mode also prints which superinstructions the peephole pass formed.
+
+def compile_program(src, fuse=True, fired=None):
+    code = CompilationUnit().compile(src, fuse=False)
+    return cg.peephole(code, fired) if fuse else code
+
+def compile_register(src):
+    return reg_codegen(fold(resolve(parse(src))))
+
+def run(code):
+    # loading (and any decoding the VM does) counts towards the time
+    start_time = time.perf_counter()
+    vm = RegisterVM(code) if isinstance(code, RegCode) else StackVM(code)
+    vm.execute()
+    return time.perf_counter() - start_time
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 3
+    fuse = "--no-fuse" not in sys.argv
+    mode = sys.argv[sys.argv.index("--mode") + 1] if "--mode" in sys.argv else "stack"
+    total = {}
+    for label, (src, expected) in EULER.items():
+        fired = {}
+        code = compile_program(src, fuse, fired) if mode == "stack" else compile_register(src)
+        best = min(run(code) for _ in range(repeat))
+        print(f"{label} (expected {expected}): {Fore.CYAN}{best:.6f} seconds{Style.RESET_ALL} {fired}")
+        for name, count in fired.items():
+            total[name] = total.get(name, 0) + count
+    if fuse and mode == "stack":
+        print(f"Superinstructions formed: {total}")
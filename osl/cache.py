@@ -0,0 +1,161 @@
+import os
+import time
+import struct
+import pickle
+import hashlib
+import tempfile
+from dataclasses import fields
+from typing import List, Optional, Tuple
+from codegen import CompilationUnit, resolve, parse, fold, codegen, AST
+from container import Code
+
+# An on-disk cache of compiled programs, like __pycache__: one file per
+# source, named after the hash of the source and of the compiler, holding
+#   magic "OSLC", the length of the tree (u32), the resolved and folded tree
+#   as flatten() records with fold()'s stats (pickled), then the bytecode
+#   container
+# Any change to the compiler's own sources changes every name, so entries
+# never outlive the compiler that wrote them; the old ones age out.
+
+MAGIC = b"OSLC"
+ENTRY = struct.Struct("<4sI")
+
+COMPILER = ["osl_lexer.py", "osl_parser.py", "cosl.py", "codegen.py", "container.py"]
+
+_compiler_version = None
+
+def compiler_version() -> bytes:
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in COMPILER:
+            with open(os.path.join(here, name), "rb") as f:
+                digest.update(f.read())
+        _compiler_version = digest.digest()
+    return _compiler_version
+
+# The tree is pickled as a flat list: pickle recurses once per level of
+# nesting and would overflow the C stack on the deep trees every other pass
+# handles. Each node is a record (class name, number of children, field...)
+# in post-order, where a child node's field is `...` and a list of nodes' is a
+# 1-tuple of its length; the children themselves are the records before it.
+# Nodes with neither (Number, Variable, ...) have None for the count.
+
+NODE_CLASSES = {cls.__name__: cls for cls in AST.__subclasses__()}
+
+def flatten(tree: AST) -> List[tuple]:
+    records = []
+    pending = [(tree, False)]
+    while pending:
+        node, done = pending.pop()
+        values = [getattr(node, f.name) for f in fields(node)]
+        if done:
+            fields_ = [... if isinstance(v, AST) else (len(v),) if isinstance(v, list) else v
+                       for v in values]
+            children = sum(1 if v is ... else v[0] if type(v) is tuple else 0 for v in fields_)
+            if not children and not any(type(v) is tuple for v in fields_):
+                children = None
+            records.append((type(node).__name__, children, *fields_))
+            continue
+        pending.append((node, True))
+        for v in reversed(values):
+            if isinstance(v, AST):
+                pending.append((v, False))
+            elif isinstance(v, list):
+                pending.extend((child, False) for child in reversed(v))
+    return records
+
+def rebuild(records: List[tuple]) -> AST:
+    stack = []
+    push = stack.append
+    for record in records:
+        cls = NODE_CLASSES[record[0]]
+        wanted = record[1]
+        if wanted is None:
+            push(cls(*record[2:]))
+            continue
+        children = iter(stack[len(stack) - wanted:])
+        del stack[len(stack) - wanted:]
+        push(cls(*[next(children) if v is ... else [next(children) for _ in range(v[0])] if type(v) is tuple else v
+                   for v in record[2:]]))
+    return stack.pop()
+
+class CompileCache:
+    """Compiles sources through the cache in `directory`. A hit returns what
+    compile() would, without lexing, parsing, resolving or generating code.
+    After every store, entries unused for `max_age` seconds go, then the
+    least recently used ones until the cache fits in `max_bytes`."""
+
+    def __init__(self, directory: str = "__oslcache__", max_bytes: int = 64 * 2**20,
+                 max_age: float = 30 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def path(self, src: str, fuse: bool = True) -> str:
+        digest = hashlib.sha256(compiler_version())
+        digest.update(b"fuse" if fuse else b"plain")
+        digest.update(src.encode())
+        return os.path.join(self.directory, digest.hexdigest()[:32] + ".oslc")
+
+    def compile(self, src: str, fuse: bool = True) -> Tuple[AST, dict, Code]:
+        """The resolved and folded tree, fold()'s stats and the bytecode of src."""
+        path = self.path(src, fuse)
+        entry = self.load(path)
+        if entry is not None:
+            return entry
+        unit = CompilationUnit()
+        stats = {}
+        tree = fold(resolve(parse(src), unit.env), stats)
+        code = codegen(tree, fuse, unit)
+        self.store(path, tree, stats, code)
+        return tree, stats, code
+
+    def load(self, path: str) -> Optional[Tuple[AST, dict, Code]]:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            magic, size = ENTRY.unpack_from(data)
+            if magic != MAGIC:
+                return None
+            records, stats = pickle.loads(memoryview(data)[ENTRY.size:ENTRY.size + size])
+            tree = rebuild(records)
+            code = Code.from_bytes(memoryview(data)[ENTRY.size + size:])
+        except Exception:
+            # missing, truncated or written by something else: compile again
+            return None
+        # the modification time is the last use, which eviction goes by
+        os.utime(path)
+        return tree, stats, code
+
+    def store(self, path: str, tree: AST, stats: dict, code: Code):
+        data = pickle.dumps((flatten(tree), stats), pickle.HIGHEST_PROTOCOL)
+        os.makedirs(self.directory, exist_ok=True)
+        # written aside and renamed, so a reader never sees half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(ENTRY.pack(MAGIC, len(data)))
+            f.write(data)
+            f.write(code.to_bytes())
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".oslc"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        entries.sort()
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,4 +1,6 @@
 from osl_parser import *
+from container import Code, Function
+import struct
 
 PUSH_CHAR   = 0x01
 PUSH_SHORT  = 0x02
@@ -8,6 +10,7 @@ PUSH_FLOAT  = 0x05
 PUSH_DOUBLE = 0x06
 PUSH_NONE   = 0x07
 PUSH_BOOL   = 0x08
+PUSH_CONST  = 0x09
 
 POP         = 0x10
 DUP         = 0x11
@@ -39,6 +42,7 @@ JUMP_IF_NONZERO = 0x52
 CALL            = 0x53
 RETURN          = 0x54
 HALT            = 0x55
+TAIL_CALL       = 0x56
 
 I2F         = 0x60
 F2I         = 0x61
@@ -58,201 +62,318 @@ LOG = 0x90
 NEWF = 0x91
 MAKEF = 0x92
 
-full_code = bytearray()
+# superinstructions, only ever produced by peephole()
+LOAD_LOAD_ADD     = 0xA0
+LOAD_CONST_CMP_JZ = 0xA1
+CALL_N            = 0xA2
+TAIL_CALL_N       = 0xA3
 
+class CompileError(Exception):
+    # a program the bytecode has no instructions for
+    pass
 
-def do_codegen(tree: AST, code: bytearray = None): # returns bytearray
-        
-    def e_(tree: AST):
-        return do_codegen(tree)
-    
-    if code is None:
-        code = bytearray()
+class CompilationUnit:
+    """The state of compiling one program: the environment resolve() declares
+    names in (and draws their ids from), the code of the function bodies with
+    their function table entries, which codegen() places after the top level,
+    and the constant pool. Each compile() starts from scratch, so a unit can
+    compile any number of programs one after another; units share nothing, so
+    programs can also be compiled in one thread each."""
+
+    def __init__(self):
+        self.env = Environment()
+        self.reset_code()
+
+    def reset_code(self):
+        # what codegen() builds a Code from; done by each codegen()
+        self.function_code = bytearray()
+        self.functions = []     # Function entries relative to function_code
+        self.constants = []
+        self.constant_index = {}
+
+    def constant(self, val) -> int:
+        # osl shows bools (from fold()) as 1/0, and the container has no tag for them
+        if type(val) is bool:
+            val = int(val)
+        # 1 and 1.0 compare equal but are different constants
+        key = (type(val), val)
+        if key not in self.constant_index:
+            self.constant_index[key] = len(self.constants)
+            self.constants.append(val)
+        return self.constant_index[key]
+
+    def compile(self, src: str, fuse: bool = True) -> Code:
+        self.env = Environment()
+        return codegen(fold(resolve(parse(src), self.env)), fuse, self)
+
+
+# stack bytecode of the binary operators; && and || do not short-circuit
+BINOP_CODES = {
+    "+": ADD, "-": SUB, "*": MUL, "/": DIV, "%": MOD,
+    "=": EQ, "!=": NEQ, "<": LT, ">": GT, "<=": LE, ">=": GE,
+    "&&": BITWISE_AND, "||": BITWISE_OR,
+}
+
+class Label:
+    # a position in an Emitter's buffer, None until place() is called
+    __slots__ = ("pos",)
+
+    def __init__(self):
+        self.pos = None
 
+class Emitter:
+    """Appends instructions to a single growing buffer. A jump is written with
+    a placeholder offset and remembered, finish() patches every placeholder
+    once all labels are placed."""
+
+    def __init__(self, code: bytearray = None):
+        self.code = code if code is not None else bytearray()
+        self.patches = []   # (offset operand position, Label)
+
+    def emit(self, op: int, operand: int = None, size: int = 4, signed: bool = False):
+        self.code.append(op)
+        if operand is not None:
+            self.code += operand.to_bytes(size, 'little', signed=signed)
+
+    def jump(self, op: int, label: Label):
+        self.code.append(op)
+        self.patches.append((len(self.code), label))
+        self.code += b"\0\0\0\0"
+
+    def place(self, label: Label):
+        label.pos = len(self.code)
+
+    def finish(self) -> bytearray:
+        # offsets are relative to the end of the jump's operand
+        code = self.code
+        for at, label in self.patches:
+            code[at:at + 4] = (label.pos - at - 4).to_bytes(4, 'little', signed=True)
+        self.patches.clear()
+        return code
+
+
+def do_codegen(tree: AST, unit: CompilationUnit, code: bytearray = None): # returns bytearray
+    out = Emitter(code)
+    trampoline(_do_codegen(tree, unit, out))
+    return out.finish()
+
+def _do_codegen(tree: AST, unit: CompilationUnit, out: Emitter):
+    # do_codegen() as a generator, see trampoline(); every node appends to out
     match tree:
         case Program(decls):
             for decl in decls:
-                code.extend(e_(decl))
-            return code
+                yield _do_codegen(decl, unit, out)
         
         case Number(val):
-            code.append(PUSH_INT)
-            code.extend(int(val).to_bytes(4, 'little'))
-            return code
-            
+            if type(val) is int and -2**31 <= val < 2**31:
+                out.emit(PUSH_INT, val, 4, signed=True)
+            else:
+                out.emit(PUSH_CONST, unit.constant(val))
+        
         case StringLiteral(val):
-            return val
+            out.emit(PUSH_CONST, unit.constant(val))
         
         case Variable(varName, i):
-            code.append(LOAD)
-            code.extend(int(i).to_bytes(4, 'little'))
-            return code
+            out.emit(LOAD, int(i))
         
         case Let(Variable(varName, i), e1):
             if e1:
-                code.extend(e_(e1))
+                yield _do_codegen(e1, unit, out)
             else:
-                code.append(PUSH_NONE)
-            code.append(STORE)
-            code.extend(int(i).to_bytes(4, 'little'))
-            return code
+                out.emit(PUSH_NONE)
+            out.emit(STORE, int(i))
         
         case Assign(Variable(varName, i), e1):
-            code.extend(e_(e1))
-            code.append(STORE)
-            code.extend(int(i).to_bytes(4, 'little'))
-            return code
+            yield _do_codegen(e1, unit, out)
+            out.emit(STORE, int(i))
         
         case LetFun(Variable(varName, i), params, body):
-            code.append(PUSH_INT)
-            code.extend(int(i).to_bytes(4, 'little'))
-            code.append(MAKEF)
-
-            new_code = bytearray()
-            # add arguments to stack
-            for param in params:
-                new_code.append(PUSH_INT)
-                new_code.extend(int(param.id).to_bytes(4, 'little'))
-            # add number of arguments
-            new_code.append(PUSH_INT)
-            new_code.extend(int(len(params)).to_bytes(4, 'little'))
-            # add function id
-            new_code.append(PUSH_INT)
-            new_code.extend(int(i).to_bytes(4, 'little'))
-            new_code.append(NEWF)
-
-            fbody = do_codegen(body)
-
-            new_code.append(JUMP)
-            new_code.extend(len(fbody).to_bytes(2, 'little'))
-            global full_code
-            new_code.extend(fbody)
-            full_code.extend(new_code)
-            return code
+            out.emit(PUSH_INT, int(i))
+            out.emit(MAKEF)
+
+            # the function gets a buffer of its own, which goes into the unit's
+            # function code in one piece (after the functions nested in it) and
+            # is entered through its function table entry
+            fn = Emitter()
+            yield _do_codegen(body, unit, fn)
+            if not ends_in_return(body):
+                # falling off the end of a body returns None
+                fn.emit(PUSH_NONE)
+                fn.emit(RETURN)
+            unit.functions.append(Function(int(i), len(unit.function_code),
+                                           [int(param.id) for param in params], count_locals(body)))
+            unit.function_code += fn.finish()
         
-        case CallFun(Variable(varName, i), args):
+        case CallFun(Variable(varName, i), args, tail):
             for arg in args:
-                code.extend(e_(arg))
-            
-            code.append(PUSH_INT)
-            code.extend(int(len(args)).to_bytes(4, 'little'))
-            code.append(PUSH_INT)
-            code.extend(int(i).to_bytes(4, 'little'))
-            code.append(CALL)
-            return code
+                yield _do_codegen(arg, unit, out)
+            out.emit(PUSH_INT, len(args))
+            out.emit(PUSH_INT, int(i))
+            out.emit(TAIL_CALL if tail else CALL)
         
         case Statements(stmts):
             for stmt in stmts:
-                code.extend(e_(stmt))
-            return code
+                yield _do_codegen(stmt, unit, out)
         
         case PrintStmt(expr):
-            code.extend(e_(expr))
-            code.append(LOG)
-            return code
+            yield _do_codegen(expr, unit, out)
+            out.emit(LOG)
         
         case ReturnStmt(expr):
             if expr:
-                code.extend(e_(expr))
+                yield _do_codegen(expr, unit, out)
             else:
-                code.append(PUSH_NONE)
-            code.append(RETURN)
-            return code
-            
-        case BinOp("+", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(ADD)
-            return code
-        case BinOp("*", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(MUL)
-            return code
-        case BinOp("/", left, right): 
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(DIV)
-            return code
-        case BinOp("-", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(SUB)
-            return code
-        case BinOp("<", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(LT)
-            return code
-        case BinOp(">", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(GT)
-            return code
-        case BinOp("<=", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(LE)
-            return code
-        case BinOp(">=", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(GE)
-            return code
-        case BinOp("=", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(EQ)
-            return code
-        case BinOp("!=", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(NEQ)
-            return code
-        case BinOp("%", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(MOD)
-            return code
-        case BinOp("||", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(BITWISE_OR)
-            return code
-        case BinOp("&&", left, right):
-            code.extend(e_(left))
-            code.extend(e_(right))
-            code.append(BITWISE_AND)
-            return code
-        case UnOp("-", right): return -e_(right)
-        case UnOp("\u221a", right): return e_(right) ** 0.5
+                out.emit(PUSH_NONE)
+            # a TAIL_CALL never falls through, its callee returns for us
+            if not (isinstance(expr, CallFun) and expr.tail):
+                out.emit(RETURN)
+        
+        case BinOp(op, left, right) if op in BINOP_CODES:
+            yield _do_codegen(left, unit, out)
+            yield _do_codegen(right, unit, out)
+            out.emit(BINOP_CODES[op])
+        
+        case UnOp("-", right):
+            yield _do_codegen(right, unit, out)
+            out.emit(NEG)
+        
+        case If(condition, then_body, else_body):
+            else_, end = Label(), Label()
+            yield _do_codegen(condition, unit, out)
+            out.jump(JUMP_IF_ZERO, else_)
+            yield _do_codegen(then_body, unit, out)
+            out.jump(JUMP, end)
+            out.place(else_)
+            yield _do_codegen(else_body, unit, out)
+            out.place(end)
         
-        case If(condition, then_body, else_body): 
-            code.extend(e_(condition))
-            code.append(JUMP_IF_ZERO)
-            code.extend(int(0).to_bytes(2, 'little'))
-            jif_pos = len(code)-2
-            code.extend(e_(then_body))
-            code.append(JUMP)
-            code.extend(int(0).to_bytes(2, 'little'))
-            j_pos = len(code)-2
-            code[jif_pos:jif_pos+2] = int(len(code)-jif_pos-2).to_bytes(2, 'little')
-            code.extend(e_(else_body))
-            code[j_pos:j_pos+2] = int(len(code)-j_pos-2).to_bytes(2, 'little')
-            return code
-            
         case IfUnM(condition, then_body):
-            code.extend(e_(condition))
-            code.append(JUMP_IF_ZERO)
-            code.extend(int(0).to_bytes(2, 'little'))
-            jif_pos = len(code)-2
-            code.extend(e_(then_body))
-            code[jif_pos:jif_pos+2] = int(len(code)-jif_pos-2).to_bytes(2, 'little')
-            return code
-
-def codegen(t):
-    global full_code
-    code = do_codegen(t)
-    full_code.extend(code)
-    full_code.append(HALT)
-    return full_code
\ No newline at end of file
+            end = Label()
+            yield _do_codegen(condition, unit, out)
+            out.jump(JUMP_IF_ZERO, end)
+            yield _do_codegen(then_body, unit, out)
+            out.place(end)
+        
+        case BinOp(op, _, _) | UnOp(op, _):
+            # √ and ^ have no bytecode
+            raise CompileError(f"The {op} operator is not supported by the bytecode compiler")
+        
+        case _:
+            raise CompileError(f"Cannot compile {type(tree).__name__} to bytecode")
+
+def ends_in_return(body: AST) -> bool:
+    while isinstance(body, Statements) and body.stmts:
+        body = body.stmts[-1]
+    return isinstance(body, ReturnStmt)
+
+def count_locals(body: AST) -> int:
+    # the variables and functions a function body declares, at any block depth
+    # but not inside the functions nested in it
+    count = 0
+    pending = [body]
+    while pending:
+        tree = pending.pop()
+        if isinstance(tree, list):
+            pending.extend(tree)
+        elif isinstance(tree, (Let, LetFun)):
+            count += 1
+            if isinstance(tree, Let):
+                pending.append(tree.e1)
+        elif isinstance(tree, AST):
+            pending.extend(getattr(tree, f.name) for f in fields(tree))
+    return count
+
+# operand layout of every instruction peephole() may see or produce
+OPERANDS = {
+    PUSH_INT: '<i', PUSH_LONG: '<q', PUSH_CONST: '<I',
+    JUMP: '<i', JUMP_IF_ZERO: '<i', JUMP_IF_NONZERO: '<i',
+    STORE: '<i', LOAD: '<i',
+    LOAD_LOAD_ADD: '<ii',           # var, var
+    LOAD_CONST_CMP_JZ: '<iiBi',     # var, constant, comparison opcode, jump offset
+    CALL_N: '<ii',                  # function id, number of arguments
+    TAIL_CALL_N: '<ii',
+}
+JUMPS = {JUMP, JUMP_IF_ZERO, JUMP_IF_NONZERO, LOAD_CONST_CMP_JZ}
+COMPARISONS = {EQ, NEQ, LT, GT, LE, GE}
+
+def size_of(op):
+    return 1 + struct.calcsize(OPERANDS[op]) if op in OPERANDS else 1
+
+def peephole(code: Code, fired: dict = None) -> Code:
+    """Rewrite hot instruction sequences into superinstructions:
+        LOAD a; LOAD b; ADD                     -> LOAD_LOAD_ADD a b
+        LOAD a; PUSH_INT k; <cmp>; JUMP_IF_ZERO -> LOAD_CONST_CMP_JZ a k <cmp> off
+        PUSH_INT n; PUSH_INT f; (TAIL_)CALL     -> (TAIL_)CALL_N f n
+    A sequence is only fused if no jump or function entry lands inside it.
+    Jump offsets and function entries are recomputed for the shorter code.
+    `fired` counts the fusions by name."""
+    functions, constants, code = code.functions, code.constants, code.bytecode
+    instrs = []     # (offset, opcode, operands)
+    pc = 0
+    while pc < len(code):
+        op = code[pc]
+        args = struct.unpack_from(OPERANDS[op], code, pc + 1) if op in OPERANDS else ()
+        instrs.append((pc, op, args))
+        pc += size_of(op)
+    
+    targets = {len(code)} | {f.entry for f in functions}
+    for pc, op, args in instrs:
+        if op in JUMPS:
+            targets.add(pc + size_of(op) + args[-1])
+    
+    fused = []      # (old offset, opcode, operands, old jump target)
+    i = 0
+    while i < len(instrs):
+        window = instrs[i:i + 4]
+        ops = [op for _, op, _ in window]
+        def fusable(n):
+            return len(window) >= n and all(pc not in targets for pc, _, _ in window[1:n])
+        pc, op, args = window[0]
+        
+        if ops[:3] == [LOAD, LOAD, ADD] and fusable(3):
+            new, n = (pc, LOAD_LOAD_ADD, (args[0], window[1][2][0]), None), 3
+        elif (ops[:2] == [LOAD, PUSH_INT] and len(ops) == 4 and ops[2] in COMPARISONS
+              and ops[3] == JUMP_IF_ZERO and fusable(4)):
+            jz_pc, _, (offset,) = window[3]
+            new, n = (pc, LOAD_CONST_CMP_JZ, (args[0], window[1][2][0], ops[2], 0),
+                      jz_pc + size_of(JUMP_IF_ZERO) + offset), 4
+        elif ops[:2] == [PUSH_INT, PUSH_INT] and ops[2:3] in ([CALL], [TAIL_CALL]) and fusable(3):
+            new, n = (pc, CALL_N if ops[2] == CALL else TAIL_CALL_N, (window[1][2][0], args[0]), None), 3
+        else:
+            new, n = (pc, op, args, pc + size_of(op) + args[-1] if op in JUMPS else None), 1
+        
+        if n > 1 and fired is not None:
+            name = {LOAD_LOAD_ADD: "LOAD_LOAD_ADD", LOAD_CONST_CMP_JZ: "LOAD_CONST_CMP_JZ",
+                    CALL_N: "CALL_N", TAIL_CALL_N: "TAIL_CALL_N"}[new[1]]
+            fired[name] = fired.get(name, 0) + 1
+        fused.append(new)
+        i += n
+    
+    new_pc = {}
+    pc = 0
+    for old, op, _, _ in fused:
+        new_pc[old] = pc
+        pc += size_of(op)
+    new_pc[len(code)] = pc
+    
+    out = bytearray()
+    for old, op, args, target in fused:
+        if target is not None:
+            args = args[:-1] + (new_pc[target] - len(out) - size_of(op),)
+        out.append(op)
+        if op in OPERANDS:
+            out.extend(struct.pack(OPERANDS[op], *args))
+    functions = [Function(f.id, new_pc[f.entry], f.params, f.nlocals) for f in functions]
+    return Code(out, functions, constants)
+
+def codegen(t, fuse=True, unit: CompilationUnit = None) -> Code:
+    if unit is None:
+        unit = CompilationUnit()
+    unit.reset_code()
+    code = do_codegen(t, unit)
+    code.append(HALT)
+    base = len(code)
+    code += unit.function_code
+    functions = [Function(f.id, base + f.entry, f.params, f.nlocals) for f in unit.functions]
+    code = Code(code, functions, list(unit.constants))
+    return peephole(code) if fuse else code
\ No newline at end of file
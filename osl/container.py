@@ -0,0 +1,108 @@
+from dataclasses import dataclass, field
+from typing import List, Union
+import struct
+import mmap
+
+# The bytecode container, little-endian throughout:
+#
+#   header          magic "OSLB", format version, flags (0), function count,
+#                   constant count, code size
+#   function table  per function: id, entry (byte offset into the code),
+#                   arity, local count, then one parameter id per argument
+#   constant pool   per constant: a tag byte and its value
+#                     'i' int64, 'f' float64, 'b' byte count (u32) + signed
+#                     integer of any size, 's' byte count (u32) + UTF-8
+#   code            the instructions; execution starts at offset 0
+#
+# Jump offsets in the code are 32-bit, relative to the end of the jump's operand.
+
+MAGIC = b"OSLB"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHIII")
+FUNCTION = struct.Struct("<IIHH")
+
+Constant = Union[int, float, str]
+
+@dataclass
+class Function:
+    id: int
+    entry: int
+    params: List[int]
+    nlocals: int = 0     # variables the body declares, parameters not included
+
+    @property
+    def arity(self) -> int:
+        return len(self.params)
+
+@dataclass
+class Code:
+    bytecode: Union[bytearray, memoryview]
+    functions: List[Function] = field(default_factory=list)
+    constants: List[Constant] = field(default_factory=list)
+
+    def to_bytes(self) -> bytes:
+        out = bytearray(HEADER.pack(MAGIC, VERSION, 0, len(self.functions),
+                                    len(self.constants), len(self.bytecode)))
+        for f in self.functions:
+            out += FUNCTION.pack(f.id, f.entry, f.arity, f.nlocals)
+            out += struct.pack(f"<{f.arity}I", *f.params)
+        for const in self.constants:
+            if type(const) is str:
+                data = const.encode()
+                out += b"s" + struct.pack("<I", len(data)) + data
+            elif type(const) is float:
+                out += b"f" + struct.pack("<d", const)
+            elif -2**63 <= const < 2**63:
+                out += b"i" + struct.pack("<q", const)
+            else:
+                data = const.to_bytes((const.bit_length() + 8) // 8, 'little', signed=True)
+                out += b"b" + struct.pack("<I", len(data)) + data
+        return bytes(out + self.bytecode)
+
+    @classmethod
+    def from_bytes(cls, data) -> "Code":
+        # data may be any buffer; given a memoryview the code section stays a
+        # view into it rather than a copy
+        if bytes(data[:4]) != MAGIC:
+            raise ValueError("Not osl bytecode (bad magic)")
+        magic, version, flags, nfunctions, nconstants, size = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f"Bytecode format version {version}, this build reads {VERSION}")
+        pos = HEADER.size
+        functions = []
+        for _ in range(nfunctions):
+            fun_id, entry, arity, nlocals = FUNCTION.unpack_from(data, pos)
+            pos += FUNCTION.size
+            params = list(struct.unpack_from(f"<{arity}I", data, pos))
+            pos += 4 * arity
+            functions.append(Function(fun_id, entry, params, nlocals))
+        constants = []
+        for _ in range(nconstants):
+            tag = bytes(data[pos:pos + 1])
+            pos += 1
+            if tag == b"i":
+                constants.append(struct.unpack_from("<q", data, pos)[0])
+                pos += 8
+            elif tag == b"f":
+                constants.append(struct.unpack_from("<d", data, pos)[0])
+                pos += 8
+            elif tag in (b"b", b"s"):
+                (length,) = struct.unpack_from("<I", data, pos)
+                raw = bytes(data[pos + 4:pos + 4 + length])
+                constants.append(int.from_bytes(raw, 'little', signed=True) if tag == b"b" else raw.decode())
+                pos += 4 + length
+            else:
+                raise ValueError(f"Bad constant tag {tag!r} at byte {pos - 1}")
+        if len(data) - pos != size:
+            raise ValueError(f"Code is {len(data) - pos} bytes, the header says {size}")
+        code = data[pos:] if isinstance(data, memoryview) else bytearray(data[pos:])
+        return cls(code, functions, constants)
+
+def load(path: str) -> Code:
+    """Map a bytecode file read-only. The code section of the result is a
+    memoryview into the mapping, so only the pages the VM touches are read in;
+    the mapping stays open as long as the view is alive."""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return Code.from_bytes(memoryview(mapped))
@@ -1,39 +1,48 @@
 from dataclasses import dataclass
 from typing import List, Optional
 
-class Token:
-    pass
+# token kinds
+NUMBER, OPERATOR, KEYWORD, VARIABLE, STRING, FUNCALL = range(6)
+KIND_NAMES = ("number", "operator", "keyword", "variable", "string", "function call")
 
-@dataclass
-class NumberToken(Token):
-    val: str
-
-@dataclass
-class OperatorToken(Token):
-    op: str
+class Token:
+    # kind is one of the codes above and text is interned for everything but
+    # string literals. The token covers source[start:start + size]; size is
+    # kept rather than end because small ints are shared, so the span costs a
+    # single int object per token.
+    __slots__ = ("kind", "text", "start", "size")
     
-@dataclass
-class KeyWordToken(Token):
-    op: str
+    def __init__(self, kind: int, text: str, start: int = 0, end: int = 0):
+        self.kind = kind
+        self.text = text
+        self.start = start
+        self.size = end - start
     
-@dataclass
-class VariableToken(Token):
-    varName: str
-
-@dataclass
-class StringToken(Token):
-    val: str
-
-@dataclass
-class FunCallToken(Token):
-    funName: str
+    @property
+    def end(self) -> int:
+        return self.start + self.size
+    
+    def __eq__(self, other):
+        return isinstance(other, Token) and self.kind == other.kind and self.text == other.text
+    
+    def __hash__(self):
+        return hash((self.kind, self.text))
+    
+    def __repr__(self):
+        return f"Token({KIND_NAMES[self.kind]}, {self.text!r}, {self.start}:{self.end})"
 
 
 class Environment:
     envs: List
+    last_id: int    # variable ids are unique per environment, see fresh()
     
     def __init__(self):
         self.envs = [{}]
+        self.last_id = 0
+    
+    def fresh(self) -> int:
+        self.last_id += 1
+        return self.last_id
     
     def enter_scope(self):
         self.envs.append({})
@@ -52,6 +61,13 @@ class Environment:
                 return env[var]
         raise ValueError(f"Variable {var} not defined")
     
+    def locate(self, var):
+        # (depth, value) of the innermost binding, depth 0 being the global scope
+        for depth in range(len(self.envs) - 1, -1, -1):
+            if var in self.envs[depth]:
+                return depth, self.envs[depth][var]
+        raise ValueError(f"Variable {var} not defined")
+    
     def update(self, var, val):
         for env in reversed(self.envs):
             if var in env:
@@ -62,89 +78,98 @@ class Environment:
     def copy(self):
         new_env = Environment()
         new_env.envs = [dict(scope) for scope in self.envs]
+        new_env.last_id = self.last_id
         return new_env
 
-@dataclass
+@dataclass(slots=True)
 class AST:
     pass
 
-@dataclass
+@dataclass(slots=True)
 class BinOp(AST):
     op: str
     left: AST
     right: AST
 
-@dataclass
+@dataclass(slots=True)
 class Number(AST):
     val: int | float 
 
-@dataclass
+@dataclass(slots=True)
 class UnOp(AST):
     op: str
     right: AST
     
-@dataclass
+@dataclass(slots=True)
 class If(AST):
     condition: AST
     then_body: AST
     else_body: AST
 
-@dataclass
+@dataclass(slots=True)
 class IfUnM(AST):
     condition: AST
     then_body: AST
-@dataclass
+@dataclass(slots=True)
 class Let(AST):
     var: AST
     e1: Optional[AST]
 
-@dataclass
+@dataclass(slots=True)
 class Assign(AST):
     var: AST
     e1: AST
 
-@dataclass
+@dataclass(slots=True)
 class Variable(AST):
     varName: str
     id: int = None
+    depth: int = None   # lexical address assigned by resolve(): frame depth and
+    slot: int = None    # slot index within that frame
 
-@dataclass
+@dataclass(slots=True)
 class LetFun(AST):
     name: AST   # considering functions as first-class just like variables else it'll be str
     params: List[AST]
     body: AST
+    captures: dict = None   # set by resolve(): depth -> slots the body uses, for every enclosing frame
+    assigns: bool = False   # whether the body assigns one of them (nested functions aside)
 
-@dataclass
+@dataclass(slots=True)
 class CallFun(AST):
     fn: AST     # considering functions as first-class just like variables else it'll be str
     args: List[AST]
+    tail: bool = False  # set by resolve() when the call is the value of a `return`
     
-@dataclass
+@dataclass(slots=True)
 class FunObj:
     params: List[AST]
     body: AST
-    env: Environment
+    env: List[dict]     # the variables it uses of each enclosing frame, copied at definition
     entry: Optional[int] = None 
+    assigns: bool = False   # so every call copies them again
     
-@dataclass
+@dataclass(slots=True)
 class Statements(AST):
     stmts: List[AST]
+    size: int = None    # number of slots in the block's frame
     
-@dataclass
+@dataclass(slots=True)
 class PrintStmt(AST):
     expr: AST
     
-@dataclass
+@dataclass(slots=True)
 class ReturnStmt(AST):
     expr: Optional[AST]
     
-@dataclass
+@dataclass(slots=True)
 class Program(AST):
     decls: List[AST]
+    size: int = None    # number of slots in the global frame
 
 class ParseErr(Exception):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class StringLiteral(AST):
     val: str
\ No newline at end of file
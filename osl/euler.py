@@ -0,0 +1,75 @@
+# The programs of eulerProblems.py with the value each one logs, shared by
+# the benchmarks and test_unit_tests.py
+
+EULER = {
+    "Problem 1": ("""
+fn F(x, s) {
+    if (x = 1000) return s;
+    if (x % 3 = 0)
+        return F(x + 1, s + x);
+    if (x % 5 = 0)
+        return F(x + 1, s + x);
+    return F(x + 1, s);
+}
+log F(0, 0);
+""", 233168),
+    "Problem 2": ("""
+fn fib(a, b, s) {
+    if (a >= 4000000) return s;
+    if (a % 2 = 0)
+        return fib(b, a + b, s + a);
+    return fib(b, a + b, s);
+}
+log fib(0, 1, 0);
+""", 4613732),
+    "Problem 3": ("""
+fn prime(n, i) {
+    if (i * i > n) return n;
+    if (n % i = 0)
+        return prime(n / i, i);
+    return prime(n, i + 1);
+}
+var n := 600851475143;
+log prime(n, 2);
+""", 6857),
+    "Problem 4": ("""
+fn isPal(n, rev, org) {
+    if (n = 0)
+    {
+        if (org = rev) return 1;
+        return 0;
+    }
+    return isPal(n/10, rev*10 + n%10, org);
+}
+fn F(i, j, maxPal) {
+    if (i < 100) return maxPal;
+    if (j < 100) return F(i - 1, i - 1, maxPal);
+    var prod := i * j;
+    if ((prod > maxPal) && (isPal(prod, 0, prod)))
+        maxPal := prod;
+    return F(i, j - 1, maxPal);
+}
+log F(999, 999, 0);
+""", 906609),
+    "Problem 5": ("""
+fn gcd(a, b) {
+    if (b = 0) return a;
+    return gcd(b, a % b);
+}
+fn lcm(a, b) {
+    return a * b / gcd(a, b);
+}
+fn F(n, i) {
+    if (i = 1) return n;
+    return F(lcm(n, i - 1), i - 1);
+}
+log F(1, 20);
+""", 232792560),
+    "Problem 6": ("""
+fn F(n, sum, sumSq) {
+    if (n = 0) return sum * sum - sumSq;
+    return F(n - 1, sum + n, sumSq + n * n);
+}
+log F(100, 0, 0);
+""", 25164150),
+}
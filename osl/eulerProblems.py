@@ -3,7 +3,7 @@ import time
 import sys
 from colorama import Fore, Style
 from codegen import *
-from vm import StackVM, Code
+from vm import StackVM
 
 sys.setrecursionlimit(100000000)
 
@@ -11,11 +11,9 @@ def run_test(exp, expected, label):
     print(f"\n{label} osl Code:")
     print(exp)
     start_time = time.time()
-    result = codegen(resolve(parse(exp)))
+    code = codegen(fold(resolve(parse(exp))))
     end_time = time.time() - start_time
 
-    code = Code(bytecode=result)
-
     stack = StackVM(code)
     t2 = time.time()
     result = stack.execute()
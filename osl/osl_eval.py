@@ -1,17 +1,19 @@
 from osl_parser import *
 
-def e(tree: AST, env: Environment = None) -> int | float | bool:
+def e(tree: AST, env: List[List] = None) -> int | float | bool:
+    # env is the list of live frames, env[depth][slot] being a resolved variable
     if env is None:
-        env = Environment()
-        
-    def e_(tree: AST):
-        return e(tree, env)
-    
+        env = []
+    return trampoline(_e(tree, env))
+
+def _e(tree: AST, env: List[List]):
+    # e() as a generator, see trampoline()
     match tree:
-        case Program(decls):
+        case Program(decls, size):
+            env.append([None] * size)
             res = None
             for decl in decls:
-                res = e_(decl)
+                res = yield _e(decl, env)
             return res
         
         case Number(val):
@@ -20,89 +22,88 @@ def e(tree: AST, env: Environment = None) -> int | float | bool:
         case StringLiteral(val):
             return val
         
-        case Variable(varName, i):
-            return env.get(f"{varName}:{i}")
+        case Variable(_, _, depth, slot):
+            return env[depth][slot]
         
-        case Let(Variable(varName, i), e1):
-            v1 = e_(e1) if e1 else None
-            env.add(f"{varName}:{i}", v1)
+        case Let(Variable(_, _, depth, slot), e1):
+            env[depth][slot] = (yield _e(e1, env)) if e1 else None
             return None
         
-        case Assign(Variable(varName, i), e1):
-            v1 = e_(e1)
-            env.update(f"{varName}:{i}", v1)
+        case Assign(Variable(_, _, depth, slot), e1):
+            env[depth][slot] = yield _e(e1, env)
             return None
         
-        case LetFun(Variable(varName, i), params, body):
-            # Closure -> Copy of Environment taken along with the declaration!
-            funObj = FunObj(params, body, None)
-            env.add(f"{varName}:{i}", funObj)
-            funObj.env = env.copy()
+        case LetFun(Variable(_, _, depth, slot), params, body, captures, assigns):
+            # Closure -> Copy of the variables it uses taken along with the declaration!
+            funObj = FunObj(params, body, None, assigns=assigns)
+            env[depth][slot] = funObj
+            funObj.env = [{s: frame[s] for s in slots} for frame, slots in zip(env, captures.values())]
             return None
         
-        case CallFun(Variable(varName, i), args):
-            fun = env.get(f"{varName}:{i}")
-            rargs = [e_(arg) for arg in args]
+        case CallFun(Variable(_, _, depth, slot), args):
+            fun = env[depth][slot]
+            rargs = []
+            for arg in args:
+                rargs.append((yield _e(arg, env)))
             
-            # use the environment that was copied when the function was defined
-            call_env = fun.env.copy()
-            call_env.enter_scope()
-            for param, arg in zip(fun.params, rargs):
-                call_env.add(f"{param.varName}:{param.id}", arg)
+            # use the variables copied when the function was defined, again
+            # copied if it assigns them; the arguments fill the parameter
+            # frame in declaration order
+            call_env = [*map(dict, fun.env), rargs] if fun.assigns else fun.env + [rargs]
             
-            rbody = e(fun.body, call_env)
+            rbody = yield _e(fun.body, call_env)
             return rbody
         
-        case Statements(stmts):
-            env.enter_scope()
+        case Statements(stmts, size):
+            env.append([None] * size)
             res = None
-            for i, stmt in enumerate(stmts):
-                res = e_(stmt)
+            for stmt in stmts:
+                res = yield _e(stmt, env)
                 if res is not None:
-                    env.exit_scope()
+                    env.pop()
                     return res
-            env.exit_scope()
+            env.pop()
             return res
         
         case PrintStmt(expr):
-            print(e_(expr))
+            print((yield _e(expr, env)))
             return
         
         case ReturnStmt(expr):
             if expr:
-                return e_(expr)
+                return (yield _e(expr, env))
             return None
             
-        case BinOp("+", left, right): return e_(left) + e_(right)
-        case BinOp("*", left, right): return e_(left) * e_(right)
+        case BinOp("+", left, right): return (yield _e(left, env)) + (yield _e(right, env))
+        case BinOp("*", left, right): return (yield _e(left, env)) * (yield _e(right, env))
         case BinOp("/", left, right): 
-            left_val = e_(left)
-            right_val = e_(right)
+            left_val = yield _e(left, env)
+            right_val = yield _e(right, env)
             if isinstance(left_val, int) and isinstance(right_val, int):
                 return left_val // right_val
             return left_val / right_val
-        case BinOp("^", left, right): return e_(left) ** e_(right)
-        case BinOp("-", left, right): return e_(left) - e_(right)
-        case BinOp("<", left, right): return e_(left) < e_(right)
-        case BinOp(">", left, right): return e_(left) > e_(right)
-        case BinOp("<=", left, right): return e_(left) <= e_(right)
-        case BinOp(">=", left, right): return e_(left) >= e_(right)
-        case BinOp("=", left, right): return e_(left) == e_(right)
-        case BinOp("!=", left, right): return e_(left) != e_(right)
-        case BinOp("%", left, right): return e_(left) % e_(right)
-        case BinOp("||", left, right): return e_(left) or e_(right)
-        case BinOp("&&", left, right): return e_(left) and e_(right)
+        case BinOp("^", left, right): return (yield _e(left, env)) ** (yield _e(right, env))
+        case BinOp("-", left, right): return (yield _e(left, env)) - (yield _e(right, env))
+        case BinOp("<", left, right): return (yield _e(left, env)) < (yield _e(right, env))
+        case BinOp(">", left, right): return (yield _e(left, env)) > (yield _e(right, env))
+        case BinOp("<=", left, right): return (yield _e(left, env)) <= (yield _e(right, env))
+        case BinOp(">=", left, right): return (yield _e(left, env)) >= (yield _e(right, env))
+        case BinOp("=", left, right): return (yield _e(left, env)) == (yield _e(right, env))
+        case BinOp("!=", left, right): return (yield _e(left, env)) != (yield _e(right, env))
+        case BinOp("%", left, right): return (yield _e(left, env)) % (yield _e(right, env))
+        case BinOp("||", left, right): return (yield _e(left, env)) or (yield _e(right, env))
+        case BinOp("&&", left, right): return (yield _e(left, env)) and (yield _e(right, env))
         
-        case UnOp("-", right): return -e_(right)
-        case UnOp("\u221a", right): return e_(right) ** 0.5
+        case UnOp("-", right): return -(yield _e(right, env))
+        case UnOp("\u221a", right): return (yield _e(right, env)) ** 0.5
         
         case If(condition, then_body, else_body): 
-            if e_(condition):
-                return e_(then_body) 
+            if (yield _e(condition, env)):
+                return (yield _e(then_body, env)) 
             else:
-                return e_(else_body)
+                return (yield _e(else_body, env))
         
         case IfUnM(condition, then_body):
-            if e_(condition):
-                return e_(then_body)
+            if (yield _e(condition, env)):
+                return (yield _e(then_body, env))
             return None
\ No newline at end of file
@@ -1,109 +1,76 @@
 from collections.abc import Iterator
+import re
+from sys import intern
+from json.decoder import scanstring
 from cosl import *
 
-def lex(s: str) -> Iterator[Token]:
-    i = 0
-    prev_token = None
+KEYWORDS = {"if", "else", "var", "in", "fn", "log", "return"}
 
-    while True:
-        while i < len(s) and s[i].isspace():
-            i += 1
+# One alternation scans the whole source. Whitespace and comments are skipped
+# in front of every token, and the group that matches names the token; a '"'
+# that does not start a complete string literal falls through to ERROR. As
+# END or ERROR match wherever the skip stops, it is never backtracked into.
+TOKEN_RE = re.compile(r"""
+    (?:\s+|//[^\n]*)*
+    (?:
+        (?P<CALL>[^\W\d]\w*)(?=\()
+      | (?P<NAME>[^\W\d]\w*)
+      | (?P<STRING>"(?:[^"\\]|\\.)*")
+      | (?P<NUMBER>\d[\d.]*)
+      | (?P<OP><=|>=|!=|\|\||&&|:=|[-+*/^()<>=%\u221a,{};])
+      | (?P<END>\Z)
+      | (?P<ERROR>.)
+    )
+""", re.VERBOSE | re.DOTALL)
 
-        if i >= len(s):
-            return
+def lex(s: str) -> Iterator[Token]:
+    prev_token = None
 
-        if s[i].isalpha() or s[i] == '_':
-            start = i
-            while i < len(s) and (s[i].isalpha() or s[i].isdigit() or s[i] == '_'):
-                i += 1
-                name = s[start:i]
+    for m in TOKEN_RE.finditer(s):
+        kind = m.lastgroup
+        text = m.group(kind)
+        start, end = m.span(kind)
 
-            if name in {"if", "else", "var", "in", "fn", "log", "return"}:
-                prev_token = KeyWordToken(name)
-                yield prev_token
+        if kind == "NAME" or kind == "CALL":
+            text = intern(text)
+            if text in KEYWORDS:
+                prev_token = Token(KEYWORD, text, start, end)
 
             # If preceded by `fn`, it's a function definition
-            elif isinstance(prev_token, KeyWordToken) and prev_token.op == "fn":
-                prev_token = VariableToken(name)
-                yield prev_token
+            elif prev_token is not None and prev_token.kind == KEYWORD and prev_token.text == "fn":
+                prev_token = Token(VARIABLE, text, start, end)
 
             # If followed by '(', it's a function call
-            elif i < len(s) and s[i] == "(":
-                prev_token = FunCallToken(name)
-                yield prev_token
+            elif kind == "CALL":
+                prev_token = Token(FUNCALL, text, start, end)
 
             else:
-                prev_token = VariableToken(name)
-                yield prev_token
-        
-        elif s[i] == '/' and i + 1 < len(s) and s[i + 1] == '/':
-            i += 2
-            while i < len(s) and s[i] != '\n':
-                i += 1
-        
-        elif s[i] == '"':
-            i += 1
-            start = i
-            string = ""
-            while i < len(s):
-                char = s[i]
-                if char == '"':
-                    i += 1
-                    yield StringToken(string)
-                    break
-                if char == '\\':
-                    i += 1
-                    if i >= len(s):
-                        raise ValueError("Unterminated string")
-                    escape_char = s[i]
-                    if escape_char == '"':
-                        string += '"'
-                    elif escape_char == '\\':
-                        string += '\\'
-                    elif escape_char == '/':
-                        string += '/'
-                    elif escape_char == 'b':
-                        string += '\b'
-                    elif escape_char == 'f':
-                        string += '\f'
-                    elif escape_char == 'n':
-                        string += '\n'
-                    elif escape_char == 'r':
-                        string += '\r'
-                    elif escape_char == 't':
-                        string += '\t'
-                    elif escape_char == 'u':
-                        if i + 4 >= len(s):
-                            raise ValueError("Unterminated unicode escape sequence")
-                        hex_value = s[i+1:i+5]
-                        if all(c in '0123456789abcdefABCDEF' for c in hex_value):
-                            string += chr(int(hex_value, 16))
-                            i += 4
-                        else:
-                            raise ValueError(f"Invalid unicode escape sequence at index {i}: \\u{hex_value}")
-                    else:
-                        raise ValueError(f"Invalid escape character at index {i}: \\{escape_char}")
-                else:
-                    string += char
-                i += 1
-            else:
-                raise ValueError("Unterminated string")
-        
-        elif s[i].isdigit():
-            start = i
-            while i < len(s) and (s[i].isdigit() or s[i] == '.'):
-                i += 1
-            prev_token = NumberToken(s[start:i])
+                prev_token = Token(VARIABLE, text, start, end)
             yield prev_token
 
-        else:
-            if s[i:i+2] in {"<=", ">=", "!=", "||", "&&", ":="}:
-                prev_token = OperatorToken(s[i:i+2])
-                yield prev_token
-                i += 2
-            elif s[i] in {'+', '*', '/', '^', '-', '(', ')', '<', '>', '=', '%', '\u221a', ",", "{", "}", ";"}:
-                prev_token = OperatorToken(s[i])
-                yield prev_token
-                i += 1
+        elif kind == "OP":
+            prev_token = Token(OPERATOR, intern(text), start, end)
+            yield prev_token
+
+        elif kind == "NUMBER":
+            prev_token = Token(NUMBER, intern(text), start, end)
+            yield prev_token
+
+        elif kind == "STRING":
+            if '\\' in text:
+                # the escapes are JSON's, so let the json module's scanner decode them
+                try:
+                    text = scanstring(s, start + 1, False)[0]
+                except ValueError as err:
+                    raise ValueError(f"Invalid escape sequence in string at index {err.pos}") from None
+                yield Token(STRING, text, start, end)
             else:
-                raise ParseErr(f"Unexpected character: {s[i]} at position {i}")
\ No newline at end of file
+                yield Token(STRING, text[1:-1], start, end)
+
+        elif kind == "END":
+            return
+
+        else:
+            if text == '"':
+                raise ValueError("Unterminated string")
+            raise ParseErr(f"Unexpected character: {text} at position {start}")
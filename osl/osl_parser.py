@@ -1,32 +1,73 @@
 from osl_lexer import *
-from more_itertools import peekable
+from dataclasses import fields
+import operator
 
-cnt = 0
-def fresh():
-    global cnt
-    cnt = cnt + 1
-    return cnt
+def trampoline(gen):
+    # Runs a pass written as a generator, where `value = yield child` has the
+    # child generator run first and sends back what it returns. Suspended
+    # parents wait on a list instead of the Python stack, so a pass over a tree
+    # of any depth needs only a few Python frames.
+    stack = []
+    value = None
+    while True:
+        try:
+            child = gen.send(value)
+        except StopIteration as stop:
+            if not stack:
+                return stop.value
+            gen = stack.pop()
+            value = stop.value
+        else:
+            stack.append(gen)
+            gen = child
+            value = None
+
+# binding power of the binary operators of expB; ^ groups to the right,
+# comparisons do not chain and the rest group to the left
+BINARY_PRECEDENCE = {
+    "||": 1, "&&": 1,
+    "<": 2, ">": 2, "<=": 2, ">=": 2, "=": 2, "!=": 2,
+    "+": 3, "-": 3,
+    "*": 4, "/": 4, "%": 4,
+    "^": 5,
+}
+RIGHT_ASSOCIATIVE = {"^"}
+NON_ASSOCIATIVE = {"<", ">", "<=", ">=", "=", "!="}
 
 def parse(s: str) -> AST:
-    t = peekable(lex(s))
-    i = 0
+    # the whole token stream up front, read through a cursor
+    tokens = list(lex(s))
+    n = len(tokens)
+    pos = 0
+    
+    def where(token: Token = None) -> str:
+        # line and column of a token, or of the end of the input
+        pos = token.start if token is not None else len(s)
+        line = s.count("\n", 0, pos) + 1
+        column = pos - s.rfind("\n", 0, pos)
+        return f"line {line}, column {column}"
     
-    def consume(expected_type=None, expected_value=None):
-        nonlocal i
-        token = next(t, None)
-        if token is None:
-            raise ParseErr(f"Unexpected end of input at index {i}")
-        if expected_type and not isinstance(token, expected_type):
-            raise ParseErr(f"Expected {expected_type.__name__} at index {i}, got {type(token).__name__}")
-        if expected_value:
-            actual_value = getattr(token, "op", None) or getattr(token, "varName", None) or getattr(token, "val", None)
-            if actual_value != expected_value:
-                raise ParseErr(f"Expected '{expected_value}' at index {i}, got '{actual_value}'")
-        i += 1
+    def consume(kind: int = None, text: str = None) -> Token:
+        nonlocal pos
+        if pos >= n:
+            raise ParseErr(f"Unexpected end of input at {where()}")
+        token = tokens[pos]
+        pos += 1
+        if kind is not None and token.kind != kind:
+            raise ParseErr(f"Expected {KIND_NAMES[kind]} at {where(token)}, got {KIND_NAMES[token.kind]} '{token.text}'")
+        if text is not None and token.text != text:
+            raise ParseErr(f"Expected '{text}' at {where(token)}, got '{token.text}'")
         return token
     
-    def peek():
-        return t.peek(None)
+    def peek(k: int = 0) -> Optional[Token]:
+        # the k-th token after the cursor, None past the end
+        return tokens[pos + k] if pos + k < n else None
+    
+    def at(kind: int, text: str) -> bool:
+        if pos >= n:
+            return False
+        token = tokens[pos]
+        return token.kind == kind and token.text == text
     
     def parse_program():
         decls = []
@@ -35,282 +76,443 @@ def parse(s: str) -> AST:
         return Program(decls)
     
     def parse_declaration():
-        match peek():
-            case KeyWordToken("fn"):
-                return parse_func()
-            case KeyWordToken("var"):
-                return parse_let()
-            case _:
-                return parse_statement()
+        if at(KEYWORD, "fn"):
+            return parse_func()
+        if at(KEYWORD, "var"):
+            return parse_let()
+        return parse_statement()
             
     def parse_func():
-        consume(KeyWordToken, "fn")
-        func_name = consume(VariableToken)
+        consume(KEYWORD, "fn")
+        func_name = consume(VARIABLE)
         
-        consume(OperatorToken, "(")
+        consume(OPERATOR, "(")
         args = []
-        if peek() != OperatorToken(")"):
+        if not at(OPERATOR, ")"):
             while True:
-                args.append(Variable(consume(VariableToken).varName)) # what else otherwise in the parameter list
-                if peek() == OperatorToken(","):
-                    consume(OperatorToken, ",")
+                args.append(Variable(consume(VARIABLE).text)) # what else otherwise in the parameter list
+                if at(OPERATOR, ","):
+                    consume(OPERATOR, ",")
                 else:
                     break
-        consume(OperatorToken, ")")
+        consume(OPERATOR, ")")
         
         body = parse_block()
 
-        return LetFun(Variable(func_name.varName), args, body)
+        return LetFun(Variable(func_name.text), args, body)
     
     def parse_let():
-        consume(KeyWordToken, "var")
-        var = Variable(consume(VariableToken).varName)
+        consume(KEYWORD, "var")
+        var = Variable(consume(VARIABLE).text)
         e1 = None
-        if peek() == OperatorToken(":="):
-            consume(OperatorToken, ":=")
+        if at(OPERATOR, ":="):
+            consume(OPERATOR, ":=")
             e1 = parse_expression()
-        consume(OperatorToken, ";")
+        consume(OPERATOR, ";")
         return Let(var, e1)
     
     def parse_statement():
-        match peek():
-            case KeyWordToken("if"):
-                return parse_if()
-            case KeyWordToken("log"):
-                consume(KeyWordToken, "log")
-                # consume(OperatorToken, "(")
-                expr = parse_expression()
-                # consume(OperatorToken, ")")
-                consume(OperatorToken, ";")
-                return PrintStmt(expr)
-            case KeyWordToken("return"):
-                consume(KeyWordToken, "return")
-                if peek() != OperatorToken(";"):
-                    expr = parse_expression()
-                else:
-                    expr = None
-                consume(OperatorToken, ";")
-                return ReturnStmt(expr)
-            case OperatorToken("{"):
-                return parse_block()
-            case _:
+        if at(KEYWORD, "if"):
+            return parse_if()
+        if at(KEYWORD, "log"):
+            consume(KEYWORD, "log")
+            # consume(OPERATOR, "(")
+            expr = parse_expression()
+            # consume(OPERATOR, ")")
+            consume(OPERATOR, ";")
+            return PrintStmt(expr)
+        if at(KEYWORD, "return"):
+            consume(KEYWORD, "return")
+            if not at(OPERATOR, ";"):
                 expr = parse_expression()
-                consume(OperatorToken, ";")
-                return expr
+            else:
+                expr = None
+            consume(OPERATOR, ";")
+            return ReturnStmt(expr)
+        if at(OPERATOR, "{"):
+            return parse_block()
+        expr = parse_expression()
+        consume(OPERATOR, ";")
+        return expr
         
     def parse_if():
-        consume(KeyWordToken, "if")
+        consume(KEYWORD, "if")
         condition = parse_expression()
         then_body = parse_statement()
-        if peek() == KeyWordToken("else"):
-            consume(KeyWordToken, "else")
+        if at(KEYWORD, "else"):
+            consume(KEYWORD, "else")
             else_body = parse_statement()
             return If(condition, then_body, else_body)
         return IfUnM(condition, then_body)
     
     def parse_block():
-        consume(OperatorToken, "{")
+        consume(OPERATOR, "{")
         decls = []
-        while peek() != OperatorToken("}"):
+        while not at(OPERATOR, "}"):
             decl = parse_declaration()
             decls.append(decl)
-        consume(OperatorToken, "}")
+        consume(OPERATOR, "}")
         return Statements(decls) if decls else Statements([])
     
     def parse_expression():
         # expression -> expB | assignment
         # first parse the lhs, if it's a variable and next token is ':=' then it's an assignment
         # otherwise it's an expB so return it as is.
-        ast = parse_bool()
-        if not isinstance(ast, Variable) and peek() == OperatorToken(":="):
-            raise ParseErr(f"Expected variable on the left side of assignment := operator at index {i}")
-        if isinstance(ast, Variable) and peek() == OperatorToken(":="):
-            consume(OperatorToken, ":=")
-            e1 = parse_bool()
+        ast = parse_binary()
+        if not isinstance(ast, Variable) and at(OPERATOR, ":="):
+            raise ParseErr(f"Expected variable on the left side of assignment := operator at {where(peek())}")
+        if isinstance(ast, Variable) and at(OPERATOR, ":="):
+            consume(OPERATOR, ":=")
+            e1 = parse_binary()
             return Assign(ast, e1)
         return ast
     
-    def parse_bool():
-        ast = parse_comparison()
-        while True:
-            match peek():
-                case OperatorToken("||"):
-                    consume()
-                    ast = BinOp("||", ast, parse_comparison())
-                case OperatorToken("&&"):
-                    consume()
-                    ast = BinOp("&&", ast, parse_comparison())
-                case _:
-                    return ast
-
-    def parse_comparison():
-        ast = parse_add()
-        match peek():
-            case OperatorToken(op) if op in {"<", ">", "<=", ">=", "=", "!="}:
-                consume()
-                return BinOp(op, ast, parse_add())
-            case _:
-                return ast
-    
-    def parse_add():
-        ast = parse_mul()
-        while True:
-            match peek():
-                case OperatorToken('+'):
-                    consume()
-                    ast = BinOp('+', ast, parse_mul())
-                case OperatorToken('-'):
-                    consume()
-                    ast = BinOp('-', ast, parse_mul())
-                case _:
-                    return ast
- 
-    def parse_mul():
-        ast = parse_exponentiation()
-        while True:
-            match peek():
-                case OperatorToken('*'):
-                    consume()
-                    ast = BinOp("*", ast, parse_exponentiation())
-                case OperatorToken('/'):
-                    consume()
-                    ast = BinOp("/", ast, parse_exponentiation())
-                case OperatorToken("%"):
-                    consume()
-                    ast = BinOp("%", ast, parse_exponentiation())
-                case _:
-                    return ast
+    def next_op(ops) -> Optional[str]:
+        # the next token's text if it is one of the operators in ops
+        if pos < n:
+            token = tokens[pos]
+            if token.kind == OPERATOR and token.text in ops:
+                return token.text
+        return None
     
-    def parse_exponentiation():
+    def parse_binary(min_precedence: int = 1):
+        # precedence climbing: this loop takes the operators binding at least as
+        # tightly as min_precedence, the recursive call the tighter right operand
+        nonlocal pos
         ast = parse_atom()
-        while True:
-            match peek():
-                case OperatorToken('^'):
-                    consume()
-                    ast = BinOp("^", ast, parse_exponentiation())
-                case _:
-                    return ast
+        while pos < n:
+            token = tokens[pos]
+            if token.kind != OPERATOR:
+                break
+            op = token.text
+            precedence = BINARY_PRECEDENCE.get(op, 0)
+            if precedence < min_precedence:
+                break
+            pos += 1
+            if op in RIGHT_ASSOCIATIVE:
+                ast = BinOp(op, ast, parse_binary(precedence))
+            else:
+                ast = BinOp(op, ast, parse_binary(precedence + 1))
+                if op in NON_ASSOCIATIVE and next_op(NON_ASSOCIATIVE):
+                    raise ParseErr(f"Comparisons do not chain at {where(peek())}")
+        return ast
 
     def parse_atom():
-        match peek():
-            case NumberToken(v):
-                consume()
-                val = float(v) if '.' in v else int(v)
-                return Number(val)
-            
-            case StringToken(v):
-                consume()
-                return StringLiteral(v)
-            
-            case VariableToken(varName):
-                consume()
-                return Variable(varName)
-            
-            case FunCallToken(_):
-                fn_name = consume(FunCallToken).funName
-                consume(OperatorToken, "(")
-                args = []
-                if peek() != OperatorToken(")"):
-                    while True:
-                        args.append(parse_expression())
-                        if peek() == OperatorToken(","):
-                            consume(OperatorToken, ",")
-                        else:
-                            break
-                consume(OperatorToken, ")")
-                return CallFun(Variable(fn_name), args)
-            
-            case OperatorToken('-'):
-                consume()
-                return UnOp("-", parse_atom())
-            
-            case OperatorToken('\u221a'):
-                consume()
-                return UnOp("\u221a", parse_atom())
-            
-            case OperatorToken("("):
-                consume()
-                ast = parse_expression()
-                consume(OperatorToken, ")")
-                return ast
-            case _:
-                raise ParseErr(f"Unexpected token at index {i}")
+        nonlocal pos
+        token = tokens[pos] if pos < n else None
+        kind = token.kind if token is not None else None
+        
+        if kind == NUMBER:
+            pos += 1
+            v = token.text
+            val = float(v) if '.' in v else int(v)
+            return Number(val)
+        
+        if kind == STRING:
+            pos += 1
+            return StringLiteral(token.text)
+        
+        if kind == VARIABLE:
+            pos += 1
+            return Variable(token.text)
+        
+        if kind == FUNCALL:
+            fn_name = consume(FUNCALL).text
+            consume(OPERATOR, "(")
+            args = []
+            if not at(OPERATOR, ")"):
+                while True:
+                    args.append(parse_expression())
+                    if at(OPERATOR, ","):
+                        consume(OPERATOR, ",")
+                    else:
+                        break
+            consume(OPERATOR, ")")
+            return CallFun(Variable(fn_name), args)
+        
+        if kind == OPERATOR and token.text in ("-", "\u221a"):
+            consume()
+            return UnOp(token.text, parse_atom())
+        
+        if kind == OPERATOR and token.text == "(":
+            consume()
+            ast = parse_expression()
+            consume(OPERATOR, ")")
+            return ast
+        
+        raise ParseErr(f"Unexpected token at {where(token)}")
 
-    return parse_program()
+    try:
+        return parse_program()
+    finally:
+        # the parse_* functions refer to each other, so they only go away with
+        # the cycle collector; drop the tokens now rather than then
+        tokens = None
+
+def mark_tail_calls(body: AST) -> AST:
+    # a `return f(...)` inside a function body ends that function, so codegen can
+    # emit it as TAIL_CALL; nested functions are marked when their own LetFun is resolved
+    pending = [body]
+    while pending:
+        match pending.pop():
+            case Statements(stmts):
+                pending.extend(stmts)
+            case If(_, then_body, else_body):
+                pending.append(then_body)
+                pending.append(else_body)
+            case IfUnM(_, then_body):
+                pending.append(then_body)
+            case ReturnStmt(CallFun() as call):
+                call.tail = True
+    return body
 
 def resolve(program: AST, env: Environment = None) -> AST:
+    # Every name is bound to (id, slot) where slot is its index in the frame of the
+    # scope it is declared in, so e() can address it as frames[depth][slot].
     if env is None:
         env = Environment()
     
-    def resolve_(program: AST) -> AST:
-        return resolve(program, env)
+    def declare(varName: str) -> Variable:
+        slot = len(env.envs[-1])
+        env.add(varName, (i := env.fresh(), slot))
+        return Variable(varName, i, len(env.envs) - 1, slot)
+    
+    # [depth of its parameters, captures, assigns] of every LetFun being
+    # resolved, the innermost last
+    functions = []
+    
+    def lookup(varName: str, assigned: bool = False) -> Variable:
+        depth, (i, slot) = env.locate(varName)
+        # a variable declared outside a function is captured by it, and so by
+        # every function around it that it is outside of too
+        for fun in reversed(functions):
+            if depth >= fun[0]:
+                break
+            fun[1][depth].add(slot)
+        if assigned and functions and depth < functions[-1][0]:
+            functions[-1][2] = True
+        return Variable(varName, i, depth, slot)
+
+    def resolve_(program: AST):
+        # one node, as a generator run by trampoline()
+        match program:
+            case Program(decls):
+                new_decls = []
+                for decl in decls:
+                    new_decls.append((yield resolve_(decl)))
+                return Program(new_decls, len(env.envs[-1]))
+        
+            case Variable(varName, _):
+                return lookup(varName)
+        
+            case Number(_) as N:
+                return N
+        
+            case StringLiteral(_) as S:
+                return S
+        
+            case Let(Variable(varName, _), e1):
+                re1 = (yield resolve_(e1)) if e1 else None
+                return Let(declare(varName), re1)
+        
+            case Assign(Variable(varName, _), e1):
+                re1 = yield resolve_(e1)
+                return Assign(lookup(varName, assigned=True), re1)
+        
+            case LetFun(Variable(varName, _), params, body):
+                name = declare(varName)
+                env.enter_scope()
+                fun = [name.depth + 1, {depth: set() for depth in range(name.depth + 1)}, False]
+                functions.append(fun)
+                new_params = [declare(param.varName) for param in params]
+                new_body = mark_tail_calls((yield resolve_(body)))
+                functions.pop()
+                env.exit_scope()
+                captures = {depth: tuple(sorted(slots)) for depth, slots in fun[1].items()}
+                return LetFun(name, new_params, new_body, captures, fun[2])
+        
+            case Statements(stmts):
+                env.enter_scope()
+                new_stmts = []
+                for stmt in stmts:
+                    new_stmts.append((yield resolve_(stmt)))
+                size = len(env.envs[-1])
+                env.exit_scope()
+                return Statements(new_stmts, size)
+        
+            case CallFun(fn, args):
+                rfn = yield resolve_(fn)
+                rargs = []
+                for arg in args:
+                    rargs.append((yield resolve_(arg)))
+                return CallFun(rfn, rargs)
+        
+            case BinOp(op, left, right):
+                le = yield resolve_(left)
+                ri = yield resolve_(right)
+                return BinOp(op, le, ri)
+            case UnOp(op, right):
+                ri = yield resolve_(right)
+                return UnOp(op, ri)
+        
+            case If(condition, then_body, else_body):
+                condition = yield resolve_(condition)
+                then_body = yield resolve_(then_body)
+                else_body = yield resolve_(else_body)
+                return If(condition, then_body, else_body)
+        
+            case IfUnM(condition, then_body):
+                condition = yield resolve_(condition)
+                then_body = yield resolve_(then_body)
+                return IfUnM(condition, then_body)
+        
+            case PrintStmt(expr):
+                return PrintStmt((yield resolve_(expr)))
+        
+            case ReturnStmt(expr):
+                return ReturnStmt((yield resolve_(expr)))
+    
+    return trampoline(resolve_(program))
+
+def _div(left_val, right_val):
+    if isinstance(left_val, int) and isinstance(right_val, int):
+        return left_val // right_val
+    return left_val / right_val
+
+# the operators as plain functions, with the semantics e() gives them
+FOLD_BINOPS = {
+    "+": operator.add, "-": operator.sub, "*": operator.mul, "/": _div, "%": operator.mod,
+    "^": operator.pow,
+    "<": operator.lt, ">": operator.gt, "<=": operator.le, ">=": operator.ge,
+    "=": operator.eq, "!=": operator.ne,
+    "||": lambda l, r: l or r, "&&": lambda l, r: l and r,
+}
+FOLD_UNOPS = {
+    "-": operator.neg,
+    "\u221a": lambda r: r ** 0.5,
+}
+
+def count_nodes(tree) -> int:
+    count = 0
+    pending = [tree]
+    while pending:
+        tree = pending.pop()
+        if isinstance(tree, list):
+            pending.extend(tree)
+        elif isinstance(tree, AST):
+            count += 1
+            pending.extend(getattr(tree, f.name) for f in fields(tree))
+    return count
+
+def fold(tree: AST, stats: dict = None) -> AST:
+    """Constant folding and algebraic simplification over a resolved tree.
+    Constant operands are computed once, `if`s on a constant condition keep
+    only the branch taken, and x + 0, x - 0, 0 + x, x * 1, 1 * x and x / 1
+    become x where x is sure to be a number. Frame sizes and slots are left
+    as resolve() assigned them.
+    `stats`, if given, counts the nodes removed under "removed"."""
+    before = count_nodes(tree)
+    tree = _fold(tree) or Statements([], 0)
+    if stats is not None:
+        stats["removed"] = stats.get("removed", 0) + before - count_nodes(tree)
+    return tree
+
+def _is_int(tree: AST, val: int) -> bool:
+    # bools are ints to Python, but 0/1 from a comparison is not an identity
+    return isinstance(tree, Number) and type(tree.val) is int and tree.val == val
+
+def _is_numeric(tree: AST) -> bool:
+    # whether tree gives an int or float whatever its variables hold: "-",
+    # "/", "^" and the unary operators raise on anything else, while "+", "*"
+    # and "%" also take strings and keep bools as they are
+    match tree:
+        case Number(val):
+            return type(val) in (int, float)
+        case BinOp("-" | "/" | "^", _, _) | UnOp(_, _):
+            return True
+        case BinOp("+" | "*" | "%", left, right):
+            return _is_numeric(left) and _is_numeric(right)
+    return False
 
-    match program:
-        case Program(decls):
-            new_decls = [resolve_(decl) for decl in decls]
-            return Program(new_decls)
-        
-        case Variable(varName, _):
-            return Variable(varName, env.get(varName))
-        
-        case Number(_) as N:
-            return N
-        
-        case StringLiteral(_) as S:
-            return S
-        
-        case Let(Variable(varName, _), e1):
-            re1 = resolve_(e1) if e1 else None
-            env.add(varName, i := fresh())
-            return Let(Variable(varName, i), re1)
-        
-        case Assign(Variable(varName, _), e1):
-            re1 = resolve_(e1)
-            return Assign(Variable(varName, env.get(varName)), re1)
-        
-        case LetFun(Variable(varName, _), params, body):
-            env.add(varName, i := fresh())
-            env.enter_scope()
-            new_params = []
-            for param in params:
-                env.add(param.varName, j := fresh())
-                new_params.append(Variable(param.varName, j))
-            new_body = resolve_(body)
-            env.exit_scope()
-            return LetFun(Variable(varName, i), new_params, new_body)
-        
-        case Statements(stmts):
-            env.enter_scope()
-            stmts = [resolve_(stmt) for stmt in stmts]
-            env.exit_scope()
-            return Statements(stmts)
-        
-        case CallFun(fn, args):
-            rfn = resolve_(fn)
-            rargs = [resolve_(arg) for arg in args]
-            return CallFun(rfn, rargs)
+def _fold(tree: AST) -> Optional[AST]:
+    # None stands for a statement that folded away entirely
+    def body(tree: AST) -> AST:
+        return _fold(tree) or Statements([], 0)
+    
+    match tree:
+        case Program(decls, size):
+            decls = list(map(_fold, decls))
+            # a program's value is that of its last declaration, so one that
+            # folded away leaves an empty block, whose value is None too
+            if decls and decls[-1] is None:
+                decls[-1] = Statements([], 0)
+            return Program([d for d in decls if d is not None], size)
+        
+        case Statements(stmts, size):
+            return Statements([s for s in map(_fold, stmts) if s is not None], size)
+        
+        case Let(var, e1):
+            return Let(var, _fold(e1) if e1 else None)
+        
+        case Assign(var, e1):
+            return Assign(var, _fold(e1))
+        
+        case LetFun(name, params, fbody, captures, assigns):
+            return LetFun(name, params, body(fbody), captures, assigns)
+        
+        case CallFun(fn, args, tail):
+            return CallFun(fn, [_fold(arg) for arg in args], tail)
+        
+        case PrintStmt(expr):
+            return PrintStmt(_fold(expr))
+        
+        case ReturnStmt(expr):
+            return ReturnStmt(_fold(expr) if expr else None)
         
         case BinOp(op, left, right):
-            le = resolve_(left)
-            ri = resolve_(right)
-            return BinOp(op, le, ri)
+            left, right = _fold(left), _fold(right)
+            if isinstance(left, Number) and isinstance(right, Number):
+                try:
+                    # keep huge powers to run time rather than compute them here
+                    if op == "^" and abs(right.val) > 256:
+                        raise OverflowError
+                    val = FOLD_BINOPS[op](left.val, right.val)
+                    if not isinstance(val, complex):
+                        return Number(val)
+                except (ArithmeticError, TypeError):
+                    pass    # left for e() to raise
+            # only where the other operand is a number: True + 0 is 1, not
+            # True, and "ab" - 0 raises
+            if _is_numeric(left):
+                if op in ("+", "-") and _is_int(right, 0) or op in ("*", "/") and _is_int(right, 1):
+                    return left
+            if _is_numeric(right):
+                if op == "+" and _is_int(left, 0) or op == "*" and _is_int(left, 1):
+                    return right
+            return BinOp(op, left, right)
+        
         case UnOp(op, right):
-            ri = resolve_(right)
-            return UnOp(op, ri)
+            right = _fold(right)
+            if isinstance(right, Number):
+                try:
+                    val = FOLD_UNOPS[op](right.val)
+                    if not isinstance(val, complex):
+                        return Number(val)
+                except (ArithmeticError, TypeError):
+                    pass
+            return UnOp(op, right)
         
         case If(condition, then_body, else_body):
-            condition = resolve_(condition)
-            then_body = resolve_(then_body)
-            else_body = resolve_(else_body)
-            return If(condition, then_body, else_body)
+            condition = _fold(condition)
+            if isinstance(condition, Number):
+                return _fold(then_body if condition.val else else_body)
+            return If(condition, body(then_body), body(else_body))
         
         case IfUnM(condition, then_body):
-            condition = resolve_(condition)
-            then_body = resolve_(then_body)
-            return IfUnM(condition, then_body)
+            condition = _fold(condition)
+            if isinstance(condition, Number):
+                return _fold(then_body) if condition.val else None
+            return IfUnM(condition, body(then_body))
         
-        case PrintStmt(expr):
-            return PrintStmt(resolve_(expr))
-        
-        case ReturnStmt(expr):
-            return ReturnStmt(resolve_(expr))
\ No newline at end of file
+        case _:
+            return tree
\ No newline at end of file
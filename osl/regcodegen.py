@@ -0,0 +1,302 @@
+from codegen import *
+
+# Three-address code for the register VM (regvm.py). An instruction is a tuple
+# (op, a, b, c) and reuses the stack bytecode's opcode numbers where the
+# operation is the same; operands are register numbers unless noted:
+#   ADD .. MOD, BITWISE_AND/OR, EQ .. GE    a := b <op> c
+#   NEG                                     a := -b
+#   LOADK (PUSH_INT)                        a := constant b
+#   LOADNONE (PUSH_NONE)                    a := None
+#   MOVE (DUP)                              a := b
+#   LOAD                                    a := register c of enclosing function level b
+#   STORE                                   register b of enclosing function level a := c
+#   MAKEF                                   a := closure of function b of the function table,
+#                                           copying registers c[level] of each enclosing level
+#   CALL                                    a := (function in b)(registers c...)
+#   TAIL_CALL                               return (function in a)(registers c...)
+#   RETURN                                  return a
+#   JUMP                                    go to instruction a
+#   JUMP_IF_ZERO                            go to instruction b if a is falsy
+#   LOG                                     print a
+#   HALT                                    stop, a (or None) being the result
+
+LOADK    = PUSH_INT
+LOADNONE = PUSH_NONE
+MOVE     = DUP
+
+REG_BINOPS = {
+    "+": ADD, "-": SUB, "*": MUL, "/": DIV, "%": MOD,
+    "=": EQ, "!=": NEQ, "<": LT, ">": GT, "<=": LE, ">=": GE,
+    # like the stack bytecode, && and || do not short-circuit
+    "&&": BITWISE_AND, "||": BITWISE_OR,
+}
+
+@dataclass
+class RegFunction:
+    entry: int      # index of the first instruction
+    nparams: int
+    nregs: int
+    stores: bool = False    # whether it assigns what its closure copied, so each call copies it again
+
+@dataclass
+class RegCode:
+    instrs: List[tuple]
+    functions: List[RegFunction]
+    nregs: int      # registers of the top level
+
+class FunctionScope:
+    """Register allocation for one function (or the top level): every variable
+    declared directly in it gets a register for the whole activation, in
+    declaration order after the parameters, and temporaries are allocated above
+    them as a stack."""
+
+    def __init__(self, level: int, params: List[Variable], body: AST):
+        self.level = level
+        self.regs = {param.id: r for r, param in enumerate(params)}
+        self.declare(body)
+        self.top = self.nregs = len(self.regs)
+
+    def declare(self, tree: AST):
+        # nested function bodies get their own scope
+        match tree:
+            case Program(stmts) | Statements(stmts):
+                for stmt in stmts:
+                    self.declare(stmt)
+            case Let(Variable(_, i), _) | LetFun(Variable(_, i), _, _):
+                self.regs[i] = len(self.regs)
+            case If(_, then_body, else_body):
+                self.declare(then_body)
+                self.declare(else_body)
+            case IfUnM(_, then_body):
+                self.declare(then_body)
+
+    def temp(self) -> int:
+        r = self.top
+        self.top += 1
+        self.nregs = max(self.nregs, self.top)
+        return r
+
+def is_leaf(tree: AST) -> bool:
+    # evaluating it runs no code
+    return isinstance(tree, (Number, StringLiteral, Variable))
+
+def captured(fun: LetFun, scopes: List[FunctionScope]) -> tuple:
+    # for each enclosing level, the registers the body of fun (nested
+    # functions included) reads or assigns
+    used = [set() for _ in scopes]
+    pending = [fun.body]
+    while pending:
+        tree = pending.pop()
+        if isinstance(tree, list):
+            pending.extend(tree)
+        elif isinstance(tree, Variable):
+            for scope in scopes:
+                if tree.id in scope.regs:
+                    used[scope.level].add(scope.regs[tree.id])
+        elif isinstance(tree, AST):
+            pending.extend(getattr(tree, f.name) for f in fields(tree))
+    return tuple(tuple(sorted(regs)) for regs in used)
+
+def reg_codegen(program: Program) -> RegCode:
+    instrs = []
+    functions = []
+    pending = []    # (function index, LetFun, scopes enclosing it) still to be emitted
+
+    def emit(op, a=None, b=None, c=None) -> int:
+        instrs.append((op, a, b, c))
+        return len(instrs) - 1
+
+    def patch(at: int, target: int):
+        op, a, b, c = instrs[at]
+        instrs[at] = (op, target, b, c) if op == JUMP else (op, a, target, c)
+
+    def locate(scopes: List[FunctionScope], i: int):
+        for scope in reversed(scopes):
+            if i in scope.regs:
+                return scope.level, scope.regs[i]
+        raise NameError(f"Unresolved variable id {i}")
+
+    def operand(tree: AST, scopes: List[FunctionScope], copy: bool) -> int:
+        # expr() for an operand the instruction reads after the operands that
+        # follow it have run; if those may run code (copy), a local variable
+        # is copied to a temporary first, as that code could assign to it
+        if copy and isinstance(tree, Variable):
+            return expr(tree, scopes, scopes[-1].temp())
+        return expr(tree, scopes)
+
+    def expr(tree: AST, scopes: List[FunctionScope], dst: int = None) -> int:
+        # the register holding the value of tree, dst if given
+        scope = scopes[-1]
+
+        def into() -> int:
+            return dst if dst is not None else scope.temp()
+
+        match tree:
+            case Number(val) | StringLiteral(val):
+                r = into()
+                emit(LOADK, r, val)
+                return r
+
+            case Variable(_, i):
+                level, reg = locate(scopes, i)
+                if level == scope.level:
+                    if dst is None or dst == reg:
+                        return reg
+                    emit(MOVE, dst, reg)
+                    return dst
+                r = into()
+                emit(LOAD, r, level, reg)
+                return r
+
+            case BinOp(op, left, right) if op in REG_BINOPS:
+                mark = scope.top
+                a = operand(left, scopes, not is_leaf(right))
+                b = expr(right, scopes)
+                scope.top = mark
+                r = into()
+                emit(REG_BINOPS[op], r, a, b)
+                return r
+
+            case UnOp("-", right):
+                mark = scope.top
+                b = expr(right, scopes)
+                scope.top = mark
+                r = into()
+                emit(NEG, r, b)
+                return r
+
+            case CallFun(fn, args, tail):
+                mark = scope.top
+                # later[k]: whether an argument after the k-th may run code
+                later = [False] * (len(args) + 1)
+                for k in range(len(args) - 1, -1, -1):
+                    later[k] = later[k + 1] or not is_leaf(args[k])
+                f = operand(fn, scopes, later[0])
+                # arguments that are plain local variables are passed straight
+                # from their registers, the rest go through temporaries
+                regs = tuple(operand(arg, scopes, later[k + 1]) for k, arg in enumerate(args))
+                scope.top = mark
+                if tail:
+                    emit(TAIL_CALL, f, None, regs)
+                    return None
+                r = into()
+                emit(CALL, r, f, regs)
+                return r
+
+            case BinOp(op, _, _) | UnOp(op, _):
+                raise CompileError(f"The {op} operator is not supported by the register compiler")
+
+            case _:
+                raise CompileError(f"Cannot compile {type(tree).__name__} in an expression to register code")
+
+    def store(var: Variable, value: AST, scopes: List[FunctionScope]):
+        level, reg = locate(scopes, var.id)
+        scope = scopes[-1]
+        if level == scope.level:
+            if value is None:
+                emit(LOADNONE, reg)
+            else:
+                expr(value, scopes, reg)
+            return
+        mark = scope.top
+        if value is None:
+            r = scope.temp()
+            emit(LOADNONE, r)
+        else:
+            r = expr(value, scopes)
+        scope.top = mark
+        emit(STORE, level, reg, r)
+
+    def stmt(tree: AST, scopes: List[FunctionScope]) -> Optional[int]:
+        # returns the register holding the value of an expression statement
+        scope = scopes[-1]
+        match tree:
+            case Statements(stmts):
+                mark = scope.top
+                for s in stmts:
+                    stmt(s, scopes)
+                    scope.top = mark
+                return None
+
+            case Let(var, e1):
+                store(var, e1, scopes)
+                return None
+
+            case Assign(var, e1):
+                store(var, e1, scopes)
+                return None
+
+            case LetFun(var, params, body):
+                index = len(functions)
+                functions.append(None)
+                pending.append((index, tree, list(scopes)))
+                level, reg = locate(scopes, var.id)
+                emit(MAKEF, reg, index, captured(tree, scopes))
+                return None
+
+            case PrintStmt(expr_):
+                mark = scope.top
+                emit(LOG, expr(expr_, scopes))
+                scope.top = mark
+                return None
+
+            case ReturnStmt(expr_):
+                mark = scope.top
+                if expr_ is None:
+                    r = scope.temp()
+                    emit(LOADNONE, r)
+                else:
+                    r = expr(expr_, scopes)
+                scope.top = mark
+                # a TAIL_CALL never falls through, its callee returns for us
+                if not (isinstance(expr_, CallFun) and expr_.tail):
+                    emit(RETURN, r)
+                return None
+
+            case If(condition, then_body, else_body):
+                mark = scope.top
+                jz = emit(JUMP_IF_ZERO, expr(condition, scopes))
+                scope.top = mark
+                stmt(then_body, scopes)
+                j = emit(JUMP)
+                patch(jz, len(instrs))
+                stmt(else_body, scopes)
+                patch(j, len(instrs))
+                return None
+
+            case IfUnM(condition, then_body):
+                mark = scope.top
+                jz = emit(JUMP_IF_ZERO, expr(condition, scopes))
+                scope.top = mark
+                stmt(then_body, scopes)
+                patch(jz, len(instrs))
+                return None
+
+            case _:
+                # the value stays in a temporary until the next statement
+                return expr(tree, scopes)
+
+    top = FunctionScope(0, [], program)
+    result = None
+    for decl in program.decls:
+        top.top = len(top.regs)
+        result = stmt(decl, [top])
+    emit(HALT, result)
+
+    # function bodies follow the top level, nested ones after their parents
+    while pending:
+        index, LetFun_, scopes = pending.pop(0)
+        scope = FunctionScope(scopes[-1].level + 1, LetFun_.params, LetFun_.body)
+        entry = len(instrs)
+        stmt(LetFun_.body, scopes + [scope])
+        mark = scope.top
+        r = scope.temp()
+        # falling off the end of a body returns None
+        emit(LOADNONE, r)
+        emit(RETURN, r)
+        scope.top = mark
+        # nested bodies come later, so these are the function's own instructions
+        stores = any(instr[0] == STORE for instr in instrs[entry:])
+        functions[index] = RegFunction(entry, len(LetFun_.params), scope.nregs, stores)
+
+    return RegCode(instrs, functions, top.nregs)
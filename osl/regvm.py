@@ -0,0 +1,235 @@
+from dataclasses import dataclass
+from typing import List, Optional
+from vm import Opcode, Value, to_osl
+from regcodegen import RegCode, RegFunction, LOADK, LOADNONE, MOVE
+
+# Interpreter for the three-address code of regcodegen.py. Each activation has
+# its own list of registers; a closure keeps a copy of the registers it uses
+# of the functions it is nested in (a dict per level, the top level first),
+# taken when it is made, as e() copies the variables a function uses.
+
+class Closure:
+    __slots__ = ("fun", "env")
+
+    def __init__(self, fun: RegFunction, env: List[dict]):
+        self.fun = fun
+        self.env = env
+
+    def __repr__(self):
+        return f"Closure(entry={self.fun.entry})"
+
+@dataclass
+class RegFrame:
+    regs: List[Value]
+    env: List[List[Value]]
+    ret: Optional[int]      # instruction to return to
+    dst: Optional[int]      # caller's register for the result
+
+class RegisterVM:
+    def __init__(self, code: RegCode):
+        self.code = code
+        self.instrs = code.instrs
+        self.functions = code.functions
+        self.regs: List[Value] = [None] * code.nregs
+        self.env: List[List[Value]] = []
+        self.pc = 0
+        self.call_stack: List[RegFrame] = []
+        self.CALL_DEPTH = 10000
+        self.result: Value = None
+        # dispatch table, as in StackVM: opcode -> bound handler taking
+        # (pc, a, b, c) and returning the next pc
+        self.dispatch = [self.op_unknown] * 256
+        for op, name in HANDLERS.items():
+            self.dispatch[op] = getattr(self, name)
+
+    def execute(self):
+        instrs = self.instrs
+        dispatch = self.dispatch
+        pc = self.pc
+        while pc < len(instrs):
+            op, a, b, c = instrs[pc]
+            pc = dispatch[op](pc, a, b, c)
+        self.pc = pc
+        return to_osl(self.result)
+
+    def bind_call(self, fun: Closure, args: tuple) -> List[Value]:
+        regs = self.regs
+        new_regs = [None] * fun.fun.nregs
+        for r, arg in enumerate(args):
+            new_regs[r] = regs[arg]
+        return new_regs
+
+    def op_unknown(self, pc, a, b, c):
+        raise RuntimeError(f"Unknown opcode: {hex(self.instrs[pc][0])} at PC {pc}")
+
+    def op_halt(self, pc, a, b, c):
+        self.result = self.regs[a] if a is not None else None
+        return len(self.instrs)
+
+    def op_loadk(self, pc, a, b, c):
+        self.regs[a] = b
+        return pc + 1
+
+    def op_loadnone(self, pc, a, b, c):
+        self.regs[a] = None
+        return pc + 1
+
+    def op_move(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b]
+        return pc + 1
+
+    def op_load(self, pc, a, b, c):
+        self.regs[a] = self.env[b][c]
+        return pc + 1
+
+    def op_store(self, pc, a, b, c):
+        self.env[a][b] = self.regs[c]
+        return pc + 1
+
+    def op_add(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] + regs[c]
+        return pc + 1
+
+    def op_sub(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] - regs[c]
+        return pc + 1
+
+    def op_mul(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] * regs[c]
+        return pc + 1
+
+    def op_div(self, pc, a, b, c):
+        # as e(): ints divide to an int, anything else to a float
+        regs = self.regs
+        left, right = regs[b], regs[c]
+        regs[a] = left // right if isinstance(left, int) and isinstance(right, int) else left / right
+        return pc + 1
+
+    def op_mod(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] % regs[c]
+        return pc + 1
+
+    def op_neg(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = -regs[b]
+        return pc + 1
+
+    def op_bitwise_and(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] & regs[c]
+        return pc + 1
+
+    def op_bitwise_or(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] | regs[c]
+        return pc + 1
+
+    def op_eq(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] == regs[c]
+        return pc + 1
+
+    def op_neq(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] != regs[c]
+        return pc + 1
+
+    def op_lt(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] < regs[c]
+        return pc + 1
+
+    def op_gt(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] > regs[c]
+        return pc + 1
+
+    def op_le(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] <= regs[c]
+        return pc + 1
+
+    def op_ge(self, pc, a, b, c):
+        regs = self.regs
+        regs[a] = regs[b] >= regs[c]
+        return pc + 1
+
+    def op_jump(self, pc, a, b, c):
+        return a
+
+    def op_jump_if_zero(self, pc, a, b, c):
+        return b if not self.regs[a] else pc + 1
+
+    def op_makef(self, pc, a, b, c):
+        # stored first, so a recursive function finds itself in its copy
+        regs = self.regs
+        closure = regs[a] = Closure(self.functions[b], None)
+        closure.env = [{r: level[r] for r in used} for level, used in zip(self.env + [regs], c)]
+        return pc + 1
+
+    def op_call(self, pc, a, b, c):
+        if len(self.call_stack) >= self.CALL_DEPTH:
+            raise RuntimeError("Stack overflow")
+        fun = self.regs[b]
+        new_regs = self.bind_call(fun, c)
+        self.call_stack.append(RegFrame(self.regs, self.env, pc + 1, a))
+        self.regs = new_regs
+        self.env = [*map(dict, fun.env)] if fun.fun.stores else fun.env
+        return fun.fun.entry
+
+    def op_tail_call(self, pc, a, b, c):
+        # the callee takes over the current activation, call_stack does not grow
+        fun = self.regs[a]
+        self.regs = self.bind_call(fun, c)
+        self.env = [*map(dict, fun.env)] if fun.fun.stores else fun.env
+        return fun.fun.entry
+
+    def op_return(self, pc, a, b, c):
+        if not self.call_stack:
+            raise RuntimeError("RETURN outside function")
+        value = self.regs[a]
+        frame = self.call_stack.pop()
+        self.regs = frame.regs
+        self.env = frame.env
+        self.regs[frame.dst] = value
+        return frame.ret
+
+    def op_log(self, pc, a, b, c):
+        print(to_osl(self.regs[a]))
+        return pc + 1
+
+# opcode -> name of its RegisterVM handler
+HANDLERS = {
+    Opcode.HALT:         "op_halt",
+    LOADK:               "op_loadk",
+    LOADNONE:            "op_loadnone",
+    MOVE:                "op_move",
+    Opcode.LOAD:         "op_load",
+    Opcode.STORE:        "op_store",
+    Opcode.ADD:          "op_add",
+    Opcode.SUB:          "op_sub",
+    Opcode.MUL:          "op_mul",
+    Opcode.DIV:          "op_div",
+    Opcode.MOD:          "op_mod",
+    Opcode.NEG:          "op_neg",
+    Opcode.BITWISE_AND:  "op_bitwise_and",
+    Opcode.BITWISE_OR:   "op_bitwise_or",
+    Opcode.EQ:           "op_eq",
+    Opcode.NEQ:          "op_neq",
+    Opcode.LT:           "op_lt",
+    Opcode.GT:           "op_gt",
+    Opcode.LE:           "op_le",
+    Opcode.GE:           "op_ge",
+    Opcode.JUMP:         "op_jump",
+    Opcode.JUMP_IF_ZERO: "op_jump_if_zero",
+    Opcode.MAKEF:        "op_makef",
+    Opcode.CALL:         "op_call",
+    Opcode.TAIL_CALL:    "op_tail_call",
+    Opcode.RETURN:       "op_return",
+    Opcode.LOG:          "op_log",
+}
@@ -1,9 +1,11 @@
 from osl_eval import *
 from pprint import pprint
 import sys
+import os
 from codegen import *
 sys.setrecursionlimit(100000000)
 from visualizer import *
+from cache import CompileCache
 
 with open("code.osl") as f:
     code = f.read()
@@ -14,16 +16,23 @@ with open("code.osl") as f:
 # for i, t in enumerate(lex(code)):
 #     print(f"{i}: {t}")
 # print()
-rcode = resolve(parse(code))
+# an unchanged code.osl comes out of __oslcache__ instead of being compiled
+rcode, stats, code = CompileCache().compile(code)
 pprint(rcode)
+print(f"Constant folding removed {stats['removed']} nodes")
 # print()
 # print(e(rcode))
-# print(codegen(rcode))
-bb = bytearray(codegen(rcode))
-print(bb)
-with open("bytecode.bin", "wb") as bytecode_file:
-    bytecode_file.write(bb)
+print(code.functions, code.constants)
+bb = code.to_bytes()
+# only rewritten when it changed, so the file keeps its timestamp otherwise
+old = None
+if os.path.exists("bytecode.bin"):
+    with open("bytecode.bin", "rb") as bytecode_file:
+        old = bytecode_file.read()
+if old != bb:
+    with open("bytecode.bin", "wb") as bytecode_file:
+        bytecode_file.write(bb)
 
-result = parse_bytecode(bb)
+result = parse_bytecode(code.bytecode)
 for opcode, operand in result:
    print(f"{opcode} {operand if operand is not None else ''}")
\ No newline at end of file
@@ -0,0 +1,73 @@
+import io
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional
+from container import Code
+from vm import StackVM, Value
+
+# Runs many StackVMs in one thread, round robin, each for at most `quantum`
+# instructions per turn (see StackVM.execute(max_steps)). A long program
+# then only takes its share of the time, and every program has its own
+# limits on instructions, stack size and call depth: one that goes past
+# them, or fails, stops there and the others carry on.
+
+READY, DONE, FAILED = "ready", "done", "failed"
+
+@dataclass
+class Task:
+    name: str
+    vm: StackVM
+    max_steps: Optional[int]    # None for no limit
+    state: str = READY
+    result: Value = None
+    error: Optional[str] = None
+
+    @property
+    def output(self) -> str:
+        # what the program has logged so far
+        return self.vm.out.getvalue()
+
+class Scheduler:
+    def __init__(self, quantum: int = 1000):
+        self.quantum = quantum
+        self.tasks: List[Task] = []
+        self.ready = deque()
+
+    def spawn(self, code: Code, name: str = None, max_steps: Optional[int] = None,
+              stack_size: int = 10000, call_depth: int = 10000) -> Task:
+        """Adds a program to run, with its own VM and limits. Its LOG output is
+        kept in the task rather than printed."""
+        vm = StackVM(code)
+        vm.STACK_SIZE = stack_size
+        vm.CALL_DEPTH = call_depth
+        vm.out = io.StringIO()
+        task = Task(name if name is not None else f"task {len(self.tasks)}", vm, max_steps)
+        self.tasks.append(task)
+        self.ready.append(task)
+        return task
+
+    def step(self, task: Task):
+        """Runs one turn of task."""
+        vm = task.vm
+        budget = self.quantum
+        if task.max_steps is not None:
+            budget = min(budget, task.max_steps - vm.steps)
+        try:
+            result = vm.execute(budget)
+        except Exception as err:
+            task.state, task.error = FAILED, f"{type(err).__name__}: {err}"
+            return
+        if vm.done:
+            task.state, task.result = DONE, result
+        elif task.max_steps is not None and vm.steps >= task.max_steps:
+            task.state, task.error = FAILED, f"Step limit of {task.max_steps} reached"
+
+    def run(self) -> List[Task]:
+        """Takes turns until every task has finished or failed."""
+        ready = self.ready
+        while ready:
+            task = ready.popleft()
+            self.step(task)
+            if task.state == READY:
+                ready.append(task)
+        return self.tasks
@@ -4,17 +4,23 @@ def parse_bytecode(bytecode: bytearray):
     opcodes = {
         0x01: ("PUSH_CHAR", 1), 0x02: ("PUSH_SHORT", 2), 0x03: ("PUSH_INT", 4), 0x04: ("PUSH_LONG", 8),
         0x05: ("PUSH_FLOAT", 4), 0x06: ("PUSH_DOUBLE", 8),
+        0x07: ("PUSH_NONE", 0), 0x09: ("PUSH_CONST", 4),
         0x10: ("POP", 0), 0x11: ("DUP", 0), 0x12: ("SWAP", 0), 0x13: ("OVER", 0),
         0x20: ("ADD", 0), 0x21: ("SUB", 0), 0x22: ("MUL", 0), 0x23: ("DIV", 0), 0x24: ("MOD", 0), 0x25: ("NEG", 0),
         0x30: ("BITWISE_NOT", 0), 0x31: ("BITWISE_AND", 0), 0x32: ("BITWISE_OR", 0), 0x33: ("BITWISE_XOR", 0),
         0x40: ("EQ", 0), 0x41: ("NEQ", 0), 0x42: ("LT", 0), 0x43: ("GT", 0), 0x44: ("LE", 0), 0x45: ("GE", 0),
-        0x50: ("JUMP", 2), 0x51: ("JUMP_IF_ZERO", 2), 0x52: ("JUMP_IF_NONZERO", 2), 0x53: ("CALL", 0),
-        0x54: ("RETURN", 0), 0x55: ("HALT", 0),
+        0x50: ("JUMP", 4), 0x51: ("JUMP_IF_ZERO", 4), 0x52: ("JUMP_IF_NONZERO", 4), 0x53: ("CALL", 0),
+        0x54: ("RETURN", 0), 0x55: ("HALT", 0), 0x56: ("TAIL_CALL", 0),
         0x60: ("I2F", 0), 0x61: ("F2I", 0), 0x62: ("I2D", 0), 0x63: ("D2I", 0), 0x64: ("F2D", 0), 0x65: ("D2F", 0),
         0x70: ("NEW_OBJECT", 1), 0x71: ("GET_FIELD", 1), 0x72: ("SET_FIELD", 1),
         0x80: ("STORE", 4), 0x81: ("LOAD", 4),
         0x90: ("LOG", 0), 0x91: ("NEWF", 0), 0x92: ("MAKEF", 0),
     }
+    # superinstructions have several operand fields
+    fused = {
+        0xA0: ("LOAD_LOAD_ADD", '<ii'), 0xA1: ("LOAD_CONST_CMP_JZ", '<iiBi'),
+        0xA2: ("CALL_N", '<ii'), 0xA3: ("TAIL_CALL_N", '<ii'),
+    }
     
     index = 0
     output = []
@@ -23,7 +29,12 @@ def parse_bytecode(bytecode: bytearray):
         opcode = bytecode[index]
         index += 1
         
-        if opcode in opcodes:
+        if opcode in fused:
+            name, fmt = fused[opcode]
+            operand = struct.unpack_from(fmt, bytecode, index)
+            index += struct.calcsize(fmt)
+            output.append((name, operand))
+        elif opcode in opcodes:
             name, operand_size = opcodes[opcode]
             operand = None
             
@@ -2,6 +2,10 @@
 #include <stdlib.h>
 #include <stdint.h>
 #include <string.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 typedef enum {
     VAL_CHAR,
@@ -100,7 +104,17 @@ typedef enum {
     // Heap Object Operations
     NEW_OBJECT  = 0x70,
     GET_FIELD   = 0x71,
-    SET_FIELD   = 0x72
+    SET_FIELD   = 0x72,
+
+    // Variables (one flat slot per variable id, this VM has no frames)
+    STORE       = 0x80,
+    LOAD        = 0x81,
+
+    // Superinstructions formed by codegen.peephole()
+    LOAD_LOAD_ADD     = 0xA0,
+    LOAD_CONST_CMP_JZ = 0xA1,
+    CALL_N            = 0xA2,
+    TAIL_CALL_N       = 0xA3
 } Opcode;
 
 GCObject* gc_alloc(uint8_t field_count) {
@@ -180,10 +194,17 @@ void gc_collect(Value* stack, int top) {
 
 #define POP() ( top > 0 ? stack[--top] : (fprintf(stderr, "Stack underflow\n"), exit(1), stack[0]) )
 
+#define VARS_SIZE 4096
+
+#define READ_I32(at) ((int32_t)(code[(at)] | (code[(at)+1] << 8) | (code[(at)+2] << 16) | ((uint32_t)code[(at)+3] << 24)))
+
+#define VAR(id) ( (id) >= 0 && (id) < VARS_SIZE ? &vars[(id)] : (fprintf(stderr, "Bad variable id %d\n", (id)), exit(1), &vars[0]) )
+
 int execute(uint8_t *code, size_t codeSize) {
     size_t pc = 0;
     Value stack[STACK_SIZE];
     int top = 0;
+    Value vars[VARS_SIZE] = {0};
 
     while (pc < codeSize) {
         uint8_t op = code[pc];
@@ -445,27 +466,27 @@ int execute(uint8_t *code, size_t codeSize) {
 
             // Control Flow
             case JUMP: {
-                if (pc + 2 >= codeSize) { fprintf(stderr, "Unexpected end in JUMP\n"); exit(1); }
-                int16_t offset = code[pc+1] | (code[pc+2] << 8);
-                pc += 3;
+                if (pc + 4 >= codeSize) { fprintf(stderr, "Unexpected end in JUMP\n"); exit(1); }
+                int32_t offset = READ_I32(pc+1);
+                pc += 5;
                 pc += offset;
                 break;
             }
             case JUMP_IF_ZERO: {
-                if (pc + 2 >= codeSize) { fprintf(stderr, "Unexpected end in JUMP_IF_ZERO\n"); exit(1); }
-                int16_t offset = code[pc+1] | (code[pc+2] << 8);
+                if (pc + 4 >= codeSize) { fprintf(stderr, "Unexpected end in JUMP_IF_ZERO\n"); exit(1); }
+                int32_t offset = READ_I32(pc+1);
                 Value cond = POP();
-                pc += 3;
+                pc += 5;
                 if (cond.type == VAL_INT && cond.i == 0) {
                     pc += offset;
                 }
                 break;
             }
             case JUMP_IF_NONZERO: {
-                if (pc + 2 >= codeSize) { fprintf(stderr, "Unexpected end in JUMP_IF_NONZERO\n"); exit(1); }
-                int16_t offset = code[pc+1] | (code[pc+2] << 8);
+                if (pc + 4 >= codeSize) { fprintf(stderr, "Unexpected end in JUMP_IF_NONZERO\n"); exit(1); }
+                int32_t offset = READ_I32(pc+1);
                 Value cond = POP();
-                pc += 3;
+                pc += 5;
                 if (cond.type == VAL_INT && cond.i != 0) {
                     pc += offset;
                 }
@@ -584,6 +605,65 @@ int execute(uint8_t *code, size_t codeSize) {
                 break;
             }
 
+            // Variables
+            case STORE: {
+                if (pc + 4 >= codeSize) { fprintf(stderr, "Unexpected end in STORE\n"); exit(1); }
+                *VAR(READ_I32(pc+1)) = POP();
+                pc += 5;
+                break;
+            }
+            case LOAD: {
+                if (pc + 4 >= codeSize) { fprintf(stderr, "Unexpected end in LOAD\n"); exit(1); }
+                PUSH(*VAR(READ_I32(pc+1)));
+                pc += 5;
+                break;
+            }
+
+            // Superinstructions
+            case LOAD_LOAD_ADD: {
+                // LOAD a; LOAD b; ADD
+                if (pc + 8 >= codeSize) { fprintf(stderr, "Unexpected end in LOAD_LOAD_ADD\n"); exit(1); }
+                Value a = *VAR(READ_I32(pc+1));
+                Value b = *VAR(READ_I32(pc+5));
+                if (a.type == VAL_INT && b.type == VAL_INT) {
+                    Value result; result.type = VAL_INT; result.i = a.i + b.i;
+                    PUSH(result);
+                } else { fprintf(stderr, "ADD supports only INT values.\n"); exit(1); }
+                pc += 9;
+                break;
+            }
+            case LOAD_CONST_CMP_JZ: {
+                // LOAD a; PUSH_INT k; <cmp>; JUMP_IF_ZERO offset
+                if (pc + 13 >= codeSize) { fprintf(stderr, "Unexpected end in LOAD_CONST_CMP_JZ\n"); exit(1); }
+                Value a = *VAR(READ_I32(pc+1));
+                int32_t k = READ_I32(pc+5);
+                uint8_t cmp = code[pc+9];
+                int32_t offset = READ_I32(pc+10);
+                int taken;
+                if (a.type != VAL_INT) taken = 0;
+                else switch (cmp) {
+                    case EQ:  taken = a.i == k; break;
+                    case NEQ: taken = a.i != k; break;
+                    case LT:  taken = a.i <  k; break;
+                    case GT:  taken = a.i >  k; break;
+                    case LE:  taken = a.i <= k; break;
+                    case GE:  taken = a.i >= k; break;
+                    default: fprintf(stderr, "Bad comparison in LOAD_CONST_CMP_JZ: %d\n", cmp); exit(1);
+                }
+                pc += 14;
+                if (!taken) {
+                    pc += offset;
+                }
+                break;
+            }
+            case CALL_N:
+            case TAIL_CALL_N:
+                // calls here go to an address (see CALL) and load() refuses code
+                // with functions, so only a hand-written program gets here
+                fprintf(stderr, "Unsupported opcode: %s, this VM has no function table\n",
+                        op == CALL_N ? "CALL_N" : "TAIL_CALL_N");
+                exit(1);
+
             default:
                 fprintf(stderr, "Unknown opcode: %d\n", op);
                 exit(1);
@@ -606,7 +686,44 @@ int execute(uint8_t *code, size_t codeSize) {
     return 0;
 }
 
-int main(void) {
+// Maps a bytecode container (see container.py) read-only and returns its code
+// section; the constant pool is skipped, this VM has no use for it. Programs
+// that declare functions are refused: their calls (CALL, or CALL_N and
+// TAIL_CALL_N once fused) go through closures and the function table, which
+// only vm.py implements.
+uint8_t *load(const char *path, size_t *codeSize) {
+    int fd = open(path, O_RDONLY);
+    struct stat st;
+    if (fd < 0 || fstat(fd, &st) < 0) { perror(path); exit(1); }
+    size_t size = st.st_size;
+    uint8_t *code = size ? mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0) : MAP_FAILED;
+    close(fd);
+    if (code == MAP_FAILED || size < 20 || memcmp(code, "OSLB", 4) != 0) {
+        fprintf(stderr, "%s: not osl bytecode\n", path); exit(1);
+    }
+    if ((code[4] | (code[5] << 8)) != 1) { fprintf(stderr, "%s: unsupported bytecode version\n", path); exit(1); }
+    uint32_t functions = READ_I32(8), constants = READ_I32(12);
+    if (functions) {
+        fprintf(stderr, "%s: declares functions, which this VM does not run (see vm.py)\n", path); exit(1);
+    }
+    size_t pos = 20;
+    for (uint32_t k = 0; k < constants && pos < size; k++) {
+        uint8_t tag = code[pos++];
+        pos += (tag == 'i' || tag == 'f') ? 8 : 4 + (uint32_t)READ_I32(pos);
+    }
+    *codeSize = (uint32_t)READ_I32(16);
+    if (pos + *codeSize != size) { fprintf(stderr, "%s: truncated bytecode\n", path); exit(1); }
+    return code + pos;
+}
+
+int main(int argc, char **argv) {
+    if (argc > 1) {
+        // ./vm bytecode.bin
+        size_t codeSize;
+        uint8_t *code = load(argv[1], &codeSize);
+        return execute(code, codeSize);
+    }
+
     /* This program computes: -( (5 + 3) * 2 / 4 ) to show arithmetic,
        then it allocates a new object with 2 fields, sets field 0 to the arithmetic
        result, and then retrieves field 0. */
@@ -640,8 +757,8 @@ int main(void) {
         DUP,
         PUSH_INT, 10, 0, 0, 0,
         LT, DUP, POP,
-        JUMP_IF_ZERO, 3, 0,
-        JUMP, 6, 0,
+        JUMP_IF_ZERO, 5, 0, 0, 0,
+        JUMP, 6, 0, 0, 0,
         PUSH_INT, 1, 0, 0, 0,
         ADD,
         HALT
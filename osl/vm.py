@@ -1,14 +1,32 @@
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Union
 import struct
+import operator
+from array import array
+from bisect import bisect_left
+import ast
+import inspect
+import textwrap
+import sys
+from container import Code, Function, load
+
+class FunObj:
+    __slots__ = ("entry", "args", "env")
+    
+    def __init__(self, entry: int, args: Optional[List[int]], env: "Environment"):
+        self.entry = entry
+        self.args = args
+        self.env = env
+    
+    def __repr__(self):
+        return f"FunObj(entry={self.entry}, args={self.args})"
 
-@dataclass
-class Value:
-    pass
+# values live on the stack unboxed
+Value = Union[int, float, str, bool, None, FunObj]
 
-@dataclass
-class Integer(Value):
-    val: int
+def to_osl(val: Value) -> Value:
+    # comparisons leave Python bools on the stack, osl shows them as 1/0
+    return int(val) if type(val) is bool else val
 
 class Environment:
     envs: List[Dict[int, Value]]
@@ -46,25 +64,16 @@ class Environment:
         new_env.envs = [dict(scope) for scope in self.envs]
         return new_env
 
-@dataclass
-class FunObj(Value):
-    entry: int
-    args: Optional[List[int]]
-    env: Environment
-
 @dataclass
 class CallFrame:
     env: Environment
     ret: int
     
-@dataclass
-class Code:
-    bytecode: bytearray
-    # env: Environment   
-
 class Opcode:
     PUSH_INT    = 0x03
+    PUSH_LONG   = 0x04
     PUSH_NONE   = 0x07
+    PUSH_CONST  = 0x09
     POP         = 0x10
     DUP         = 0x11
     ADD         = 0x20
@@ -73,38 +82,153 @@ class Opcode:
     DIV         = 0x23
     MOD         = 0x24
     NEG         = 0x25
+    BITWISE_AND = 0x31
+    BITWISE_OR  = 0x32
     EQ          = 0x40
+    NEQ         = 0x41
     LT          = 0x42
     GT          = 0x43
+    LE          = 0x44
+    GE          = 0x45
     JUMP        = 0x50
     JUMP_IF_ZERO    = 0x51
     JUMP_IF_NONZERO = 0x52
     CALL        = 0x53
     RETURN      = 0x54
     HALT        = 0x55
+    TAIL_CALL   = 0x56
     STORE       = 0x80
     LOAD        = 0x81
     ENTER_SCOPE = 0x82
     EXIT_SCOPE  = 0x83
     LOG         = 0x90
-    NEWF        = 0x91
     MAKEF       = 0x92
+    LOAD_LOAD_ADD     = 0xA0
+    LOAD_CONST_CMP_JZ = 0xA1
+    CALL_N            = 0xA2
+    TAIL_CALL_N       = 0xA3
+
+# size and struct format of the operand following an opcode in the bytecode
+OPERANDS = {
+    Opcode.PUSH_INT:        (4, '<i'),
+    Opcode.PUSH_LONG:       (8, '<q'),
+    Opcode.PUSH_CONST:      (4, '<I'),
+    Opcode.JUMP:            (4, '<i'),
+    Opcode.JUMP_IF_ZERO:    (4, '<i'),
+    Opcode.JUMP_IF_NONZERO: (4, '<i'),
+    Opcode.STORE:           (4, '<i'),
+    Opcode.LOAD:            (4, '<i'),
+    Opcode.LOAD_LOAD_ADD:     (8, '<ii'),
+    Opcode.LOAD_CONST_CMP_JZ: (13, '<iiBi'),
+    Opcode.CALL_N:            (8, '<ii'),
+    Opcode.TAIL_CALL_N:       (8, '<ii'),
+}
+# the jump offset is the last field of the operand
+JUMPS = {Opcode.JUMP, Opcode.JUMP_IF_ZERO, Opcode.JUMP_IF_NONZERO, Opcode.LOAD_CONST_CMP_JZ}
+COMPARE = {
+    Opcode.EQ: operator.eq, Opcode.NEQ: operator.ne,
+    Opcode.LT: operator.lt, Opcode.GT: operator.gt,
+    Opcode.LE: operator.le, Opcode.GE: operator.ge,
+}
+
+# opcode -> (operand size, unpack_from, kind) for the instructions that have an
+# operand; kind says how decode() treats it
+_PLAIN, _SINGLE, _JUMP, _CONST = range(4)
+UNPACK = [None] * 256
+for _op, (_size, _fmt) in OPERANDS.items():
+    UNPACK[_op] = (_size, struct.Struct(_fmt).unpack_from,
+                   _JUMP if _op in JUMPS else _CONST if _op == Opcode.PUSH_CONST
+                   else _SINGLE if len(_fmt) == 2 else _PLAIN)
+# the decoded form of every instruction without an operand
+BARE = [(_op, None) for _op in range(256)]
+
+def decode(bytecode, constants: List = ()) -> Tuple[List[Tuple[int, Optional[int]]], array]:
+    """Decode bytecode once into (opcode, operand) pairs, and return them with
+    the byte offset of every instruction (plus the end of the code) for
+    index_at(). Jump offsets become absolute instruction indices and
+    PUSH_CONST's pool index the constant itself. Operands with several fields
+    decode to tuples, LOAD_CONST_CMP_JZ's comparison opcode to the matching
+    function from `operator`.
+    bytecode may be any buffer, e.g. a memoryview of a mapped file; operands
+    are unpacked straight from it. Equal instructions share one tuple."""
+    instrs = []
+    offsets = array('I')
+    jumps = []      # indices of the jumps, whose target is still a byte offset
+    shared = {}
+    append, record, share = instrs.append, offsets.append, shared.setdefault
+    pc, end = 0, len(bytecode)
+    while pc < end:
+        op = bytecode[pc]
+        record(pc)
+        unpack = UNPACK[op]
+        if unpack is None:
+            append(BARE[op])
+            pc += 1
+            continue
+        size, unpack_from, kind = unpack
+        if pc + size >= end:
+            raise RuntimeError(f"Truncated instruction {hex(op)} at PC {pc}")
+        operand = unpack_from(bytecode, pc + 1)
+        pc += 1 + size
+        if kind == _SINGLE:
+            instr = (op, operand[0])
+            append(share(instr, instr))
+        elif kind == _PLAIN:
+            append(share((op, operand), (op, operand)))
+        elif kind == _JUMP:
+            jumps.append(len(instrs))
+            if op == Opcode.LOAD_CONST_CMP_JZ:
+                var, const, cmp, offset = operand
+                append((op, (var, const, COMPARE[cmp], offset + pc)))
+            else:
+                append((op, operand[0] + pc))
+        else:
+            # not shared: 1 and 1.0 are equal keys
+            append((op, constants[operand[0]]))
+    record(pc)
+
+    for i in jumps:
+        op, operand = instrs[i]
+        if isinstance(operand, tuple):
+            instrs[i] = (op, operand[:-1] + (index_at(offsets, operand[-1]),))
+        else:
+            instrs[i] = (op, index_at(offsets, operand))
+    return instrs, offsets
+
+def index_at(offsets: array, pos: int) -> int:
+    """The index of the instruction starting at byte offset pos."""
+    i = bisect_left(offsets, pos)
+    if i == len(offsets) or offsets[i] != pos:
+        raise RuntimeError(f"Jump target {pos} is not an instruction boundary")
+    return i
     
 class StackVM:
     def __init__(self, code: Code):
         self.code = code
+        self.instrs, offsets = decode(code.bytecode, code.constants)
         self.stack: List[Value] = []
         self.pc = 0
         self.call_stack: List[CallFrame] = []
         self.STACK_SIZE = 10000
+        self.CALL_DEPTH = sys.maxsize
+        self.steps = 0      # instructions completed by execute(max_steps)
+        self.out = None     # where LOG prints, stdout if None
         c = CallFrame(
             env=Environment(),
             ret=None)
         self.call_stack.append(c)
+        # every function of the function table exists from the start; MAKEF
+        # gives it the environment of its definition site
+        for f in code.functions:
+            # bind_call() pops the arguments last first
+            c.env.add(f.id, FunObj(index_at(offsets, f.entry), f.params[::-1], None))
+        # dispatch table: opcode -> bound handler taking (pc, operand), returning the next pc
+        self.dispatch = [self.op_unknown] * 256
+        for op, name in HANDLERS.items():
+            self.dispatch[op] = getattr(self, name)
 
     def push(self, value: Value):
-        if len(self.stack) >= self.STACK_SIZE:
-            raise RuntimeError("Stack overflow")
+        # execute() bounds the stack at CALL rather than on every push
         self.stack.append(value)
 
     def pop(self) -> Value:
@@ -118,238 +242,374 @@ class StackVM:
             raise RuntimeError("No active call frame")
         return self.call_stack[-1].env
     
-    def execute(self):
-        while self.pc < len(self.code.bytecode):
-            op = self.code.bytecode[self.pc]
-            #print(f"Opcode: {hex(op)}")
-            if op == Opcode.HALT:
-                break
-            
-            elif op == Opcode.PUSH_INT:
-                if self.pc + 4 > len(self.code.bytecode):
-                    raise RuntimeError("Invalid PUSH_INT instruction")
-                val = struct.unpack('<i', self.code.bytecode[self.pc + 1:self.pc + 5])[0] # < denotes little-endian, i denotes int
-                self.push(Integer(val))
-                self.pc += 5
-                
-            elif op == Opcode.POP:
-                self.pop()
-                self.pc += 1
-                
-            elif op == Opcode.DUP:
-                if not self.stack:
-                    raise RuntimeError("Stack underflow")
-                self.push(self.stack[-1])
-                self.pc += 1
-                
-            elif op == Opcode.ADD:
-                right = self.pop()
-                left = self.pop()
-                if isinstance(left, Integer) and isinstance(right, Integer):
-                    self.push(Integer(left.val + right.val))
-                else:
-                    raise TypeError("Invalid types for ADD")
-                self.pc += 1
-                
-            elif op == Opcode.SUB:
-                right = self.pop()
-                left = self.pop()
-                if isinstance(left, Integer) and isinstance(right, Integer):
-                    self.push(Integer(left.val - right.val))
-                else:
-                    raise TypeError("Invalid types for SUB")
-                self.pc += 1
-            
-            elif op == Opcode.MUL:
-                right = self.pop()
-                left = self.pop()
-                if isinstance(left, Integer) and isinstance(right, Integer):
-                    self.push(Integer(left.val * right.val))
-                else:
-                    raise TypeError("Invalid types for MUL")
-                self.pc += 1
-            
-            elif op == Opcode.DIV:
-                right = self.pop()
-                left = self.pop()
-                if isinstance(left, Integer) and isinstance(right, Integer):
-                    if right.val == 0:
-                        raise ZeroDivisionError("Division by zero")
-                    self.push(Integer(left.val // right.val))
-                else:
-                    raise TypeError("Invalid types for DIV")
-                self.pc += 1
-            
-            elif op == Opcode.MOD:
-                right = self.pop()
-                left = self.pop()
-                if isinstance(left, Integer) and isinstance(right, Integer):
-                    if right.val == 0:
-                        raise ZeroDivisionError("Division by zero")
-                    self.push(Integer(left.val % right.val))
-                else:
-                    raise TypeError("Invalid types for MOD")
-                self.pc += 1
-                
-            elif op == Opcode.NEG:
-                right = self.pop()
-                if isinstance(right, Integer):
-                    self.push(Integer(-right.val))
-                else:
-                    raise TypeError("Invalid type for NEG")
-                self.pc += 1
-                
-            elif op == Opcode.EQ:
-                b = self.pop()
-                a = self.pop()
-                if isinstance(a, Integer) and isinstance(b, Integer):
-                    self.push(Integer(int(a.val == b.val)))
-                else:
-                    raise TypeError("Invalid types for EQ")
-                self.pc += 1
-            
-            elif op == Opcode.LT:
-                b = self.pop()
-                a = self.pop()
-                if isinstance(a, Integer) and isinstance(b, Integer):
-                    self.push(Integer(int(a.val < b.val)))
-                else:
-                    raise TypeError("Invalid types for LT")
-
-                self.pc += 1
-
-            elif op == Opcode.GT:
-                b = self.pop()
-                a = self.pop()
-                if isinstance(a, Integer) and isinstance(b, Integer):
-                    self.push(Integer(int(a.val > b.val)))
-                else:
-                    raise TypeError("Invalid types for GT")
-
-                self.pc += 1
-            
-            elif op == Opcode.JUMP:
-                if self.pc + 2 > len(self.code.bytecode):
-                    raise RuntimeError("Invalid JUMP instruction")
-                offset = struct.unpack('<h', self.code.bytecode[self.pc + 1:self.pc + 3])[0]
-                self.pc += 3 + offset
-            
-            elif op == Opcode.JUMP_IF_ZERO:
-                if self.pc + 2 > len(self.code.bytecode):
-                    raise RuntimeError("Invalid JUMP_IF_ZERO instruction")
-                offset = struct.unpack('<h', self.code.bytecode[self.pc + 1:self.pc + 3])[0]
-                cond = self.pop()
-                if not isinstance(cond, Integer):
-                    raise TypeError("Invalid type for JUMP_IF_ZERO")
-                
-                self.pc += 3 + (offset if cond.val == 0 else 0)
-                
-            elif op == Opcode.JUMP_IF_NONZERO:
-                if self.pc + 2 > len(self.code.bytecode):
-                    raise RuntimeError("Invalid JUMP_IF_NONZERO instruction")
-                offset = struct.unpack('<h', self.code.bytecode[self.pc + 1:self.pc + 3])[0]
-                cond = self.pop()
-                if not isinstance(cond, Integer):
-                    raise TypeError("Invalid type for JUMP_IF_NONZERO")
-                
-                self.pc += 3 + (offset if cond.val != 0 else 0)
-                
-            elif op == Opcode.STORE:
-                if self.pc + 4 > len(self.code.bytecode):
-                    raise RuntimeError("Invalid STORE instruction")
-                
-                id = struct.unpack('<i', self.code.bytecode[self.pc + 1:self.pc + 5])[0]
-                val = self.pop()
-                try:
-                    self.current_env().update(id, val)
-                except ValueError:
-                    self.current_env().add(id, val)
-                self.pc += 5
-                
-            elif op == Opcode.LOAD:
-                if self.pc + 4 > len(self.code.bytecode):
-                    raise RuntimeError("Invalid LOAD instruction")
-                
-                id = struct.unpack('<i', self.code.bytecode[self.pc + 1:self.pc + 5])[0]
-                val = self.current_env().get(id)
-                self.push(val)
-                self.pc += 5
-
-            
-            elif op == Opcode.CALL:
-                """
-                The stack is as follows:
-                Function address
-                Number of arguments
-                Argument 1's val
-                ...
-                (All are 4 bytes)
-                """
-                if self.pc + 1 > len(self.code.bytecode):
-                    raise RuntimeError("Invalid CALL instruction")
-                
-                fun_id = self.pop().val
-                funObject = self.current_env().get(fun_id)
-                call_env = funObject.env.copy()
-                call_env.enter_scope()
-                num_args = self.pop().val
-
-                for it in range(num_args):
-                    val = self.pop()
-                    call_env.add(funObject.args[it], val)
-
-                self.pc += 1
-                
-                c = CallFrame(
-                    env = call_env,
-                    ret = self.pc
-                )
-                self.call_stack.append(c)
-                self.pc = funObject.entry
-                
-            elif op == Opcode.RETURN:
-                if not self.call_stack:
-                    raise RuntimeError("RETURN outside function")
-                frame = self.call_stack.pop()
-                return_value = self.pop() if self.stack else None
-                if return_value is not None:
-                    self.push(return_value)
-                self.pc = frame.ret if frame.ret is not None else len(self.code.bytecode)
-
-            elif op == Opcode.LOG:
-                if not self.stack:
-                    raise RuntimeError("No elements to print (empty stack)")
-                val = self.pop()
-                print(val.val)
-                self.pc += 1
-
-            elif op == Opcode.PUSH_NONE:
-                self.push(None)
-                self.pc += 1
-
-            elif op == Opcode.NEWF:
-                fun_id = self.pop().val
-                num_args = self.pop().val
-                args_ids = []
-                for _ in range(num_args):
-                    args_ids.append(self.pop().val)
-
-                newFunObj = FunObj(self.pc+4, args_ids, None)
-                self.current_env().add(fun_id, newFunObj)
-                self.pc += 1
-
-            elif op == Opcode.MAKEF:
-                fun_id = self.pop().val
-                funObject = self.current_env().get(fun_id)
-                
-                self.current_env().add(fun_id, funObject)
-                funObject.env = self.current_env().copy()
-                self.pc += 1
-                
+    def bind_call(self, fun_id: int, num_args: int) -> tuple[FunObj, Environment]:
+        """Pop a call's arguments, and return the callee with a fresh environment
+        holding them."""
+        funObject = self.current_env().get(fun_id)
+        call_env = funObject.env.copy()
+        call_env.enter_scope()
+
+        for it in range(num_args):
+            val = self.pop()
+            call_env.add(funObject.args[it], val)
+        return funObject, call_env
+    
+    def result(self) -> Value:
+        return to_osl(self.stack[-1]) if self.stack else None
+    
+    @property
+    def done(self) -> bool:
+        return self.pc >= len(self.instrs)
+    
+    def execute(self, max_steps: Optional[int] = None):
+        # pc indexes self.instrs, not the raw bytecode; values on the stack are
+        # plain ints, bools, None or FunObj. With max_steps, stops after that
+        # many instructions with pc, stack and call_stack as they are, and
+        # returns None unless done; the next execute() carries on from there.
+        instrs = self.instrs
+        dispatch = self.dispatch
+        pc = self.pc
+        steps = 0
+        try:
+            if max_steps is None:
+                while pc < len(instrs):
+                    op, operand = instrs[pc]
+                    pc = dispatch[op](pc, operand)
             else:
-                raise RuntimeError(f"Unknown opcode: {hex(op)} at PC {self.pc}")    
-                
-        return self.stack[-1].val if self.stack else None       
+                end = len(instrs)
+                for steps in range(max_steps):
+                    if pc >= end:
+                        break
+                    op, operand = instrs[pc]
+                    pc = dispatch[op](pc, operand)
+                else:
+                    steps = max_steps
+        finally:
+            # also when a handler raises, leaving pc at its instruction
+            self.pc = pc
+            self.steps += steps
+        return self.result() if pc >= len(instrs) else None
+    
+    # Handlers. Each one ends in a single `return <next pc>` (possibly one per
+    # if/else branch, never inside a loop) so generate_execute() can inline it.
+    
+    def op_unknown(self, pc, operand):
+        raise RuntimeError(f"Unknown opcode: {hex(self.instrs[pc][0])} at PC {pc}")
+    
+    def op_halt(self, pc, operand):
+        return len(self.instrs)
+    
+    def op_push(self, pc, operand):
+        self.stack.append(operand)
+        return pc + 1
+    
+    def op_push_none(self, pc, operand):
+        self.stack.append(None)
+        return pc + 1
+    
+    def op_pop(self, pc, operand):
+        self.stack.pop()
+        return pc + 1
+    
+    def op_dup(self, pc, operand):
+        self.stack.append(self.stack[-1])
+        return pc + 1
+    
+    def op_add(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() + right)
+        return pc + 1
+    
+    def op_sub(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() - right)
+        return pc + 1
+    
+    def op_mul(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() * right)
+        return pc + 1
+    
+    def op_div(self, pc, operand):
+        # as e(): ints divide to an int, anything else to a float
+        stack = self.stack
+        right = stack.pop()
+        left = stack.pop()
+        stack.append(left // right if isinstance(left, int) and isinstance(right, int) else left / right)
+        return pc + 1
+    
+    def op_mod(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() % right)
+        return pc + 1
+    
+    def op_neg(self, pc, operand):
+        stack = self.stack
+        stack.append(-stack.pop())
+        return pc + 1
+    
+    def op_eq(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() == right)
+        return pc + 1
+    
+    def op_neq(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() != right)
+        return pc + 1
+    
+    def op_lt(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() < right)
+        return pc + 1
+    
+    def op_gt(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() > right)
+        return pc + 1
+    
+    def op_le(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() <= right)
+        return pc + 1
+    
+    def op_ge(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() >= right)
+        return pc + 1
+    
+    def op_bitwise_and(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() & right)
+        return pc + 1
+    
+    def op_bitwise_or(self, pc, operand):
+        stack = self.stack
+        right = stack.pop()
+        stack.append(stack.pop() | right)
+        return pc + 1
+    
+    def op_jump(self, pc, operand):
+        return operand
+    
+    def op_jump_if_zero(self, pc, operand):
+        return operand if not self.stack.pop() else pc + 1
+    
+    def op_jump_if_nonzero(self, pc, operand):
+        return operand if self.stack.pop() else pc + 1
+    
+    def op_store(self, pc, operand):
+        val = self.stack.pop()
+        try:
+            self.current_env().update(operand, val)
+        except ValueError:
+            self.current_env().add(operand, val)
+        return pc + 1
+    
+    def op_load(self, pc, operand):
+        self.stack.append(self.current_env().get(operand))
+        return pc + 1
+    
+    def op_call(self, pc, operand):
+        """
+        The stack is as follows:
+        Function address
+        Number of arguments
+        Argument 1's val
+        ...
+        (All are 4 bytes)
+        """
+        if len(self.stack) >= self.STACK_SIZE or len(self.call_stack) >= self.CALL_DEPTH:
+            raise RuntimeError("Stack overflow")
+        funObject, call_env = self.bind_call(self.pop(), self.pop())
+        self.call_stack.append(CallFrame(env=call_env, ret=pc + 1))
+        return funObject.entry
+    
+    def op_tail_call(self, pc, operand):
+        # `return f(...)`: the callee takes over the current frame and
+        # returns straight to our caller, so call_stack does not grow; the
+        # operand stack still can, with values a loop leaves behind
+        if len(self.stack) >= self.STACK_SIZE:
+            raise RuntimeError("Stack overflow")
+        funObject, call_env = self.bind_call(self.pop(), self.pop())
+        self.call_stack[-1].env = call_env
+        return funObject.entry
+    
+    def op_call_n(self, pc, operand):
+        # CALL with the function id and argument count as operands
+        if len(self.stack) >= self.STACK_SIZE or len(self.call_stack) >= self.CALL_DEPTH:
+            raise RuntimeError("Stack overflow")
+        funObject, call_env = self.bind_call(*operand)
+        self.call_stack.append(CallFrame(env=call_env, ret=pc + 1))
+        return funObject.entry
+    
+    def op_tail_call_n(self, pc, operand):
+        if len(self.stack) >= self.STACK_SIZE:
+            raise RuntimeError("Stack overflow")
+        funObject, call_env = self.bind_call(*operand)
+        self.call_stack[-1].env = call_env
+        return funObject.entry
+    
+    def op_load_load_add(self, pc, operand):
+        env = self.current_env()
+        self.stack.append(env.get(operand[0]) + env.get(operand[1]))
+        return pc + 1
+    
+    def op_load_const_cmp_jz(self, pc, operand):
+        var, const, compare, target = operand
+        return pc + 1 if compare(self.current_env().get(var), const) else target
+    
+    def op_return(self, pc, operand):
+        if not self.call_stack:
+            raise RuntimeError("RETURN outside function")
+        frame = self.call_stack.pop()
+        # a returned None is dropped rather than left on the stack
+        if self.stack and self.stack[-1] is None:
+            self.stack.pop()
+        return frame.ret if frame.ret is not None else len(self.instrs)
+    
+    def op_log(self, pc, operand):
+        if not self.stack:
+            raise RuntimeError("No elements to print (empty stack)")
+        print(to_osl(self.stack.pop()), file=self.out)
+        return pc + 1
+    
+    def op_makef(self, pc, operand):
+        fun_id = self.stack.pop()
+        funObject = self.current_env().get(fun_id)
+        self.current_env().add(fun_id, funObject)
+        funObject.env = self.current_env().copy()
+        return pc + 1
+
+# opcode -> name of its StackVM handler
+HANDLERS = {
+    Opcode.HALT:            "op_halt",
+    Opcode.PUSH_INT:        "op_push",
+    Opcode.PUSH_LONG:       "op_push",
+    Opcode.PUSH_CONST:      "op_push",
+    Opcode.PUSH_NONE:       "op_push_none",
+    Opcode.POP:             "op_pop",
+    Opcode.DUP:             "op_dup",
+    Opcode.ADD:             "op_add",
+    Opcode.SUB:             "op_sub",
+    Opcode.MUL:             "op_mul",
+    Opcode.DIV:             "op_div",
+    Opcode.MOD:             "op_mod",
+    Opcode.NEG:             "op_neg",
+    Opcode.BITWISE_AND:     "op_bitwise_and",
+    Opcode.BITWISE_OR:      "op_bitwise_or",
+    Opcode.EQ:              "op_eq",
+    Opcode.NEQ:             "op_neq",
+    Opcode.LT:              "op_lt",
+    Opcode.GT:              "op_gt",
+    Opcode.LE:              "op_le",
+    Opcode.GE:              "op_ge",
+    Opcode.JUMP:            "op_jump",
+    Opcode.JUMP_IF_ZERO:    "op_jump_if_zero",
+    Opcode.JUMP_IF_NONZERO: "op_jump_if_nonzero",
+    Opcode.CALL:            "op_call",
+    Opcode.TAIL_CALL:       "op_tail_call",
+    Opcode.RETURN:          "op_return",
+    Opcode.STORE:           "op_store",
+    Opcode.LOAD:            "op_load",
+    Opcode.LOG:             "op_log",
+    Opcode.MAKEF:           "op_makef",
+    Opcode.LOAD_LOAD_ADD:     "op_load_load_add",
+    Opcode.LOAD_CONST_CMP_JZ: "op_load_const_cmp_jz",
+    Opcode.CALL_N:            "op_call_n",
+    Opcode.TAIL_CALL_N:       "op_tail_call_n",
+}
+
+class _InlineReturn(ast.NodeTransformer):
+    # `return X` -> `pc = X`; handlers only return as their last statement.
+    # self.stack and self.instrs are never rebound while executing, so they
+    # become the locals hoisted out of the loop.
+    def visit_Return(self, node):
+        self.generic_visit(node)
+        return ast.copy_location(ast.Assign([ast.Name("pc", ast.Store())], node.value), node)
+    
+    def visit_Attribute(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id == "self" and node.attr in ("stack", "instrs"):
+            return ast.copy_location(ast.Name(node.attr, node.ctx), node)
+        return self.generic_visit(node)
+    
+    def visit_Assign(self, node):
+        # drop the handlers' own `stack = self.stack`
+        self.generic_visit(node)
+        if ast.unparse(node) == "stack = stack":
+            return None
+        return node
+    
+    def visit_For(self, node):
+        assert not any(isinstance(n, ast.Return) for n in ast.walk(node)), "return inside a loop"
+        return node
+    
+    visit_While = visit_For
+
+def generate_execute(order: Optional[List[int]] = None) -> str:
+    """Emit the source of an execute() with the body of every handler in HANDLERS
+    inlined into one if/elif chain, testing opcodes in `order` first (e.g. most
+    frequent first) and the rest in table order."""
+    order = list(order or [])
+    order += [op for op in HANDLERS if op not in order]
+    chain = []
+    for k, op in enumerate(order):
+        handler = ast.parse(textwrap.dedent(inspect.getsource(getattr(StackVM, HANDLERS[op])))).body[0]
+        body = [stmt for stmt in handler.body
+                if not (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant))]  # docstrings
+        body = [stmt for stmt in map(_InlineReturn().visit, body) if stmt is not None] or [ast.Pass()]
+        chain.append(f"{'if' if k == 0 else 'elif'} op == {op:#04x}:")
+        for stmt in body:
+            chain.extend("    " + line for line in ast.unparse(ast.fix_missing_locations(stmt)).splitlines())
+    chain += [
+        "else:",
+        "    pc = self.op_unknown(pc, operand)",
+    ]
+    # the chain goes into both of execute()'s loops, with and without max_steps
+    inlined = ["                " + line for line in chain]
+    lines = [
+        "def execute(self, max_steps=None):",
+        "    instrs = self.instrs",
+        "    stack = self.stack",
+        "    pc = self.pc",
+        "    steps = 0",
+        "    try:",
+        "        if max_steps is None:",
+        "            while pc < len(instrs):",
+        "                op, operand = instrs[pc]",
+        *inlined,
+        "        else:",
+        "            end = len(instrs)",
+        "            for steps in range(max_steps):",
+        "                if pc >= end:",
+        "                    break",
+        "                op, operand = instrs[pc]",
+        *inlined,
+        "            else:",
+        "                steps = max_steps",
+        "    finally:",
+        "        self.pc = pc",
+        "        self.steps += steps",
+        "    return self.result() if pc >= len(instrs) else None",
+    ]
+    return "\n".join(lines) + "\n"
+
+def specialised_vm(order: Optional[List[int]] = None) -> type:
+    """A StackVM subclass whose execute() is generated by generate_execute(order)."""
+    namespace = dict(globals())
+    exec(compile(generate_execute(order), "<generated execute>", "exec"), namespace)
+    return type("SpecialisedStackVM", (StackVM,), {"execute": namespace["execute"]})
               
 # Example 1 (Addition: 5 + 3) 
                 
@@ -435,13 +695,9 @@ class StackVM:
 
 # Uncomment from here
 
-with open("bytecode.bin", "rb") as f:
-    inp = bytearray(f.read())
-
-code = Code(
-    bytecode=inp,
-    # env=Environment()
-)
+if __name__ == "__main__":
+    # python3 vm.py [bytecode file]; the file is mapped, not read
+    code = load(sys.argv[1] if len(sys.argv) > 1 else "bytecode.bin")
 
-stack = StackVM(code)
-result = stack.execute()
+    stack = StackVM(code)
+    result = stack.execute()
@@ -1,16 +1,26 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from collections.abc import Iterator
-from more_itertools import peekable
-from typing import List, Optional
+from typing import Callable, List, Optional
 import sys
+from sys import intern
+import operator
+import re
+import codecs
+from json.decoder import scanstring
 
 sys.setrecursionlimit(100000000)
 
 class Environment:
     envs: List
+    last_id: int    # variable ids are unique per environment, see fresh()
     
     def __init__(self):
         self.envs = [{}]
+        self.last_id = 0
+    
+    def fresh(self) -> int:
+        self.last_id += 1
+        return self.last_id
     
     def enter_scope(self):
         self.envs.append({})
@@ -29,6 +39,13 @@ class Environment:
                 return env[var]
         raise ValueError(f"Variable {var} not defined")
     
+    def locate(self, var):
+        # (depth, value) of the innermost binding, depth 0 being the global scope
+        for depth in range(len(self.envs) - 1, -1, -1):
+            if var in self.envs[depth]:
+                return depth, self.envs[depth][var]
+        raise ValueError(f"Variable {var} not defined")
+    
     def update(self, var, val):
         for env in reversed(self.envs):
             if var in env:
@@ -39,253 +56,292 @@ class Environment:
     def copy(self):
         new_env = Environment()
         new_env.envs = [dict(scope) for scope in self.envs]
+        new_env.last_id = self.last_id
         return new_env
 
-cnt = 0
-def fresh():
-    global cnt
-    cnt = cnt + 1
-    return cnt
+def trampoline(gen):
+    # Runs a pass written as a generator, where `value = yield child` has the
+    # child generator run first and sends back what it returns. Suspended
+    # parents wait on a list instead of the Python stack, so a pass over a tree
+    # of any depth needs only a few Python frames.
+    stack = []
+    value = None
+    while True:
+        try:
+            child = gen.send(value)
+        except StopIteration as stop:
+            if not stack:
+                return stop.value
+            gen = stack.pop()
+            value = stop.value
+        else:
+            stack.append(gen)
+            gen = child
+            value = None
 
-@dataclass
+@dataclass(slots=True)
 class AST:
     pass
 
-@dataclass
+@dataclass(slots=True)
 class BinOp(AST):
     op: str
     left: AST
     right: AST
 
-@dataclass
+@dataclass(slots=True)
 class Number(AST):
     val: int | float 
 
-@dataclass
+@dataclass(slots=True)
 class UnOp(AST):
     op: str
     right: AST
     
-@dataclass
+@dataclass(slots=True)
 class If(AST):
     condition: AST
     then_body: AST
     else_body: AST
 
-@dataclass
+@dataclass(slots=True)
 class IfUnM(AST):
     condition: AST
     then_body: AST
-@dataclass
+@dataclass(slots=True)
 class Let(AST):
     var: AST
     e1: Optional[AST]
 
-@dataclass
+@dataclass(slots=True)
 class Assign(AST):
     var: AST
     e1: AST
 
-@dataclass
+@dataclass(slots=True)
 class Variable(AST):
     varName: str
     id: int = None
+    depth: int = None   # lexical address assigned by resolve(): frame depth and
+    slot: int = None    # slot index within that frame
 
-@dataclass
+@dataclass(slots=True)
 class LetFun(AST):
     name: AST   # considering functions as first-class just like variables else it'll be str
     params: List[AST]
     body: AST
+    captures: dict = None   # set by resolve(): depth -> slots the body uses, for every enclosing frame
+    assigns: bool = False   # whether the body assigns one of them (nested functions aside)
 
-@dataclass
+@dataclass(slots=True)
 class CallFun(AST):
     fn: AST     # considering functions as first-class just like variables else it'll be str
     args: List[AST]
+    tail: bool = False  # set by resolve() when the call is the value of a `return`
     
-@dataclass
+@dataclass(slots=True)
 class FunObj:
     params: List[AST]
     body: AST
-    env: Environment
+    env: List[dict]     # the variables it uses of each enclosing frame, copied at definition
+    assigns: bool = False   # so every call copies them again
+
+@dataclass(slots=True)
+class TailCall:
+    # returned by a call in tail position; the nearest non-tail call runs it in its own loop
+    fun: FunObj
+    args: List
     
-@dataclass
+@dataclass(slots=True)
 class Statements(AST):
     stmts: List[AST]
+    size: int = None    # number of slots in the block's frame
     
-@dataclass
+@dataclass(slots=True)
 class PrintStmt(AST):
     expr: AST
     
-@dataclass
+@dataclass(slots=True)
 class ReturnStmt(AST):
     expr: Optional[AST]
     
-@dataclass
+@dataclass(slots=True)
 class Program(AST):
     decls: List[AST]
+    size: int = None    # number of slots in the global frame
 
 class ParseErr(Exception):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class StringLiteral(AST):
     val: str
              
-class Token:
-    pass
+# token kinds
+NUMBER, OPERATOR, KEYWORD, VARIABLE, STRING, FUNCALL = range(6)
+KIND_NAMES = ("number", "operator", "keyword", "variable", "string", "function call")
 
-@dataclass
-class NumberToken(Token):
-    val: str
-
-@dataclass
-class OperatorToken(Token):
-    op: str
+class Token:
+    # kind is one of the codes above and text is interned for everything but
+    # string literals. The token covers source[start:start + size]; size is
+    # kept rather than end because small ints are shared, so the span costs a
+    # single int object per token.
+    __slots__ = ("kind", "text", "start", "size")
     
-@dataclass
-class KeyWordToken(Token):
-    op: str
+    def __init__(self, kind: int, text: str, start: int = 0, end: int = 0):
+        self.kind = kind
+        self.text = text
+        self.start = start
+        self.size = end - start
     
-@dataclass
-class VariableToken(Token):
-    varName: str
-
-@dataclass
-class StringToken(Token):
-    val: str
-
-@dataclass
-class FunCallToken(Token):
-    funName: str
-
+    @property
+    def end(self) -> int:
+        return self.start + self.size
+    
+    def __eq__(self, other):
+        return isinstance(other, Token) and self.kind == other.kind and self.text == other.text
+    
+    def __hash__(self):
+        return hash((self.kind, self.text))
+    
+    def __repr__(self):
+        return f"Token({KIND_NAMES[self.kind]}, {self.text!r}, {self.start}:{self.end})"
+
+
+KEYWORDS = {"if", "else", "var", "in", "fn", "print", "return"}
+
+# One alternation scans the whole source. Whitespace and comments are skipped
+# in front of every token, and the group that matches names the token; a '"'
+# that does not start a complete string literal falls through to ERROR. As
+# END or ERROR match wherever the skip stops, it is never backtracked into.
+TOKEN_RE = re.compile(r"""
+    (?:\s+|//[^\n]*)*
+    (?:
+        (?P<CALL>[^\W\d]\w*)(?=\()
+      | (?P<NAME>[^\W\d]\w*)
+      | (?P<STRING>"(?:[^"\\]|\\.)*")
+      | (?P<NUMBER>\d[\d.]*)
+      | (?P<OP><=|>=|!=|\|\||&&|:=|[-+*/^()<>=%\u221a,{};])
+      | (?P<END>\Z)
+      | (?P<ERROR>.)
+    )
+""", re.VERBOSE | re.DOTALL)
 
 def lex(s: str) -> Iterator[Token]:
-    i = 0
-    prev_token = None
-
-    while True:
-        while i < len(s) and s[i].isspace():
-            i += 1
-
-        if i >= len(s):
-            return
-
-        if s[i].isalpha() or s[i] == '_':
-            start = i
-            while i < len(s) and (s[i].isalpha() or s[i].isdigit() or s[i] == '_'):
-                i += 1
-                name = s[start:i]
-
-            if name in {"if", "else", "var", "in", "fn", "print", "return"}:
-                prev_token = KeyWordToken(name)
-                yield prev_token
+    return _lex(s)
+
+def _lex(s: str, pos: int = 0, base: int = 0, more: bool = False, prev_token: Token = None) -> Iterator[Token]:
+    # lex() from s[pos:], where s starts at offset base of the source. With more,
+    # s is only what has been read so far: the scan stops in front of anything
+    # that may go on past the end of s (a token or whitespace touching it, the
+    # start of a string) and returns the index in s to resume from once more
+    # text is appended. prev_token is the token before s[pos:], if any.
+    cut = len(s) if more else -1
+
+    for m in TOKEN_RE.finditer(s, pos):
+        if m.end() == cut:
+            return m.start()
+        kind = m.lastgroup
+        text = m.group(kind)
+        start, end = m.span(kind)
+        start += base
+        end += base
+
+        if kind == "NAME" or kind == "CALL":
+            text = intern(text)
+            if text in KEYWORDS:
+                prev_token = Token(KEYWORD, text, start, end)
 
             # If preceded by `fn`, it's a function definition
-            elif isinstance(prev_token, KeyWordToken) and prev_token.op == "fn":
-                prev_token = VariableToken(name)
-                yield prev_token
+            elif prev_token is not None and prev_token.kind == KEYWORD and prev_token.text == "fn":
+                prev_token = Token(VARIABLE, text, start, end)
 
             # If followed by '(', it's a function call
-            elif i < len(s) and s[i] == "(":
-                prev_token = FunCallToken(name)
-                yield prev_token
+            elif kind == "CALL":
+                prev_token = Token(FUNCALL, text, start, end)
 
             else:
-                prev_token = VariableToken(name)
-                yield prev_token
-        
-        elif s[i] == '/' and i + 1 < len(s) and s[i + 1] == '/':
-            i += 2
-            while i < len(s) and s[i] != '\n':
-                i += 1
-        
-        elif s[i] == '"':
-            i += 1
-            start = i
-            string = ""
-            while i < len(s):
-                char = s[i]
-                if char == '"':
-                    i += 1
-                    yield StringToken(string)
-                    break
-                if char == '\\':
-                    i += 1
-                    if i >= len(s):
-                        raise ValueError("Unterminated string")
-                    escape_char = s[i]
-                    if escape_char == '"':
-                        string += '"'
-                    elif escape_char == '\\':
-                        string += '\\'
-                    elif escape_char == '/':
-                        string += '/'
-                    elif escape_char == 'b':
-                        string += '\b'
-                    elif escape_char == 'f':
-                        string += '\f'
-                    elif escape_char == 'n':
-                        string += '\n'
-                    elif escape_char == 'r':
-                        string += '\r'
-                    elif escape_char == 't':
-                        string += '\t'
-                    elif escape_char == 'u':
-                        if i + 4 >= len(s):
-                            raise ValueError("Unterminated unicode escape sequence")
-                        hex_value = s[i+1:i+5]
-                        if all(c in '0123456789abcdefABCDEF' for c in hex_value):
-                            string += chr(int(hex_value, 16))
-                            i += 4
-                        else:
-                            raise ValueError(f"Invalid unicode escape sequence at index {i}: \\u{hex_value}")
-                    else:
-                        raise ValueError(f"Invalid escape character at index {i}: \\{escape_char}")
-                else:
-                    string += char
-                i += 1
-            else:
-                raise ValueError("Unterminated string")
-        
-        elif s[i].isdigit():
-            start = i
-            while i < len(s) and (s[i].isdigit() or s[i] == '.'):
-                i += 1
-            prev_token = NumberToken(s[start:i])
+                prev_token = Token(VARIABLE, text, start, end)
             yield prev_token
 
-        else:
-            if s[i:i+2] in {"<=", ">=", "!=", "||", "&&", ":="}:
-                prev_token = OperatorToken(s[i:i+2])
-                yield prev_token
-                i += 2
-            elif s[i] in {'+', '*', '/', '^', '-', '(', ')', '<', '>', '=', '%', '\u221a', ",", "{", "}", ";"}:
-                prev_token = OperatorToken(s[i])
-                yield prev_token
-                i += 1
+        elif kind == "OP":
+            prev_token = Token(OPERATOR, intern(text), start, end)
+            yield prev_token
+
+        elif kind == "NUMBER":
+            prev_token = Token(NUMBER, intern(text), start, end)
+            yield prev_token
+
+        elif kind == "STRING":
+            if '\\' in text:
+                # the escapes are JSON's, so let the json module's scanner decode them
+                try:
+                    text = scanstring(s, start - base + 1, False)[0]
+                except ValueError as err:
+                    raise ValueError(f"Invalid escape sequence in string at index {base + err.pos}") from None
+                yield Token(STRING, text, start, end)
             else:
-                raise ParseErr(f"Unexpected character: {s[i]} at position {i}")
+                yield Token(STRING, text[1:-1], start, end)
+
+        elif kind == "END":
+            return
+
+        else:
+            if text == '"':
+                if more:
+                    return m.start()
+                raise ValueError("Unterminated string")
+            raise ParseErr(f"Unexpected character: {text} at position {start}")
     
+# binding power of the binary operators of expB; ^ groups to the right,
+# comparisons do not chain and the rest group to the left
+BINARY_PRECEDENCE = {
+    "||": 1, "&&": 1,
+    "<": 2, ">": 2, "<=": 2, ">=": 2, "=": 2, "!=": 2,
+    "+": 3, "-": 3,
+    "*": 4, "/": 4, "%": 4,
+    "^": 5,
+}
+RIGHT_ASSOCIATIVE = {"^"}
+NON_ASSOCIATIVE = {"<", ">", "<=", ">=", "=", "!="}
+
 def parse(s: str) -> AST:
-    t = peekable(lex(s))
-    i = 0
-    
-    def consume(expected_type=None, expected_value=None):
-        nonlocal i
-        token = next(t, None)
-        if token is None:
-            raise ParseErr(f"Unexpected end of input at index {i}")
-        if expected_type and not isinstance(token, expected_type):
-            raise ParseErr(f"Expected {expected_type.__name__} at index {i}, got {type(token).__name__}")
-        if expected_value:
-            actual_value = getattr(token, "op", None) or getattr(token, "varName", None) or getattr(token, "val", None)
-            if actual_value != expected_value:
-                raise ParseErr(f"Expected '{expected_value}' at index {i}, got '{actual_value}'")
-        i += 1
+    def where(token: Token = None) -> str:
+        # line and column of a token, or of the end of the input
+        pos = token.start if token is not None else len(s)
+        line = s.count("\n", 0, pos) + 1
+        column = pos - s.rfind("\n", 0, pos)
+        return f"line {line}, column {column}"
+    
+    return parse_tokens(list(lex(s)), where)
+
+def parse_tokens(tokens: List[Token], where: Callable[[Optional[Token]], str]) -> AST:
+    # the whole token stream up front, read through a cursor; where() places a
+    # token, or the end of the input, in the source for error messages
+    n = len(tokens)
+    pos = 0
+    
+    def consume(kind: int = None, text: str = None) -> Token:
+        nonlocal pos
+        if pos >= n:
+            raise ParseErr(f"Unexpected end of input at {where()}")
+        token = tokens[pos]
+        pos += 1
+        if kind is not None and token.kind != kind:
+            raise ParseErr(f"Expected {KIND_NAMES[kind]} at {where(token)}, got {KIND_NAMES[token.kind]} '{token.text}'")
+        if text is not None and token.text != text:
+            raise ParseErr(f"Expected '{text}' at {where(token)}, got '{token.text}'")
         return token
     
-    def peek():
-        return t.peek(None)
+    def peek(k: int = 0) -> Optional[Token]:
+        # the k-th token after the cursor, None past the end
+        return tokens[pos + k] if pos + k < n else None
+    
+    def at(kind: int, text: str) -> bool:
+        if pos >= n:
+            return False
+        token = tokens[pos]
+        return token.kind == kind and token.text == text
     
     def parse_program():
         decls = []
@@ -294,298 +350,533 @@ def parse(s: str) -> AST:
         return Program(decls)
     
     def parse_declaration():
-        match peek():
-            case KeyWordToken("fn"):
-                return parse_func()
-            case KeyWordToken("var"):
-                return parse_let()
-            case _:
-                return parse_statement()
+        if at(KEYWORD, "fn"):
+            return parse_func()
+        if at(KEYWORD, "var"):
+            return parse_let()
+        return parse_statement()
             
     def parse_func():
-        consume(KeyWordToken, "fn")
-        func_name = consume(VariableToken)
+        consume(KEYWORD, "fn")
+        func_name = consume(VARIABLE)
         
-        consume(OperatorToken, "(")
+        consume(OPERATOR, "(")
         args = []
-        if peek() != OperatorToken(")"):
+        if not at(OPERATOR, ")"):
             while True:
-                args.append(Variable(consume(VariableToken).varName)) # what else otherwise in the parameter list
-                if peek() == OperatorToken(","):
-                    consume(OperatorToken, ",")
+                args.append(Variable(consume(VARIABLE).text)) # what else otherwise in the parameter list
+                if at(OPERATOR, ","):
+                    consume(OPERATOR, ",")
                 else:
                     break
-        consume(OperatorToken, ")")
+        consume(OPERATOR, ")")
         
         body = parse_block()
 
-        return LetFun(Variable(func_name.varName), args, body)
+        return LetFun(Variable(func_name.text), args, body)
     
     def parse_let():
-        consume(KeyWordToken, "var")
-        var = Variable(consume(VariableToken).varName)
+        consume(KEYWORD, "var")
+        var = Variable(consume(VARIABLE).text)
         e1 = None
-        if peek() == OperatorToken(":="):
-            consume(OperatorToken, ":=")
+        if at(OPERATOR, ":="):
+            consume(OPERATOR, ":=")
             e1 = parse_expression()
-        consume(OperatorToken, ";")
+        consume(OPERATOR, ";")
         return Let(var, e1)
     
     def parse_statement():
-        match peek():
-            case KeyWordToken("if"):
-                return parse_if()
-            case KeyWordToken("print"):
-                consume(KeyWordToken, "print")
-                consume(OperatorToken, "(")
+        if at(KEYWORD, "if"):
+            return parse_if()
+        if at(KEYWORD, "print"):
+            consume(KEYWORD, "print")
+            consume(OPERATOR, "(")
+            expr = parse_expression()
+            consume(OPERATOR, ")")
+            consume(OPERATOR, ";")
+            return PrintStmt(expr)
+        if at(KEYWORD, "return"):
+            consume(KEYWORD, "return")
+            if not at(OPERATOR, ";"):
                 expr = parse_expression()
-                consume(OperatorToken, ")")
-                consume(OperatorToken, ";")
-                return PrintStmt(expr)
-            case KeyWordToken("return"):
-                consume(KeyWordToken, "return")
-                if peek() != OperatorToken(";"):
-                    expr = parse_expression()
-                else:
-                    expr = None
-                consume(OperatorToken, ";")
-                return ReturnStmt(expr)
-            case OperatorToken("{"):
-                return parse_block()
-            case _:
-                expr = parse_expression()
-                consume(OperatorToken, ";")
-                return expr
+            else:
+                expr = None
+            consume(OPERATOR, ";")
+            return ReturnStmt(expr)
+        if at(OPERATOR, "{"):
+            return parse_block()
+        expr = parse_expression()
+        consume(OPERATOR, ";")
+        return expr
         
     def parse_if():
-        consume(KeyWordToken, "if")
+        consume(KEYWORD, "if")
         condition = parse_expression()
         then_body = parse_statement()
-        if peek() == KeyWordToken("else"):
-            consume(KeyWordToken, "else")
+        if at(KEYWORD, "else"):
+            consume(KEYWORD, "else")
             else_body = parse_statement()
             return If(condition, then_body, else_body)
         return IfUnM(condition, then_body)
     
     def parse_block():
-        consume(OperatorToken, "{")
+        consume(OPERATOR, "{")
         decls = []
-        while peek() != OperatorToken("}"):
+        while not at(OPERATOR, "}"):
             decl = parse_declaration()
             decls.append(decl)
-        consume(OperatorToken, "}")
+        consume(OPERATOR, "}")
         return Statements(decls) if decls else Statements([])
     
     def parse_expression():
         # expression -> expB | assignment
         # first parse the lhs, if it's a variable and next token is ':=' then it's an assignment
         # otherwise it's an expB so return it as is.
-        ast = parse_bool()
-        if not isinstance(ast, Variable) and peek() == OperatorToken(":="):
-            raise ParseErr(f"Expected variable on the left side of assignment := operator at index {i}")
-        if isinstance(ast, Variable) and peek() == OperatorToken(":="):
-            consume(OperatorToken, ":=")
-            e1 = parse_bool()
+        ast = parse_binary()
+        if not isinstance(ast, Variable) and at(OPERATOR, ":="):
+            raise ParseErr(f"Expected variable on the left side of assignment := operator at {where(peek())}")
+        if isinstance(ast, Variable) and at(OPERATOR, ":="):
+            consume(OPERATOR, ":=")
+            e1 = parse_binary()
             return Assign(ast, e1)
         return ast
     
-    def parse_bool():
-        ast = parse_comparison()
-        while True:
-            match peek():
-                case OperatorToken("||"):
-                    consume()
-                    ast = BinOp("||", ast, parse_comparison())
-                case OperatorToken("&&"):
-                    consume()
-                    ast = BinOp("&&", ast, parse_comparison())
-                case _:
-                    return ast
-
-    def parse_comparison():
-        ast = parse_add()
-        match peek():
-            case OperatorToken(op) if op in {"<", ">", "<=", ">=", "=", "!="}:
-                consume()
-                return BinOp(op, ast, parse_add())
-            case _:
-                return ast
+    def next_op(ops) -> Optional[str]:
+        # the next token's text if it is one of the operators in ops
+        if pos < n:
+            token = tokens[pos]
+            if token.kind == OPERATOR and token.text in ops:
+                return token.text
+        return None
     
-    def parse_add():
-        ast = parse_mul()
-        while True:
-            match peek():
-                case OperatorToken('+'):
-                    consume()
-                    ast = BinOp('+', ast, parse_mul())
-                case OperatorToken('-'):
-                    consume()
-                    ast = BinOp('-', ast, parse_mul())
-                case _:
-                    return ast
- 
-    def parse_mul():
-        ast = parse_exponentiation()
-        while True:
-            match peek():
-                case OperatorToken('*'):
-                    consume()
-                    ast = BinOp("*", ast, parse_exponentiation())
-                case OperatorToken('/'):
-                    consume()
-                    ast = BinOp("/", ast, parse_exponentiation())
-                case OperatorToken("%"):
-                    consume()
-                    ast = BinOp("%", ast, parse_exponentiation())
-                case _:
-                    return ast
-    
-    def parse_exponentiation():
+    def parse_binary(min_precedence: int = 1):
+        # precedence climbing: this loop takes the operators binding at least as
+        # tightly as min_precedence, the recursive call the tighter right operand
+        nonlocal pos
         ast = parse_atom()
-        while True:
-            match peek():
-                case OperatorToken('^'):
-                    consume()
-                    ast = BinOp("^", ast, parse_exponentiation())
-                case _:
-                    return ast
+        while pos < n:
+            token = tokens[pos]
+            if token.kind != OPERATOR:
+                break
+            op = token.text
+            precedence = BINARY_PRECEDENCE.get(op, 0)
+            if precedence < min_precedence:
+                break
+            pos += 1
+            if op in RIGHT_ASSOCIATIVE:
+                ast = BinOp(op, ast, parse_binary(precedence))
+            else:
+                ast = BinOp(op, ast, parse_binary(precedence + 1))
+                if op in NON_ASSOCIATIVE and next_op(NON_ASSOCIATIVE):
+                    raise ParseErr(f"Comparisons do not chain at {where(peek())}")
+        return ast
 
     def parse_atom():
-        match peek():
-            case NumberToken(v):
-                consume()
-                val = float(v) if '.' in v else int(v)
-                return Number(val)
-            
-            case StringToken(v):
-                consume()
-                return StringLiteral(v)
-            
-            case VariableToken(varName):
-                consume()
-                return Variable(varName)
-            
-            case FunCallToken(_):
-                fn_name = consume(FunCallToken).funName
-                consume(OperatorToken, "(")
-                args = []
-                if peek() != OperatorToken(")"):
-                    while True:
-                        args.append(parse_expression())
-                        if peek() == OperatorToken(","):
-                            consume(OperatorToken, ",")
-                        else:
-                            break
-                consume(OperatorToken, ")")
-                return CallFun(Variable(fn_name), args)
-            
-            case OperatorToken('-'):
-                consume()
-                return UnOp("-", parse_atom())
-            
-            case OperatorToken('\u221a'):
-                consume()
-                return UnOp("\u221a", parse_atom())
-            
-            case OperatorToken("("):
-                consume()
-                ast = parse_expression()
-                consume(OperatorToken, ")")
-                return ast
-            case _:
-                raise ParseErr(f"Unexpected token at index {i}")
-
-    return parse_program()
+        nonlocal pos
+        token = tokens[pos] if pos < n else None
+        kind = token.kind if token is not None else None
+        
+        if kind == NUMBER:
+            pos += 1
+            v = token.text
+            val = float(v) if '.' in v else int(v)
+            return Number(val)
+        
+        if kind == STRING:
+            pos += 1
+            return StringLiteral(token.text)
+        
+        if kind == VARIABLE:
+            pos += 1
+            return Variable(token.text)
+        
+        if kind == FUNCALL:
+            fn_name = consume(FUNCALL).text
+            consume(OPERATOR, "(")
+            args = []
+            if not at(OPERATOR, ")"):
+                while True:
+                    args.append(parse_expression())
+                    if at(OPERATOR, ","):
+                        consume(OPERATOR, ",")
+                    else:
+                        break
+            consume(OPERATOR, ")")
+            return CallFun(Variable(fn_name), args)
+        
+        if kind == OPERATOR and token.text in ("-", "\u221a"):
+            consume()
+            return UnOp(token.text, parse_atom())
+        
+        if kind == OPERATOR and token.text == "(":
+            consume()
+            ast = parse_expression()
+            consume(OPERATOR, ")")
+            return ast
+        
+        raise ParseErr(f"Unexpected token at {where(token)}")
+
+    try:
+        return parse_program()
+    finally:
+        # the parse_* functions refer to each other, so they only go away with
+        # the cycle collector; drop the tokens now rather than then
+        tokens = None
+
+def parse_stream(f, chunk_size: int = 1 << 16) -> Iterator[AST]:
+    """Parse the source read from f a chunk at a time and yield each top-level
+    declaration as soon as it is complete. f is anything with read(n), giving
+    str (a text file) or UTF-8 bytes (a binary file, an mmap). Only the text
+    and tokens of the declaration being read are held, so memory does not grow
+    with the length of the source."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""            # the source from offset base on, read so far
+    base = 0
+    lines = 0           # newlines before base
+    line_start = 0      # offset just past the last of them
+    pos = 0             # where lexing resumes in buf
+    eof = False
+    prev_token = None
+    decl = []           # tokens of the declaration being read
+    depth = 0
+    complete = False    # decl ends here unless an else follows
+    
+    def where(token: Token = None) -> str:
+        # as in parse(); the declaration's text is still in buf
+        pos = (token.start if token is not None else base + len(buf)) - base
+        line = lines + buf.count("\n", 0, pos) + 1
+        newline = buf.rfind("\n", 0, pos)
+        column = pos - newline if newline >= 0 else base + pos - line_start + 1
+        return f"line {line}, column {column}"
+    
+    while True:
+        tokens = _lex(buf, pos, base, not eof, prev_token)
+        while True:
+            try:
+                token = next(tokens)
+            except StopIteration as stop:
+                pos = stop.value
+                break
+            prev_token = token
+            if complete and not (token.kind == KEYWORD and token.text == "else"):
+                yield from parse_tokens(decl, where).decls
+                decl = []
+            complete = False
+            decl.append(token)
+            if token.kind == OPERATOR:
+                if token.text in ("{", "("):
+                    depth += 1
+                elif token.text in ("}", ")"):
+                    depth -= 1
+                # a top-level declaration ends in ; or in the } of a block
+                complete = depth <= 0 and token.text in (";", "}")
+        if eof:
+            break
+        
+        # keep the text from the declaration being read on, and append a chunk
+        keep = decl[0].start - base if decl else pos
+        lines += buf.count("\n", 0, keep)
+        newline = buf.rfind("\n", 0, keep)
+        if newline >= 0:
+            line_start = base + newline + 1
+        chunk = f.read(chunk_size)
+        if isinstance(chunk, str):
+            text = chunk
+        else:
+            text = decoder.decode(chunk, final=not chunk)
+        eof = not chunk
+        buf = buf[keep:] + text
+        base += keep
+        pos -= keep
+    
+    if decl:
+        yield from parse_tokens(decl, where).decls
+
+def mark_tail_calls(body: AST) -> AST:
+    # a `return f(...)` that is the last statement of a function body ends that
+    # function, so the call can reuse the caller's slot on the Python stack.
+    # Earlier ones are left alone: like `return;`, one whose value is None
+    # carries on with the next statement, so the caller's frame is still needed.
+    # Nested functions are marked when their own LetFun is resolved
+    pending = [body]
+    while pending:
+        match pending.pop():
+            case Statements(stmts) if stmts:
+                pending.append(stmts[-1])
+            case If(_, then_body, else_body):
+                pending.append(then_body)
+                pending.append(else_body)
+            case IfUnM(_, then_body):
+                pending.append(then_body)
+            case ReturnStmt(CallFun() as call):
+                call.tail = True
+    return body
 
 def resolve(program: AST, env: Environment = None) -> AST:
+    # Every name is bound to (id, slot) where slot is its index in the frame of the
+    # scope it is declared in, so e() can address it as frames[depth][slot].
     if env is None:
         env = Environment()
     
-    def resolve_(program: AST) -> AST:
-        return resolve(program, env)
-
-    match program:
-        case Program(decls):
-            new_decls = [resolve_(decl) for decl in decls]
-            return Program(new_decls)
-        
-        case Variable(varName, _):
-            return Variable(varName, env.get(varName))
-        
-        case Number(_) as N:
-            return N
-        
-        case StringLiteral(_) as S:
-            return S
-        
-        case Let(Variable(varName, _), e1):
-            re1 = resolve_(e1) if e1 else None
-            env.add(varName, i := fresh())
-            return Let(Variable(varName, i), re1)
-        
-        case Assign(Variable(varName, _), e1):
-            re1 = resolve_(e1)
-            return Assign(Variable(varName, env.get(varName)), re1)
-        
-        case LetFun(Variable(varName, _), params, body):
-            env.add(varName, i := fresh())
-            env.enter_scope()
-            new_params = []
-            for param in params:
-                env.add(param.varName, j := fresh())
-                new_params.append(Variable(param.varName, j))
-            new_body = resolve_(body)
-            env.exit_scope()
-            return LetFun(Variable(varName, i), new_params, new_body)
-        
-        case Statements(stmts):
-            env.enter_scope()
-            stmts = [resolve_(stmt) for stmt in stmts]
-            env.exit_scope()
-            return Statements(stmts)
-        
-        case CallFun(fn, args):
-            rfn = resolve_(fn)
-            rargs = [resolve_(arg) for arg in args]
-            return CallFun(rfn, rargs)
+    def declare(varName: str) -> Variable:
+        slot = len(env.envs[-1])
+        env.add(varName, (i := env.fresh(), slot))
+        return Variable(varName, i, len(env.envs) - 1, slot)
+    
+    # [depth of its parameters, captures, assigns] of every LetFun being
+    # resolved, the innermost last
+    functions = []
+    
+    def lookup(varName: str, assigned: bool = False) -> Variable:
+        depth, (i, slot) = env.locate(varName)
+        # a variable declared outside a function is captured by it, and so by
+        # every function around it that it is outside of too
+        for fun in reversed(functions):
+            if depth >= fun[0]:
+                break
+            fun[1][depth].add(slot)
+        if assigned and functions and depth < functions[-1][0]:
+            functions[-1][2] = True
+        return Variable(varName, i, depth, slot)
+
+    def resolve_(program: AST):
+        # one node, as a generator run by trampoline()
+        match program:
+            case Program(decls):
+                new_decls = []
+                for decl in decls:
+                    new_decls.append((yield resolve_(decl)))
+                return Program(new_decls, len(env.envs[-1]))
+        
+            case Variable(varName, _):
+                return lookup(varName)
+        
+            case Number(_) as N:
+                return N
+        
+            case StringLiteral(_) as S:
+                return S
+        
+            case Let(Variable(varName, _), e1):
+                re1 = (yield resolve_(e1)) if e1 else None
+                return Let(declare(varName), re1)
+        
+            case Assign(Variable(varName, _), e1):
+                re1 = yield resolve_(e1)
+                return Assign(lookup(varName, assigned=True), re1)
+        
+            case LetFun(Variable(varName, _), params, body):
+                name = declare(varName)
+                env.enter_scope()
+                fun = [name.depth + 1, {depth: set() for depth in range(name.depth + 1)}, False]
+                functions.append(fun)
+                new_params = [declare(param.varName) for param in params]
+                new_body = mark_tail_calls((yield resolve_(body)))
+                functions.pop()
+                env.exit_scope()
+                captures = {depth: tuple(sorted(slots)) for depth, slots in fun[1].items()}
+                return LetFun(name, new_params, new_body, captures, fun[2])
+        
+            case Statements(stmts):
+                env.enter_scope()
+                new_stmts = []
+                for stmt in stmts:
+                    new_stmts.append((yield resolve_(stmt)))
+                size = len(env.envs[-1])
+                env.exit_scope()
+                return Statements(new_stmts, size)
+        
+            case CallFun(fn, args):
+                rfn = yield resolve_(fn)
+                rargs = []
+                for arg in args:
+                    rargs.append((yield resolve_(arg)))
+                return CallFun(rfn, rargs)
+        
+            case BinOp(op, left, right):
+                le = yield resolve_(left)
+                ri = yield resolve_(right)
+                return BinOp(op, le, ri)
+            case UnOp(op, right):
+                ri = yield resolve_(right)
+                return UnOp(op, ri)
+        
+            case If(condition, then_body, else_body):
+                condition = yield resolve_(condition)
+                then_body = yield resolve_(then_body)
+                else_body = yield resolve_(else_body)
+                return If(condition, then_body, else_body)
+        
+            case IfUnM(condition, then_body):
+                condition = yield resolve_(condition)
+                then_body = yield resolve_(then_body)
+                return IfUnM(condition, then_body)
+        
+            case PrintStmt(expr):
+                return PrintStmt((yield resolve_(expr)))
+        
+            case ReturnStmt(expr):
+                return ReturnStmt((yield resolve_(expr)))
+    
+    return trampoline(resolve_(program))
+
+def _div(left_val, right_val):
+    if isinstance(left_val, int) and isinstance(right_val, int):
+        return left_val // right_val
+    return left_val / right_val
+
+# the operators as plain functions, with the semantics e() gives them
+FOLD_BINOPS = {
+    "+": operator.add, "-": operator.sub, "*": operator.mul, "/": _div, "%": operator.mod,
+    "^": operator.pow,
+    "<": operator.lt, ">": operator.gt, "<=": operator.le, ">=": operator.ge,
+    "=": operator.eq, "!=": operator.ne,
+    "||": lambda l, r: l or r, "&&": lambda l, r: l and r,
+}
+FOLD_UNOPS = {
+    "-": operator.neg,
+    "\u221a": lambda r: r ** 0.5,
+}
+
+def count_nodes(tree) -> int:
+    count = 0
+    pending = [tree]
+    while pending:
+        tree = pending.pop()
+        if isinstance(tree, list):
+            pending.extend(tree)
+        elif isinstance(tree, AST):
+            count += 1
+            pending.extend(getattr(tree, f.name) for f in fields(tree))
+    return count
+
+def fold(tree: AST, stats: dict = None) -> AST:
+    """Constant folding and algebraic simplification over a resolved tree.
+    Constant operands are computed once, `if`s on a constant condition keep
+    only the branch taken, and x + 0, x - 0, 0 + x, x * 1, 1 * x and x / 1
+    become x where x is sure to be a number. Frame sizes and slots are left
+    as resolve() assigned them.
+    `stats`, if given, counts the nodes removed under "removed"."""
+    before = count_nodes(tree)
+    tree = _fold(tree) or Statements([], 0)
+    if stats is not None:
+        stats["removed"] = stats.get("removed", 0) + before - count_nodes(tree)
+    return tree
+
+def _is_int(tree: AST, val: int) -> bool:
+    # bools are ints to Python, but 0/1 from a comparison is not an identity
+    return isinstance(tree, Number) and type(tree.val) is int and tree.val == val
+
+def _is_numeric(tree: AST) -> bool:
+    # whether tree gives an int or float whatever its variables hold: "-",
+    # "/", "^" and the unary operators raise on anything else, while "+", "*"
+    # and "%" also take strings and keep bools as they are
+    match tree:
+        case Number(val):
+            return type(val) in (int, float)
+        case BinOp("-" | "/" | "^", _, _) | UnOp(_, _):
+            return True
+        case BinOp("+" | "*" | "%", left, right):
+            return _is_numeric(left) and _is_numeric(right)
+    return False
+
+def _fold(tree: AST) -> Optional[AST]:
+    # None stands for a statement that folded away entirely
+    def body(tree: AST) -> AST:
+        return _fold(tree) or Statements([], 0)
+    
+    match tree:
+        case Program(decls, size):
+            decls = list(map(_fold, decls))
+            # a program's value is that of its last declaration, so one that
+            # folded away leaves an empty block, whose value is None too
+            if decls and decls[-1] is None:
+                decls[-1] = Statements([], 0)
+            return Program([d for d in decls if d is not None], size)
+        
+        case Statements(stmts, size):
+            return Statements([s for s in map(_fold, stmts) if s is not None], size)
+        
+        case Let(var, e1):
+            return Let(var, _fold(e1) if e1 else None)
+        
+        case Assign(var, e1):
+            return Assign(var, _fold(e1))
+        
+        case LetFun(name, params, fbody, captures, assigns):
+            return LetFun(name, params, body(fbody), captures, assigns)
+        
+        case CallFun(fn, args, tail):
+            return CallFun(fn, [_fold(arg) for arg in args], tail)
+        
+        case PrintStmt(expr):
+            return PrintStmt(_fold(expr))
+        
+        case ReturnStmt(expr):
+            return ReturnStmt(_fold(expr) if expr else None)
         
         case BinOp(op, left, right):
-            le = resolve_(left)
-            ri = resolve_(right)
-            return BinOp(op, le, ri)
+            left, right = _fold(left), _fold(right)
+            if isinstance(left, Number) and isinstance(right, Number):
+                try:
+                    # keep huge powers to run time rather than compute them here
+                    if op == "^" and abs(right.val) > 256:
+                        raise OverflowError
+                    val = FOLD_BINOPS[op](left.val, right.val)
+                    if not isinstance(val, complex):
+                        return Number(val)
+                except (ArithmeticError, TypeError):
+                    pass    # left for e() to raise
+            # only where the other operand is a number: True + 0 is 1, not
+            # True, and "ab" - 0 raises
+            if _is_numeric(left):
+                if op in ("+", "-") and _is_int(right, 0) or op in ("*", "/") and _is_int(right, 1):
+                    return left
+            if _is_numeric(right):
+                if op == "+" and _is_int(left, 0) or op == "*" and _is_int(left, 1):
+                    return right
+            return BinOp(op, left, right)
+        
         case UnOp(op, right):
-            ri = resolve_(right)
-            return UnOp(op, ri)
+            right = _fold(right)
+            if isinstance(right, Number):
+                try:
+                    val = FOLD_UNOPS[op](right.val)
+                    if not isinstance(val, complex):
+                        return Number(val)
+                except (ArithmeticError, TypeError):
+                    pass
+            return UnOp(op, right)
         
         case If(condition, then_body, else_body):
-            condition = resolve_(condition)
-            then_body = resolve_(then_body)
-            else_body = resolve_(else_body)
-            return If(condition, then_body, else_body)
+            condition = _fold(condition)
+            if isinstance(condition, Number):
+                return _fold(then_body if condition.val else else_body)
+            return If(condition, body(then_body), body(else_body))
         
         case IfUnM(condition, then_body):
-            condition = resolve_(condition)
-            then_body = resolve_(then_body)
-            return IfUnM(condition, then_body)
+            condition = _fold(condition)
+            if isinstance(condition, Number):
+                return _fold(then_body) if condition.val else None
+            return IfUnM(condition, body(then_body))
         
-        case PrintStmt(expr):
-            return PrintStmt(resolve_(expr))
-        
-        case ReturnStmt(expr):
-            return ReturnStmt(resolve_(expr))
+        case _:
+            return tree
 
-def e(tree: AST, env: Environment = None) -> int | float | bool:
+def e(tree: AST, env: List[List] = None) -> int | float | bool:
+    # env is the list of live frames, env[depth][slot] being a resolved variable
     if env is None:
-        env = Environment()
-        
-    def e_(tree: AST):
-        return e(tree, env)
-    
+        env = []
+    return trampoline(_e(tree, env))
+
+def _e(tree: AST, env: List[List]):
+    # e() as a generator, see trampoline()
     match tree:
-        case Program(decls):
+        case Program(decls, size):
+            env.append([None] * size)
             res = None
             for decl in decls:
-                res = e_(decl)
+                res = yield _e(decl, env)
             return res
         
         case Number(val):
@@ -594,94 +885,278 @@ def e(tree: AST, env: Environment = None) -> int | float | bool:
         case StringLiteral(val):
             return val
         
-        case Variable(varName, i):
-            return env.get(f"{varName}:{i}")
+        case Variable(_, _, depth, slot):
+            return env[depth][slot]
         
-        case Let(Variable(varName, i), e1):
-            v1 = e_(e1) if e1 else None
-            env.add(f"{varName}:{i}", v1)
+        case Let(Variable(_, _, depth, slot), e1):
+            env[depth][slot] = (yield _e(e1, env)) if e1 else None
             return None
         
-        case Assign(Variable(varName, i), e1):
-            v1 = e_(e1)
-            env.update(f"{varName}:{i}", v1)
+        case Assign(Variable(_, _, depth, slot), e1):
+            env[depth][slot] = yield _e(e1, env)
             return None
         
-        case LetFun(Variable(varName, i), params, body):
-            # Closure -> Copy of Environment taken along with the declaration!
-            funObj = FunObj(params, body, None)
-            env.add(f"{varName}:{i}", funObj)
-            funObj.env = env.copy()
+        case LetFun(Variable(_, _, depth, slot), params, body, captures, assigns):
+            # Closure -> Copy of the variables it uses taken along with the declaration!
+            funObj = FunObj(params, body, None, assigns=assigns)
+            env[depth][slot] = funObj
+            funObj.env = [{s: frame[s] for s in slots} for frame, slots in zip(env, captures.values())]
             return None
         
-        case CallFun(Variable(varName, i), args):
-            fun = env.get(f"{varName}:{i}")
-            rargs = [e_(arg) for arg in args]
-            
-            # use the environment that was copied when the function was defined
-            call_env = fun.env.copy()
-            call_env.enter_scope()
-            for param, arg in zip(fun.params, rargs):
-                call_env.add(f"{param.varName}:{param.id}", arg)
+        case CallFun(Variable(_, _, depth, slot), args, tail):
+            fun = env[depth][slot]
+            rargs = []
+            for arg in args:
+                rargs.append((yield _e(arg, env)))
+            if tail:
+                return TailCall(fun, rargs)
             
-            rbody = e(fun.body, call_env)
-            return rbody
+            # use the variables copied when the function was defined, again
+            # copied if it assigns them; the arguments fill the parameter frame
+            # in declaration order; tail calls made by the body come back here
+            # instead of nesting
+            while True:
+                call_env = [*map(dict, fun.env), rargs] if fun.assigns else fun.env + [rargs]
+                rbody = yield _e(fun.body, call_env)
+                if type(rbody) is not TailCall:
+                    return rbody
+                fun, rargs = rbody.fun, rbody.args
         
-        case Statements(stmts):
-            env.enter_scope()
+        case Statements(stmts, size):
+            env.append([None] * size)
             res = None
-            for i, stmt in enumerate(stmts):
-                res = e_(stmt)
+            for stmt in stmts:
+                res = yield _e(stmt, env)
                 if res is not None:
-                    env.exit_scope()
+                    env.pop()
                     return res
-            env.exit_scope()
+            env.pop()
             return res
         
         case PrintStmt(expr):
-            print(e_(expr))
+            print((yield _e(expr, env)))
             return
         
         case ReturnStmt(expr):
             if expr:
-                return e_(expr)
+                return (yield _e(expr, env))
             return None
             
-        case BinOp("+", left, right): return e_(left) + e_(right)
-        case BinOp("*", left, right): return e_(left) * e_(right)
+        case BinOp("+", left, right): return (yield _e(left, env)) + (yield _e(right, env))
+        case BinOp("*", left, right): return (yield _e(left, env)) * (yield _e(right, env))
         case BinOp("/", left, right): 
-            left_val = e_(left)
-            right_val = e_(right)
+            left_val = yield _e(left, env)
+            right_val = yield _e(right, env)
             if isinstance(left_val, int) and isinstance(right_val, int):
                 return left_val // right_val
             return left_val / right_val
-        case BinOp("^", left, right): return e_(left) ** e_(right)
-        case BinOp("-", left, right): return e_(left) - e_(right)
-        case BinOp("<", left, right): return e_(left) < e_(right)
-        case BinOp(">", left, right): return e_(left) > e_(right)
-        case BinOp("<=", left, right): return e_(left) <= e_(right)
-        case BinOp(">=", left, right): return e_(left) >= e_(right)
-        case BinOp("=", left, right): return e_(left) == e_(right)
-        case BinOp("!=", left, right): return e_(left) != e_(right)
-        case BinOp("%", left, right): return e_(left) % e_(right)
-        case BinOp("||", left, right): return e_(left) or e_(right)
-        case BinOp("&&", left, right): return e_(left) and e_(right)
-        
-        case UnOp("-", right): return -e_(right)
-        case UnOp("\u221a", right): return e_(right) ** 0.5
+        case BinOp("^", left, right): return (yield _e(left, env)) ** (yield _e(right, env))
+        case BinOp("-", left, right): return (yield _e(left, env)) - (yield _e(right, env))
+        case BinOp("<", left, right): return (yield _e(left, env)) < (yield _e(right, env))
+        case BinOp(">", left, right): return (yield _e(left, env)) > (yield _e(right, env))
+        case BinOp("<=", left, right): return (yield _e(left, env)) <= (yield _e(right, env))
+        case BinOp(">=", left, right): return (yield _e(left, env)) >= (yield _e(right, env))
+        case BinOp("=", left, right): return (yield _e(left, env)) == (yield _e(right, env))
+        case BinOp("!=", left, right): return (yield _e(left, env)) != (yield _e(right, env))
+        case BinOp("%", left, right): return (yield _e(left, env)) % (yield _e(right, env))
+        case BinOp("||", left, right): return (yield _e(left, env)) or (yield _e(right, env))
+        case BinOp("&&", left, right): return (yield _e(left, env)) and (yield _e(right, env))
+        
+        case UnOp("-", right): return -(yield _e(right, env))
+        case UnOp("\u221a", right): return (yield _e(right, env)) ** 0.5
         
         case If(condition, then_body, else_body): 
-            if e_(condition):
-                return e_(then_body) 
+            if (yield _e(condition, env)):
+                return (yield _e(then_body, env)) 
             else:
-                return e_(else_body)
+                return (yield _e(else_body, env))
         
         case IfUnM(condition, then_body):
-            if e_(condition):
-                return e_(then_body)
+            if (yield _e(condition, env)):
+                return (yield _e(then_body, env))
             return None
 
 
+# one closure factory per operator, so the operator is dispatched once at compile time
+BINOPS = {
+    "+": lambda l, r: lambda env: l(env) + r(env),
+    "-": lambda l, r: lambda env: l(env) - r(env),
+    "*": lambda l, r: lambda env: l(env) * r(env),
+    "/": lambda l, r: lambda env: _div(l(env), r(env)),
+    "%": lambda l, r: lambda env: l(env) % r(env),
+    "^": lambda l, r: lambda env: l(env) ** r(env),
+    "<": lambda l, r: lambda env: l(env) < r(env),
+    ">": lambda l, r: lambda env: l(env) > r(env),
+    "<=": lambda l, r: lambda env: l(env) <= r(env),
+    ">=": lambda l, r: lambda env: l(env) >= r(env),
+    "=": lambda l, r: lambda env: l(env) == r(env),
+    "!=": lambda l, r: lambda env: l(env) != r(env),
+    "||": lambda l, r: lambda env: l(env) or r(env),
+    "&&": lambda l, r: lambda env: l(env) and r(env),
+}
+
+UNOPS = {
+    "-": lambda r: lambda env: -r(env),
+    "\u221a": lambda r: lambda env: r(env) ** 0.5,
+}
+
+def compile_to_closures(program: AST, env: List[List] = None):
+    # Walks the resolved tree once and turns every node into a Python closure over
+    # the list of live frames (same layout as e()), so node kinds and operators are
+    # matched at compile time only. Returns a callable that runs the program, on
+    # the frames in env if given.
+    
+    def c(tree: AST):
+        match tree:
+            case Program(decls, size):
+                cdecls = [c(decl) for decl in decls]
+                def program_(env):
+                    env.append([None] * size)
+                    res = None
+                    for decl in cdecls:
+                        res = decl(env)
+                    return res
+                return program_
+            
+            case Number(val) | StringLiteral(val):
+                return lambda env: val
+            
+            case Variable(_, _, depth, slot):
+                return lambda env: env[depth][slot]
+            
+            case Let(Variable(_, _, depth, slot), e1) | Assign(Variable(_, _, depth, slot), e1):
+                ce1 = c(e1) if e1 else (lambda env: None)
+                def store(env):
+                    env[depth][slot] = ce1(env)
+                return store
+            
+            case LetFun(Variable(_, _, depth, slot), params, body, captures, assigns):
+                cbody = c(body)
+                def letfun(env):
+                    funObj = FunObj(params, cbody, None, assigns=assigns)
+                    env[depth][slot] = funObj
+                    funObj.env = [{s: frame[s] for s in slots} for frame, slots in zip(env, captures.values())]
+                return letfun
+            
+            case CallFun(Variable(_, _, depth, slot), args, tail):
+                cargs = [c(arg) for arg in args]
+                match cargs:
+                    case []:
+                        args_ = lambda env: []
+                    case [a1]:
+                        args_ = lambda env: [a1(env)]
+                    case [a1, a2]:
+                        args_ = lambda env: [a1(env), a2(env)]
+                    case [a1, a2, a3]:
+                        args_ = lambda env: [a1(env), a2(env), a3(env)]
+                    case _:
+                        args_ = lambda env: [arg(env) for arg in cargs]
+                if tail:
+                    return lambda env: TailCall(env[depth][slot], args_(env))
+                def call(env):
+                    fun = env[depth][slot]
+                    args = args_(env)
+                    res = fun.body([*map(dict, fun.env), args] if fun.assigns else fun.env + [args])
+                    while type(res) is TailCall:
+                        fun, args = res.fun, res.args
+                        res = fun.body([*map(dict, fun.env), args] if fun.assigns else fun.env + [args])
+                    return res
+                return call
+            
+            case Statements(stmts, size):
+                cstmts = [c(stmt) for stmt in stmts]
+                def block(env):
+                    env.append([None] * size)
+                    for stmt in cstmts:
+                        res = stmt(env)
+                        if res is not None:
+                            env.pop()
+                            return res
+                    env.pop()
+                    return None
+                return block
+            
+            case PrintStmt(expr):
+                cexpr = c(expr)
+                def print_(env):
+                    print(cexpr(env))
+                return print_
+            
+            case ReturnStmt(expr):
+                return c(expr) if expr else (lambda env: None)
+            
+            case BinOp(op, left, right):
+                return BINOPS[op](c(left), c(right))
+            
+            case UnOp(op, right):
+                return UNOPS[op](c(right))
+            
+            case If(condition, then_body, else_body):
+                ccond, cthen, celse = c(condition), c(then_body), c(else_body)
+                return lambda env: cthen(env) if ccond(env) else celse(env)
+            
+            case IfUnM(condition, then_body):
+                ccond, cthen = c(condition), c(then_body)
+                return lambda env: cthen(env) if ccond(env) else None
+            
+            case _:
+                raise ValueError(f"Cannot compile {tree}")
+    
+    run = c(program)
+    return lambda: run([] if env is None else env)
+
+# execution engines over a resolved program, selectable by name; given the
+# frames, they run a single resolved declaration instead
+ENGINES = {
+    "tree": e,
+    "closure": lambda tree, env=None: compile_to_closures(tree, env)(),
+}
+
+def run_stream(f, engine: str = "tree", chunk_size: int = 1 << 16):
+    """Run the program read from f (see parse_stream()) one top-level
+    declaration at a time: each is resolved against the globals declared
+    before it and run as soon as it has been parsed, so its output comes
+    before the rest of the source is read. Returns the value of the last
+    declaration, like the engines on the whole program."""
+    session = Session(engine)
+    res = None
+    for decl in parse_stream(f, chunk_size):
+        res = session.execute(session.compile(Program([decl])))
+    return res
+
+class Session:
+    """Globals that outlive the programs run in them, for running a program a
+    declaration or a snippet at a time (run_stream(), osl_serve.py)."""
+    
+    def __init__(self, engine: str = "tree"):
+        self.engine = engine
+        self.env = Environment()
+        self.frame = []     # the global frame, grown in place as globals are declared
+    
+    def compile(self, program: AST) -> List[AST]:
+        """The declarations of program, resolved against the globals. If one
+        of them fails to resolve, none of their globals are kept."""
+        env = self.env
+        declared = len(env.envs[0])
+        try:
+            decls = [resolve(decl, env) for decl in program.decls]
+        except Exception:
+            del env.envs[1:]
+            for name in list(env.envs[0])[declared:]:
+                del env.envs[0][name]
+            raise
+        # make room for the new globals, in place
+        self.frame.extend([None] * (len(env.envs[0]) - len(self.frame)))
+        return decls
+    
+    def execute(self, decls: List[AST]):
+        """Runs compiled declarations in order; the value of the last one."""
+        res = None
+        for decl in decls:
+            res = ENGINES[self.engine](decl, [self.frame])
+        return res
+
+
 exp = """
 var x := 5;
 fn f(y) 
@@ -0,0 +1,256 @@
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from osl_package import Session, parse, ENGINES
+
+# A warm interpreter behind a socket, so running a snippet costs neither a
+# Python start nor the imports.
+# python3 osl_serve.py [port | unix socket path]      (default port 7327)
+#
+# The protocol is line-delimited JSON, one request and one reply per line:
+#   {"id": 1, "code": "var x := 2; print(x);", "session": "s", "engine": "tree"}
+#       runs code as declarations added to the globals of the session, which
+#       live until it is reset. Without "session", the connection's own one.
+#       "engine" picks the engine of a session being created.
+#       -> {"id": 1, "ok": true, "value": null, "output": "2\n",
+#           "compile_ms": 0.05, "execute_ms": 0.01}
+#       -> {"id": 1, "ok": false, "error": "ParseErr: ...", "output": ""}
+#   {"op": "reset", "session": "s"}     forgets the session's globals
+#   {"op": "stats"}                     the latency counters, in ms
+# A snippet that fails to parse or resolve adds none of its globals; one that
+# fails while running keeps what it did before the error.
+# Each session runs in a worker process of its own, off the event loop, so a
+# long program holds up only its session. One still running after the
+# server's timeout, or whose worker dies, is killed and its session reset:
+#       -> {"id": 1, "ok": false, "error": "Timeout: ...", "output": ""}
+# Workers of reset sessions are kept warm for the next new session.
+
+PORT = 7327
+LINE_LIMIT = 1 << 24
+TIMEOUT = 10.0              # seconds a snippet may run
+RECURSION_LIMIT = 100000    # osl_package's lets deep recursion overflow the C stack
+IDLE_WORKERS = 4
+
+class Latency:
+    # count, mean and percentiles over the last `window` samples, in ms
+    def __init__(self, window: int = 10000):
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+
+    def report(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        recent = sorted(self.recent)
+        percentile = lambda p: recent[min(len(recent) - 1, int(p * len(recent)))] * 1e3
+        return {"count": self.count, "mean": self.total / self.count * 1e3,
+                "p50": percentile(0.5), "p99": percentile(0.99), "max": recent[-1] * 1e3}
+
+def jsonable(value):
+    # function objects and the like go out as their repr
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+def run_snippet(session: Session, code: str) -> dict:
+    # in the worker; a failure while running still reports the compile time
+    out = io.StringIO()
+    timings = {}
+    try:
+        start_time = time.perf_counter()
+        decls = session.compile(parse(code))
+        compiled = time.perf_counter()
+        timings["compile_ms"] = (compiled - start_time) * 1e3
+        with contextlib.redirect_stdout(out):
+            value = session.execute(decls)
+        executed = time.perf_counter()
+    except Exception as err:
+        return {"ok": False, "error": f"{type(err).__name__}: {err}", "output": out.getvalue(), **timings}
+    return {"ok": True, "value": jsonable(value), "output": out.getvalue(), **timings,
+            "execute_ms": (executed - compiled) * 1e3}
+
+def work(conn, server: int):
+    # the worker process: runs (engine, code) requests, starting a new session
+    # when an engine is given. Forked workers hold each other's pipe ends, so
+    # one would not see EOF if the server died; it watches the server's pid.
+    sys.setrecursionlimit(RECURSION_LIMIT)
+    session = None
+    while True:
+        while not conn.poll(1.0):
+            if os.getppid() != server:
+                return
+        try:
+            engine, code = conn.recv()
+        except EOFError:
+            return
+        if engine is not None:
+            session = Session(engine)
+        conn.send(run_snippet(session, code))
+
+class Worker:
+    def __init__(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=work, args=(child, os.getpid()), daemon=True)
+        self.process.start()
+        child.close()
+        self.engine = None      # set until the first snippet starts the session
+        self.lock = asyncio.Lock()
+        self.dead = False
+
+    def run(self, code: str, timeout: float) -> dict:
+        # blocks, so it goes to an executor; a worker that overruns or dies
+        # is left dead for the caller to kill
+        self.conn.send((self.engine, code))
+        self.engine = None
+        try:
+            if self.conn.poll(timeout):
+                return self.conn.recv()
+        except (EOFError, ConnectionError):
+            self.dead = True
+            self.process.join(1)
+            return {"ok": False, "output": "",
+                    "error": f"Crashed: the worker exited with code {self.process.exitcode}, the session was reset"}
+        self.dead = True
+        return {"ok": False, "output": "", "error": f"Timeout: still running after {timeout} s, the session was reset"}
+
+    def close(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class Server:
+    def __init__(self, timeout: float = TIMEOUT):
+        self.timeout = timeout
+        self.sessions = {}      # the named ones, each a Worker
+        self.idle = []          # warm workers without a session
+        self.requests = 0
+        self.errors = 0
+        self.compile = Latency()
+        self.execute = Latency()
+
+    def new_session(self, engine: str) -> Worker:
+        worker = self.idle.pop() if self.idle else Worker()
+        worker.engine = engine
+        return worker
+
+    def drop_session(self, worker: Worker):
+        if worker.dead or len(self.idle) >= IDLE_WORKERS:
+            worker.close()
+        else:
+            worker.engine = None
+            self.idle.append(worker)
+
+    def close(self):
+        # kills every worker, named and idle; unnamed ones go with their connection
+        for worker in [*self.sessions.values(), *self.idle]:
+            worker.close()
+        self.sessions.clear()
+        self.idle.clear()
+
+    async def handle(self, request: dict, own: dict) -> dict:
+        # one request; own holds the connection's unnamed session under None
+        self.requests += 1
+        reply = {"id": request.get("id")}
+        name = request.get("session")
+        sessions = own if name is None else self.sessions
+        op = request.get("op", "run")
+        if op == "stats":
+            reply.update(ok=True, requests=self.requests, errors=self.errors, sessions=len(self.sessions),
+                         compile=self.compile.report(), execute=self.execute.report())
+            return reply
+        if op == "reset":
+            if name in sessions:
+                worker = sessions.pop(name)
+                async with worker.lock:
+                    self.drop_session(worker)
+            reply["ok"] = True
+            return reply
+        if op != "run" or not isinstance(request.get("code"), str):
+            self.errors += 1
+            reply.update(ok=False, error="Bad request: expected code to run or an op of reset or stats")
+            return reply
+
+        worker = sessions.get(name)
+        if worker is None:
+            engine = request.get("engine", "tree")
+            if engine not in ENGINES:
+                self.errors += 1
+                reply.update(ok=False, error=f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+                return reply
+            worker = sessions[name] = self.new_session(engine)
+        async with worker.lock:
+            if worker.dead:
+                # reset by a timeout while this request waited
+                return await self.handle(request, own)
+            result = await asyncio.get_running_loop().run_in_executor(None, worker.run, request["code"], self.timeout)
+            if worker.dead:
+                if sessions.get(name) is worker:
+                    del sessions[name]
+                worker.close()
+        reply.update(result)
+        if "compile_ms" in result:
+            self.compile.add(result["compile_ms"] / 1e3)
+        if result["ok"]:
+            self.execute.add(result["execute_ms"] / 1e3)
+        else:
+            self.errors += 1
+        return reply
+
+    async def client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        own = {}
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("not an object")
+                except ValueError as err:
+                    self.errors += 1
+                    reply = {"id": None, "ok": False, "error": f"Bad request: {err}"}
+                else:
+                    reply = await self.handle(request, own)
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            # gone, or a line over LINE_LIMIT
+            pass
+        finally:
+            for worker in own.values():
+                self.drop_session(worker)
+            writer.close()
+
+async def start(address: str = str(PORT), server: Server = None) -> asyncio.AbstractServer:
+    """Listens on localhost:address if it is a port number (0 for any free
+    one), else on the Unix socket at the path address."""
+    server = server or Server()
+    if address.isdigit():
+        return await asyncio.start_server(server.client, "127.0.0.1", int(address), limit=LINE_LIMIT)
+    return await asyncio.start_unix_server(server.client, address, limit=LINE_LIMIT)
+
+async def main(address: str):
+    server = Server()
+    listener = await start(address, server)
+    where = listener.sockets[0].getsockname()
+    print(f"serving on {where if isinstance(where, str) else f'{where[0]}:{where[1]}'}", file=sys.stderr, flush=True)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else str(PORT)))
+    except KeyboardInterrupt:
+        pass
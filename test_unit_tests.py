@@ -1,7 +1,33 @@
 import pytest
-from osl_package import parse, e, resolve
-from io import StringIO
+from osl_package import lex, parse, parse_stream, run_stream, resolve, e as tree_e, fold, Number, BinOp, ParseErr, ENGINES
+from io import BytesIO, StringIO
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+import os
 import sys
+import time
+import osl_serve
+
+# the compiled dialect under osl/ (keyword `log`), whose modules import each
+# other by their bare names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "osl"))
+import cache as osl_cache
+import codegen as osl_codegen
+import osl_lexer
+import container as osl_container
+import osl_parser
+import osl_eval
+import regcodegen
+import regvm
+import scheduler as osl_scheduler
+import vm as osl_vm
+from euler import EULER
+
+# Every test taking `e` runs once per execution engine
+@pytest.fixture(params=list(ENGINES))
+def e(request):
+    return ENGINES[request.param]
 
 # Fixture to capture print output
 @pytest.fixture
@@ -17,7 +43,7 @@ def capture_output():
             sys.stdout = old_stdout
     return _capture_output
 
-def test_basic_arithmetic():
+def test_basic_arithmetic(e):
     assert e(resolve(parse("2;"))) == 2
     assert e(resolve(parse("2 + 3;"))) == 5
     assert e(resolve(parse("2 + 3 * 5;"))) == 17
@@ -29,12 +55,12 @@ def test_basic_arithmetic():
     assert e(resolve(parse("10 % 3;"))) == 1
     assert e(resolve(parse("\u221a(16);"))) == 4
 
-def test_variables_and_assignment():
+def test_variables_and_assignment(e):
     assert e(resolve(parse("var x := 5; x;"))) == 5
     assert e(resolve(parse("var x := 5; x := x + 1; x;"))) == 6
     assert e(resolve(parse("var x := 10; var y := x * 2; y;"))) == 20
 
-def test_functions():
+def test_functions(e):
     assert e(resolve(parse("fn f(x) { return x + 1; } f(5);"))) == 6
     assert e(resolve(parse("fn f(x) { var y := x * 2; return y; } f(3);"))) == 6
 
@@ -44,7 +70,7 @@ fn f(x) {
 }
 f(4);
 """
-def test_function_multiline():
+def test_function_multiline(e):
     assert e(resolve(parse(func_test1))) == 16
 
 nested_func_test = """
@@ -54,7 +80,7 @@ fn f(y) {
 }
 f(3);
 """
-def test_nested_function():
+def test_nested_function(e):
     assert e(resolve(parse(nested_func_test))) == 8
 
 closure_test1 = """
@@ -99,12 +125,30 @@ var y := F(5);
 y() * y();
 """
 
-def test_closure():
+def test_closure(e):
     assert e(resolve(parse(closure_test1))) == 10
     assert e(resolve(parse(closure_test2))) == 25
     assert e(resolve(parse(closure_test3))) == 25
 
-def test_control_flow():
+closure_test4 = """
+var count := 0;
+fn inc() {
+    count := count + 1;
+    return count;
+}
+var x := 1;
+fn g() {
+    return x;
+}
+x := 2;
+inc() + inc() * 10 + g() * 100 + count * 1000;
+"""
+def test_closure_copies_variables(e):
+    # a function sees its variables as they were when it was declared, and
+    # what a call assigns to them lasts until it returns
+    assert e(resolve(parse(closure_test4))) == 111
+
+def test_control_flow(e):
     assert e(resolve(parse("if (5 > 3) 10; else 20;"))) == 10
     assert e(resolve(parse("if (5 < 3) 10; else 20;"))) == 20
     assert e(resolve(parse("var x := 15; if (x > 10) x + 1; else x - 1;"))) == 16
@@ -124,7 +168,7 @@ fn g(z)
 }
 g(0);
 """
-def test_lexical_scoping(capture_output):
+def test_lexical_scoping(capture_output, e):
     output = capture_output(lambda: e(resolve(parse(lexical_scoping_test1))))
     assert output == "5\n5\n5"
     
@@ -144,15 +188,34 @@ var x := 5;
 x;
 """
 
-def test_block_scope():
+def test_block_scope(e):
     assert e(resolve(parse(block_test1))) == 10
     assert e(resolve(parse(block_test2))) == 5
 
+slots_test = """
+var x := 5;
+fn f(y) {
+    var z := y;
+    return x + z;
+}
+f(1);
+"""
+def test_resolved_slots():
+    program = resolve(parse(slots_test))
+    x, f, _ = program.decls
+    body = f.body.stmts[1].expr
+    assert (x.var.depth, x.var.slot) == (0, 0)
+    assert (f.name.depth, f.name.slot) == (0, 1)
+    assert (f.params[0].depth, f.params[0].slot) == (1, 0)
+    assert (body.left.depth, body.left.slot) == (0, 0)
+    assert (body.right.depth, body.right.slot) == (2, 0)
+    assert program.size == 2 and f.body.size == 1
+
 print_test1 = """
 var x := 42;
 print(x);
 """
-def test_print_simple(capture_output):
+def test_print_simple(capture_output, e):
     output = capture_output(lambda: e(resolve(parse(print_test1))))
     assert output == "42\nNone"
 
@@ -162,7 +225,7 @@ fn f(x) {
 }
 f(5);
 """
-def test_print_function(capture_output):
+def test_print_function(capture_output, e):
     output = capture_output(lambda: e(resolve(parse(print_test2))))
     assert output == "10\nNone"
 
@@ -173,17 +236,134 @@ fn fact(n) {
 }
 fact(5);
 """
-def test_recursion():
+def test_recursion(e):
     assert e(resolve(parse(factorial_test))) == 120
 
-def test_complex_expressions():
+tail_call_test = """
+fn F(x, s) {
+    if (x = 20000) return s;
+    return F(x + 1, s + x);
+}
+F(0, 0);
+"""
+def test_tail_calls(e):
+    # tail recursion must not grow the Python stack
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000)
+    try:
+        assert e(resolve(parse(tail_call_test))) == 199990000
+    finally:
+        sys.setrecursionlimit(limit)
+
+return_none_test = """
+fn nothing() {
+    return;
+}
+fn f(x) {
+    if (x = 1) return;
+    if (x = 2) return nothing();
+    return 7;
+}
+f(1) * 10 + f(2);
+"""
+def test_return_none(e):
+    # a return whose value is None carries on with the next statement,
+    # whether it is `return;` or a call that gives None
+    assert e(resolve(parse(return_none_test))) == 77
+    assert e(resolve(parse(return_none_test.replace("f(1) * 10 + f(2);", "fn g() { return nothing(); } g();")))) is None
+
+def test_deep_trees():
+    # resolve() and the tree engine keep their own stack, the depth of the
+    # program does not reach the Python stack
+    deep_expression = " + ".join(["1"] * 20000) + ";"
+    deep_recursion = """
+fn depth(n) {
+    if (n = 0) return 0;
+    return 1 + depth(n - 1);
+}
+depth(20000);
+"""
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000)
+    try:
+        assert tree_e(resolve(parse(deep_expression))) == 20000
+        assert tree_e(resolve(parse(deep_recursion))) == 20000
+    finally:
+        sys.setrecursionlimit(limit)
+
+def test_complex_expressions(e):
     assert e(resolve(parse("2 + 3 * (5 - 2) / 1.5;"))) == 8.0
     assert e(resolve(parse("fn f(x) { return x * \u221a(4); } f(3);"))) == 6
 
-def test_edge_cases():
+def test_edge_cases(e):
     assert e(resolve(parse("0 / 1;"))) == 0
     assert e(resolve(parse("-0;"))) == 0
     assert e(resolve(parse("var x := 0; x := x + 0; x;"))) == 0
+
+def test_tokens_and_error_positions():
+    fn, name = list(lex("fn  f(x)"))[:2]
+    assert (fn.text, fn.start, fn.end) == ("fn", 0, 2)
+    assert (name.text, name.start, name.end) == ("f", 4, 5)
+    with pytest.raises(ParseErr, match="line 2, column 10"):
+        parse("var x := 1;\nvar y := ;")
+    with pytest.raises(ParseErr, match="Expected variable at line 1, column 6"):
+        parse("fn f(1) {}")
+
+def test_precedence(e):
+    assert e(resolve(parse("2 ^ 3 ^ 2;"))) == 512
+    assert e(resolve(parse("2 - 3 - 4 * 2 ^ 2 % 5;"))) == -2
+    assert e(resolve(parse("1 + 1 = 2 && 3 < 4;"))) == 1
+    assert parse("1 || 2 = 3;").decls == [BinOp("||", Number(1), BinOp("=", Number(2), Number(3)))]
+    with pytest.raises(ParseErr, match="do not chain"):
+        parse("1 < 2 < 3;")
+
+def test_compact_nodes():
+    # AST nodes carry their fields in slots, without a __dict__ each
+    program = resolve(parse("var x := 1; print(x + 2);"))
+    nodes = [program, *program.decls, program.decls[1].expr]
+    assert not any(hasattr(node, "__dict__") for node in nodes)
+    with pytest.raises(AttributeError):
+        program.decls[0].extra = 1
+
+def test_string_escapes(capture_output):
+    # escapes are JSON's; a token's span covers the literal as written
+    for lexer in (lex, osl_lexer.lex):
+        src = r'x := "a\n\"q\"\\ é"; y := "// kept"; // skipped'
+        assert [(t.text, t.start, t.end) for t in lexer(src)] == [
+            ("x", 0, 1), (":=", 2, 4), ('a\n"q"\\ é', 5, 19), (";", 19, 20),
+            ("y", 21, 22), (":=", 23, 25), ("// kept", 26, 35), (";", 35, 36)]
+        with pytest.raises(ValueError, match="Invalid escape sequence in string at index 2"):
+            list(lexer(r'"a\q"'))
+        with pytest.raises(ValueError, match="Unterminated string"):
+            list(lexer('x := "abc'))
+    assert capture_output(lambda: tree_e(resolve(parse(r'print("tab\there");')))) == "tab\there\nNone"
+
+fold_test = """
+var x := 7;
+fn f(y) {
+    if (1 < 2) return y * 1 + (2 + 3) * 0;
+    return 99;
+}
+if (0) print(x); else x := x + 0;
+f(x - 0) + 10 / 4 + 10.0 / 4;
+"""
+def test_fold(e, capture_output):
+    stats = {}
+    program = fold(resolve(parse(fold_test)), stats)
+    assert e(program) == e(resolve(parse(fold_test))) == 11.5
+    assert stats["removed"] == 16
+    assert fold(resolve(parse("\u221a(16) * 2 - -3;"))).decls == [Number(11.0)]
+    assert fold(resolve(parse("var y := 2; (y - 1) * 1 + 0;"))).decls[1].op == "-"
+    # no folding where e() would fail or the types would change
+    assert type(e(fold(resolve(parse("var t := 1 < 2; t + 0;"))))) is int
+    assert capture_output(lambda: e(fold(resolve(parse("var b := 3 < 4; print(b * 1);"))))) == "1\nNone"
+    with pytest.raises(TypeError):
+        e(fold(resolve(parse('var n := "ab"; n - 0;'))))
+    # a last statement that folds away still gives the program its value
+    for src in ("5; if (0) print(1);", "5; if (0) print(1); else if (0) 2;", "if (1) 5; else 6;"):
+        assert e(fold(resolve(parse(src)))) == e(resolve(parse(src)))
+    with pytest.raises(ZeroDivisionError):
+        e(fold(resolve(parse("1 / 0;"))))
     
 euler_p1 = """
 fn F(x, s) {
@@ -232,8 +412,352 @@ fn F(i, j, maxPal) {
 F(999, 999, 0);
 """
 
-def test_euler():
+def test_euler(e):
     assert e(resolve(parse(euler_p1))) == 233168
     assert e(resolve(parse(euler_p2))) == 4613732
     assert e(resolve(parse(euler_p3))) == 6857
-    assert e(resolve(parse(euler_p4))) == 906609
\ No newline at end of file
+    assert e(resolve(parse(euler_p4))) == 906609
+
+stream_test = """
+var x := 2;
+fn f(y) { return x + y; }
+x := f(3); print(x);
+if (x = 1) { print("one"); } else if (x = 5) print("f\u00e9ve"); // five
+else print(x);
+{ var x := 10; print(x); }
+x;
+"""
+def test_stream(capture_output):
+    # declarations run one by one as they are read, with the same results
+    # however the source is cut into chunks
+    for engine in ENGINES:
+        want = capture_output(lambda: ENGINES[engine](resolve(parse(stream_test))))
+        assert want == "5\nf\u00e9ve\n10\n5"
+        for chunk_size in (1, 3, 1000):
+            assert capture_output(lambda: run_stream(StringIO(stream_test), engine, chunk_size)) == want
+            assert capture_output(lambda: run_stream(BytesIO(stream_test.encode()), engine, chunk_size)) == want
+    assert len(list(parse_stream(StringIO(stream_test), 2))) == 7
+    with pytest.raises(ParseErr, match="line 2, column 10"):
+        list(parse_stream(StringIO("var x := 1;\nvar y := ;"), 4))
+
+def test_serve():
+    # snippets sent to the server build on the globals of their session
+    async def session():
+        server = osl_serve.Server()
+        listener = await osl_serve.start("0", server)
+        port = listener.sockets[0].getsockname()[1]
+        connections = [await asyncio.open_connection("127.0.0.1", port) for _ in range(2)]
+        async def send(i, **request):
+            reader, writer = connections[i]
+            writer.write(json.dumps(request).encode() + b"\n")
+            return json.loads(await reader.readline())
+        try:
+            r = await send(0, id=1, code="var x := 2; fn f(y) { return x * y; }")
+            assert r["ok"] and r["id"] == 1 and r["compile_ms"] >= 0 and r["execute_ms"] >= 0
+            # globals live on between snippets; f keeps the x it was declared with
+            r = await send(0, code="x := x + 1; print(f(10)); x;")
+            assert (r["output"], r["value"]) == ("20\n", 3)
+            # a snippet that does not resolve declares nothing
+            assert "not defined" in (await send(0, code="var z := 1; fn g() { return h; }"))["error"]
+            assert "not defined" in (await send(0, code="z;"))["error"]
+            # the connection's own session is its alone, named ones are shared
+            assert "not defined" in (await send(1, code="x;"))["error"]
+            await send(0, session="s", engine="closure", code="var w := 5;")
+            assert (await send(1, session="s", code="w * 2;"))["value"] == 10
+            await send(1, op="reset", session="s")
+            assert not (await send(0, session="s", code="w;"))["ok"]
+            stats = await send(1, op="stats")
+            assert stats["compile"]["count"] == stats["execute"]["count"] == 4 and stats["errors"] == 4
+        finally:
+            for _, writer in connections:
+                writer.close()
+            listener.close()
+            await listener.wait_closed()
+            server.close()
+    asyncio.run(session())
+
+def test_serve_limits():
+    # a snippet that runs away is killed at the timeout and its session reset,
+    # while other clients are served; deep recursion fails without a crash
+    async def session():
+        server = osl_serve.Server(timeout=1.0)
+        listener = await osl_serve.start("0", server)
+        port = listener.sockets[0].getsockname()[1]
+        connections = [await asyncio.open_connection("127.0.0.1", port) for _ in range(2)]
+        async def send(i, **request):
+            reader, writer = connections[i]
+            writer.write(json.dumps(request).encode() + b"\n")
+            return json.loads(await reader.readline())
+        try:
+            await send(0, code="var x := 1;")
+            start_time = time.perf_counter()
+            runaway = asyncio.create_task(send(0, code="fn f(n) { return f(n + 1); } f(0);"))
+            await asyncio.sleep(0.1)
+            assert (await send(1, code="6 * 7;"))["value"] == 42
+            assert time.perf_counter() - start_time < 1.0
+            r = await runaway
+            assert not r["ok"] and r["error"].startswith("Timeout")
+            assert "not defined" in (await send(0, code="x;"))["error"]
+            r = await send(1, session="c", engine="closure",
+                           code="fn g(n) { if n = 0 { return 0; } return 1 + g(n - 1); } g(1000000);")
+            assert r["error"].startswith("RecursionError")
+            assert (await send(1, session="c", code="g(100);"))["value"] == 100
+        finally:
+            for _, writer in connections:
+                writer.close()
+            listener.close()
+            await listener.wait_closed()
+            server.close()
+    asyncio.run(session())
+
+def test_bytecode_unsupported():
+    # operators the bytecode has no instructions for fail to compile
+    for src, op in (("var x := 3; log x ^ 2;", "\\^"), ("var x := 4; log \u221a(x);", "\u221a")):
+        with pytest.raises(osl_codegen.CompileError, match=f"The {op} operator"):
+            osl_codegen.CompilationUnit().compile(src)
+
+def osl_e(src):
+    return osl_eval.e(osl_parser.resolve(osl_parser.parse(src)))
+
+def run_register(src):
+    return regvm.RegisterVM(regcodegen.reg_codegen(osl_parser.fold(osl_parser.resolve(osl_parser.parse(src))))).execute()
+
+register_order_test = """
+fn h(a, b) { return a * 100 + b; }
+fn f() {
+    var x := 1;
+    fn g() { x := 10; return 0; }
+    log x + g();
+    x := 1;
+    log h(x, g());
+}
+f();
+"""
+def test_register_vm(capture_output):
+    # the register backend computes what e() does; Problem 4 takes too long here
+    programs = [src for label, (src, _) in EULER.items() if label != "Problem 4"]
+    programs += [closure_test1, closure_test3, factorial_test, tail_call_test, register_order_test,
+                 'var s := "ab"; log s;']
+    for src in programs:
+        want = capture_output(lambda: osl_e(src))
+        assert capture_output(lambda: run_register(src)) == want.replace("True", "1").replace("False", "0")
+    # operands are read in order, before later ones can assign to them
+    assert capture_output(lambda: run_register(register_order_test)).split() == ["1", "100", "None"]
+    with pytest.raises(osl_codegen.CompileError, match="The \\^ operator"):
+        run_register("var x := 2; log x ^ 2;")
+
+def run_stack(src, vm=osl_vm.StackVM):
+    return vm(osl_codegen.CompilationUnit().compile(src)).execute()
+
+def run_specialised(src):
+    return run_stack(src, osl_vm.specialised_vm())
+
+division_test = """
+var x := 7.0;
+var y := 7;
+log x / 2;
+log y / 2;
+log y / 2.0;
+"""
+def test_vm_division(capture_output):
+    # both VMs divide as e() does: floor division of ints only
+    want = capture_output(lambda: osl_e(division_test))
+    assert want.split() == ["3.5", "3", "3.5", "None"]
+    for engine in (run_stack, run_specialised, run_register):
+        assert capture_output(lambda: engine(division_test)) == want
+
+leaking_loop_test = """
+fn f(n) {
+    n;
+    return f(n + 1);
+}
+f(0);
+"""
+runaway_test = """
+fn loop(n) {
+    return loop(n + 1);
+}
+loop(0);
+"""
+deep_test = """
+fn deep(n) {
+    return 1 + deep(n + 1);
+}
+log deep(0);
+"""
+def test_scheduler(capture_output):
+    compile_code = osl_codegen.CompilationUnit().compile
+    long, short = compile_code(EULER["Problem 2"][0]), compile_code(factorial_test)
+    # run in turns of a few instructions, a program does just what it does in one go
+    for code in (long, short):
+        want = capture_output(lambda: osl_vm.StackVM(code).execute())
+        sched = osl_scheduler.Scheduler(quantum=7)
+        task = sched.spawn(code)
+        sched.run()
+        assert task.state == osl_scheduler.DONE
+        assert task.output.strip() + "\n" + str(task.result) == want
+    # the short program finishes within its first turns, queued after the long one
+    sched = osl_scheduler.Scheduler(quantum=50)
+    tasks = [sched.spawn(long, "long"), sched.spawn(short, "short")]
+    finished = []
+    while sched.ready:
+        task = sched.ready.popleft()
+        sched.step(task)
+        if task.state == osl_scheduler.READY:
+            sched.ready.append(task)
+        else:
+            finished.append(task.name)
+    assert finished == ["short", "long"]
+    assert tasks[1].vm.steps < tasks[0].vm.steps
+    # a task past its limits fails there, with the instructions it ran, and the others carry on
+    sched = osl_scheduler.Scheduler(quantum=1000)
+    loop = sched.spawn(compile_code(leaking_loop_test), max_steps=10 ** 6, stack_size=100)
+    deep = sched.spawn(compile_code(deep_test), call_depth=50)
+    runaway = sched.spawn(compile_code(runaway_test), max_steps=5000)
+    fine = sched.spawn(short)
+    sched.run()
+    assert (loop.state, loop.error) == (osl_scheduler.FAILED, "RuntimeError: Stack overflow")
+    assert len(loop.vm.stack) <= 100
+    assert (deep.state, deep.error) == (osl_scheduler.FAILED, "RuntimeError: Stack overflow")
+    assert len(deep.vm.call_stack) == 50
+    assert (runaway.state, runaway.error) == (osl_scheduler.FAILED, "Step limit of 5000 reached")
+    assert runaway.vm.steps == 5000
+    assert (fine.state, fine.result) == (osl_scheduler.DONE, 120)
+    for task, size, depth in ((loop, 100, sys.maxsize), (deep, 10000, 50)):
+        for vm_class in (osl_vm.StackVM, osl_vm.specialised_vm()):
+            vm = vm_class(task.vm.code)
+            vm.STACK_SIZE, vm.CALL_DEPTH = size, depth
+            with pytest.raises(RuntimeError, match="Stack overflow"):
+                vm.execute(10 ** 6)
+            assert (vm.steps, vm.pc) == (task.vm.steps, task.vm.pc)
+
+def test_vm_closures():
+    # the engines agree on what a closure copies
+    for engine in (osl_e, run_stack, run_specialised, run_register):
+        assert engine(closure_test4) == 111
+
+def test_cache(tmp_path):
+    src = EULER["Problem 1"][0] + "log 1 < 2;"
+    cache = osl_cache.CompileCache(str(tmp_path))
+    miss = cache.compile(src)
+    assert cache.load(cache.path(src)) is not None
+    hit = cache.compile(src)
+    # a hit gives what compiling again would, down to the types of the constants
+    want = osl_codegen.CompilationUnit().compile(src)
+    for tree, stats, code in (miss, hit):
+        assert repr(tree) == repr(hit[0]) and stats == hit[1]
+        assert code.to_bytes() == want.to_bytes()
+        assert [(type(c), c) for c in code.constants] == [(type(c), c) for c in want.constants]
+    assert bool not in {type(c) for c in want.constants}
+    # a damaged entry is compiled and written again
+    path = cache.path(src)
+    size = os.path.getsize(path)
+    for damage in (lambda data: data[:len(data) // 2], lambda data: b"XXXX" + data[4:]):
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(damage(data))
+        assert cache.load(path) is None
+        tree, stats, code = cache.compile(src)
+        assert repr(tree) == repr(miss[0]) and code.to_bytes() == want.to_bytes()
+        assert os.path.getsize(path) == size
+    # entries unused for max_age go, then the least recently used past max_bytes
+    old = cache.path("log 1;")
+    cache.compile("log 1;")
+    os.utime(old, (0, 0))
+    cache.compile("log 2;")
+    assert not os.path.exists(old) and os.path.exists(path)
+    small = osl_cache.CompileCache(str(tmp_path), max_bytes=size + os.path.getsize(cache.path("log 2;")))
+    os.utime(cache.path("log 2;"), (1, 1))
+    small.compile("log 3;")
+    assert not os.path.exists(cache.path("log 2;"))
+    assert os.path.exists(path) and os.path.exists(cache.path("log 3;"))
+
+def test_compilation_unit():
+    # a unit compiles each program from scratch, so reusing one, or compiling
+    # on several threads with one unit each, gives what a fresh unit does
+    sources = [src for label, (src, _) in EULER.items() if label != "Problem 4"] + [factorial_test, closure_test4]
+    want = [osl_codegen.CompilationUnit().compile(src).to_bytes() for src in sources]
+    unit = osl_codegen.CompilationUnit()
+    for src, code in zip(sources, want):
+        assert unit.compile(src).to_bytes() == code
+        assert unit.compile(src).to_bytes() == code
+    assert len(unit.compile(factorial_test).functions) == 1
+    with ThreadPoolExecutor(4) as pool:
+        compiled = pool.map(lambda src: osl_codegen.CompilationUnit().compile(src).to_bytes(), sources * 20)
+        assert list(compiled) == want * 20
+
+def test_peephole(capture_output):
+    # fused and plain bytecode give the same output and result
+    fired = {}
+    for src in [src for label, (src, _) in EULER.items() if label != "Problem 4"] + [factorial_test, tail_call_test]:
+        plain = osl_codegen.codegen(osl_parser.fold(osl_parser.resolve(osl_parser.parse(src))), fuse=False)
+        fused = osl_codegen.peephole(plain, fired)
+        assert len(fused.bytecode) < len(plain.bytecode)
+        assert capture_output(lambda: osl_vm.StackVM(fused).execute()) == \
+               capture_output(lambda: osl_vm.StackVM(plain).execute())
+    assert set(fired) == {"LOAD_LOAD_ADD", "LOAD_CONST_CMP_JZ", "CALL_N", "TAIL_CALL_N"}
+    # LOAD 1; LOAD 2; ADD is fused unless a jump lands inside it
+    load_load_add = bytes([osl_codegen.LOAD, 1, 0, 0, 0, osl_codegen.LOAD, 2, 0, 0, 0, osl_codegen.ADD, osl_codegen.HALT])
+    for offset, fuses in ((0, True), (5, False)):
+        code = bytes([osl_codegen.JUMP, offset, 0, 0, 0]) + load_load_add
+        fused = osl_codegen.peephole(osl_codegen.Code(code, [], []))
+        assert (osl_codegen.LOAD_LOAD_ADD in fused.bytecode) == fuses
+        if not fuses:
+            assert bytes(fused.bytecode) == code
+
+constants_test = """
+log "héllo";
+log 2.5;
+log 1099511627776;
+log 1180591620717411303424;
+log -1180591620717411303424;
+"""
+def test_container(capture_output):
+    # jumping over the branch takes an offset wider than 16 bits
+    wide_jump_test = "var x := 0;\nif (x = 1) {\n" + "x := x + 1;\n" * 10000 + "}\nlog x;\n"
+    for src in (EULER["Problem 1"][0], closure_test4, constants_test, wide_jump_test):
+        code = osl_codegen.CompilationUnit().compile(src)
+        data = code.to_bytes()
+        for back in (osl_container.Code.from_bytes(data), osl_container.Code.from_bytes(memoryview(data))):
+            assert bytes(back.bytecode) == bytes(code.bytecode) and back.functions == code.functions
+            assert [(type(c), c) for c in back.constants] == [(type(c), c) for c in code.constants]
+            assert back.to_bytes() == data
+            assert capture_output(lambda: osl_vm.StackVM(back).execute()) == \
+                   capture_output(lambda: osl_vm.StackVM(code).execute())
+    assert len(code.bytecode) > 1 << 17
+    assert capture_output(lambda: osl_vm.StackVM(back).execute()) == "0\nNone"
+    assert len(osl_codegen.CompilationUnit().compile(closure_test4).functions) == 2
+    assert {type(c) for c in osl_codegen.CompilationUnit().compile(constants_test).constants} == {str, float, int}
+    for bad, error in ((b"XXXX" + data[4:], "bad magic"), (data[:4] + b"\x07" + data[5:], "version 7"),
+                       (data[:-1], "the header says")):
+        with pytest.raises(ValueError, match=error):
+            osl_container.Code.from_bytes(bad)
+
+def test_load(tmp_path, capture_output):
+    # a program mapped from a file runs as the in-memory one does
+    for k, src in enumerate((EULER["Problem 2"][0], closure_test4, constants_test)):
+        code = osl_codegen.CompilationUnit().compile(src)
+        path = tmp_path / f"program{k}.bin"
+        path.write_bytes(code.to_bytes())
+        mapped = osl_container.load(str(path))
+        assert isinstance(mapped.bytecode, memoryview)
+        assert capture_output(lambda: osl_vm.StackVM(mapped).execute()) == \
+               capture_output(lambda: osl_vm.StackVM(code).execute())
+
+def test_vm_tail_calls():
+    # TAIL_CALL reuses the caller's frame: 100000 levels of tail recursion
+    # run under a call depth of 2, call_stack holding the top level's frame
+    # and the one call's throughout
+    code = osl_codegen.CompilationUnit().compile(tail_call_test.replace("20000", "100000"))
+    for vm_class in (osl_vm.StackVM, osl_vm.specialised_vm()):
+        vm = vm_class(code)
+        vm.CALL_DEPTH = 2
+        deepest = 0
+        while (result := vm.execute(1000)) is None and not vm.done:
+            deepest = max(deepest, len(vm.call_stack))
+        assert result == 4999950000 and deepest == 2
+    with pytest.raises(RuntimeError, match="Stack overflow"):
+        vm = osl_vm.StackVM(osl_codegen.CompilationUnit().compile(deep_test))
+        vm.CALL_DEPTH = 2
+        vm.execute()